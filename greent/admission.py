@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+from greent.util import LoggingUtil
+
+logger = LoggingUtil.init_logging (__name__, level=logging.DEBUG)
+
+class ServiceUnavailable(Exception):
+    """ Raised instead of making a call to a service whose circuit is open, or that failed to load. """
+    def __init__(self, service, retry_at=None, reason=None):
+        if retry_at is not None:
+            message = "Service {0} is unavailable; calls are skipped for {1:.1f}s".format (
+                service, max (0, retry_at - time.time ()))
+        else:
+            message = "Service {0} is unavailable: {1}".format (service, reason)
+        super(ServiceUnavailable, self).__init__(message)
+        self.service = service
+        self.retry_at = retry_at
+        self.reason = reason
+
+class ServiceLimiter:
+    """ Admit calls to one service. The number of calls allowed in flight adapts to how the service is
+    doing: it grows additively, by about one per limit's worth of calls completing within latency_target
+    seconds, and shrinks multiplicatively by decrease when a call fails or is slow, between min_concurrency
+    and max_concurrency. Shrinking happens at most once per cooldown seconds so a burst of failures from
+    one window of calls counts once.
+
+    A circuit breaker sits in front of that. After failure_threshold consecutive failures the circuit opens
+    and calls fail immediately with ServiceUnavailable. After reset_timeout seconds a single trial call is
+    let through while other calls wait on it; if it succeeds the circuit closes, otherwise it stays open
+    for another reset_timeout.
+
+    Only exceptions of the types in failures count against a service. These include the HTTPError services
+    raise for 429 and 5xx responses. Others, such as a ValueError for an unsuitable input node, say nothing
+    about the service's health, so they count neither for nor against it. Only a call that succeeds closes
+    the circuit. A trial call that fails some other way leaves it half open for the next trial. """
+
+    failures = (OSError,)
+
+    def __init__(self, service, max_concurrency=4, min_concurrency=1, latency_target=10, decrease=0.5,
+                 cooldown=1, failure_threshold=5, reset_timeout=30):
+        self.service = service
+        self.max_concurrency = max (1, int (max_concurrency))
+        self.min_concurrency = max (1, min (int (min_concurrency), self.max_concurrency))
+        self.latency_target = latency_target
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.limit = float (self.max_concurrency)
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.last_decrease = 0
+        self.opened_at = None
+        self.trial = False
+        self.condition = threading.Condition ()
+
+    def acquire (self):
+        """ Wait for room to make a call. Returns True if the call is the trial call of a half open circuit.
+        Raises ServiceUnavailable if the circuit is open. """
+        with self.condition:
+            while True:
+                if self.opened_at is not None:
+                    retry_at = self.opened_at + self.reset_timeout
+                    if time.time () < retry_at:
+                        raise ServiceUnavailable (self.service, retry_at)
+                    if self.trial:
+                        self.condition.wait ()
+                        continue
+                    self.trial = True
+                    self.in_flight += 1
+                    return True
+                if self.in_flight < int (self.limit):
+                    self.in_flight += 1
+                    return False
+                self.condition.wait ()
+
+    def release (self, latency, error=None, trial=False):
+        """ Account for a finished call, adjusting the limit and the circuit. """
+        failed = isinstance (error, self.failures)
+        with self.condition:
+            self.in_flight -= 1
+            now = time.time ()
+            if failed:
+                self.consecutive_failures += 1
+                self.shrink (now)
+                if trial or self.consecutive_failures >= self.failure_threshold:
+                    if trial or self.opened_at is None:
+                        logger.warning ("Opening circuit for {0} after {1} consecutive failures: {2}".format (
+                            self.service, self.consecutive_failures, error))
+                    self.opened_at = now
+                    self.trial = False
+            elif error is not None:
+                if trial:
+                    self.trial = False
+            else:
+                self.consecutive_failures = 0
+                if trial:
+                    logger.info ("Closing circuit for {0}".format (self.service))
+                    self.opened_at = None
+                    self.trial = False
+                if latency > self.latency_target:
+                    self.shrink (now)
+                else:
+                    self.limit = min (self.max_concurrency, self.limit + 1.0 / self.limit)
+            self.condition.notify_all ()
+
+    def shrink (self, now):
+        if now - self.last_decrease >= self.cooldown:
+            self.limit = max (self.min_concurrency, self.limit * self.decrease)
+            self.last_decrease = now
+            logger.debug ("  -- service {0} limited to {1} concurrent calls".format (self.service, int (self.limit)))
+
+    def call (self, function, argument):
+        """ Call a function through the limiter. """
+        trial = self.acquire ()
+        start = time.time ()
+        try:
+            result = function (argument)
+        except Exception as e:
+            self.release (time.time () - start, e, trial)
+            raise
+        self.release (time.time () - start, None, trial)
+        return result
+
+    def get_state (self):
+        with self.condition:
+            return {
+                'limit'     : int (self.limit),
+                'in_flight' : self.in_flight,
+                'circuit'   : 'closed' if self.opened_at is None else 'half-open' if self.trial else 'open'
+            }
+
+class AdmissionController:
+    """ Hold a ServiceLimiter per service, created on first use. policy, if given, maps a service name
+    to keyword arguments for its limiter. Limiters are kept for the life of the controller, so what is
+    learned about a service in one query carries over to the next. """
+
+    def __init__(self, policy=None):
+        self.policy = policy
+        self.limiters = {}
+        self.lock = threading.Lock ()
+
+    def get_limiter (self, service):
+        with self.lock:
+            limiter = self.limiters.get (service, None)
+            if not limiter:
+                options = self.policy (service) if self.policy else {}
+                logger.debug ("  -- admission policy for {0}: {1}".format (service, options))
+                limiter = ServiceLimiter (service, **options)
+                self.limiters[service] = limiter
+        return limiter
+
+    def call (self, service, function, argument):
+        return self.get_limiter (service).call (function, argument)
+
+    def get_state (self):
+        """ Get each service's current limit, calls in flight and circuit state. """
+        with self.lock:
+            limiters = list (self.limiters.values ())
+        return { limiter.service : limiter.get_state () for limiter in limiters }
@@ -1,46 +1,169 @@
+import argparse
 import asyncio
 import logging
 import concurrent.futures
+import queue
+import random
 import requests
+import threading
+import time
 from collections import namedtuple
+from requests.adapters import HTTPAdapter
 from greent.util import LoggingUtil
 import multiprocessing
 
 logger = LoggingUtil.init_logging (__name__, level=logging.DEBUG)
 
 Operation = namedtuple ('Operation', [ 'operation', 'arguments' ])
-default_chunk_size = multiprocessing.cpu_count()
+default_window = multiprocessing.cpu_count()
+default_timeout = 60
+default_workers = 32
 
-class AsyncUtil:
-    
-    @staticmethod
-    async def parallel_requests (urls, process_response, degree=default_chunk_size):
-        with concurrent.futures.ThreadPoolExecutor(max_workers=degree) as executor:
-            loop = asyncio.get_event_loop ()
-            futures = [ loop.run_in_executor (executor, requests.get, url) for url in urls ]
-            for response in await asyncio.gather(*futures):
+class AsyncEngine:
+    """ Run blocking calls concurrently from an event loop that runs in its own thread for the life of
+    the engine, on a thread pool the engine keeps. Each batch of calls is made through a sliding window:
+    up to window calls are in flight, and as each finishes the next one starts, so a slow call holds up
+    one slot rather than the whole batch. Responses are handed to the caller's processor on the calling
+    thread, in the order they complete. Calls finished but not yet processed still count against the
+    window, so a slow processor slows the calls rather than letting responses pile up. The pool is shared
+    by every batch in the process, so a call may wait for a worker; its timeout starts when it gets one. """
+
+    def __init__(self, workers=default_workers):
+        self.pool = concurrent.futures.ThreadPoolExecutor (max_workers=workers)
+        self.loop = asyncio.new_event_loop ()
+        self.loop.set_default_executor (self.pool)
+        self.thread = threading.Thread (target=self.loop.run_forever, name="async-engine", daemon=True)
+        self.thread.start ()
+
+    async def invoke (self, function, argument, timeout):
+        """ Call function with argument on the pool, giving up timeout seconds after a worker starts it.
+        The thread making a call that times out isn't interrupted, but its slot in the window is freed. """
+        started = self.loop.create_future ()
+        def call ():
+            self.loop.call_soon_threadsafe (lambda: started.done () or started.set_result (None))
+            return function (argument)
+        result = self.loop.run_in_executor (None, call)
+        await asyncio.wait ([ started, result ], return_when=asyncio.FIRST_COMPLETED)
+        return await asyncio.wait_for (result, timeout)
+
+    def execute (self, function, arguments, process_response, window=default_window, timeout=default_timeout):
+        """ Call function with each of arguments, passing each result to process_response. Calls that
+        fail or time out are logged and skipped. """
+        arguments = iter (arguments)
+        completed = queue.Queue ()
+        def start ():
+            for argument in arguments:
+                future = asyncio.run_coroutine_threadsafe (self.invoke (function, argument, timeout), self.loop)
+                future.add_done_callback (lambda f, argument=argument: completed.put ((argument, f)))
+                return True
+            return False
+        in_flight = 0
+        while in_flight < window and start ():
+            in_flight += 1
+        while in_flight > 0:
+            argument, future = completed.get ()
+            try:
+                response = future.result ()
+            except concurrent.futures.TimeoutError:
+                logger.warning ("Timed out after {0}s: {1}".format (timeout, argument))
+            except Exception as e:
+                logger.warning ("Failed: {0}: {1}".format (argument, e))
+            else:
                 process_response (response)
+            in_flight -= 1
+            if start ():
+                in_flight += 1
+
+    def close (self):
+        self.loop.call_soon_threadsafe (self.loop.stop)
+        self.thread.join ()
+        self.pool.shutdown (wait=False)
+
+engine = None
+engine_lock = threading.Lock ()
+
+def get_engine ():
+    """ Get the engine shared by everything in the process, started the first time it's asked for. """
+    global engine
+    with engine_lock:
+        if engine is None:
+            engine = AsyncEngine ()
+        return engine
+
+session = None
+session_lock = threading.Lock ()
+
+def http_get (url):
+    """ GET a url through a session shared by callers that don't have a service's, keeping a pool of
+    keep-alive connections per host as big as the engine's pool. """
+    global session
+    if not session:
+        with session_lock:
+            if not session:
+                adapter = HTTPAdapter (pool_connections=default_workers, pool_maxsize=default_workers)
+                session = requests.Session ()
+                session.mount ('http://', adapter)
+                session.mount ('https://', adapter)
+    return session.get (url, timeout=default_timeout)
+
+class AsyncUtil:
 
     @staticmethod
-    def execute_parallel_requests (urls, response_processor, chunk_size=default_chunk_size):
-        chunks = [urls[i:i + chunk_size] for i in range(0, len(urls), chunk_size)]
+    def execute_parallel_requests (urls, response_processor, chunk_size=None, http_get=http_get,
+                                   window=default_window, timeout=default_timeout):
+        """ GET urls with up to window in flight, passing each response to response_processor. Services
+        should pass their own http_get, so requests go through their session and their handling of failing
+        responses, and share identical requests already in flight. chunk_size is the old name for window. """
         logger.debug ("urls: {}".format (urls))
-        for chunk in chunks:
-            #logger.debug (" async requests: {0}".format (len(chunk)))
-            loop = asyncio.get_event_loop()
-            loop.run_until_complete(AsyncUtil.parallel_requests(chunk, process_response=response_processor))
+        get_engine ().execute (http_get, urls, response_processor, window=chunk_size or window, timeout=timeout)
 
     @staticmethod
-    async def parallel_operation (operations, process_response, degree=default_chunk_size):
-        with concurrent.futures.ThreadPoolExecutor(max_workers=degree) as executor:
+    def execute_parallel_operations (operations, response_processor, chunk_size=None, window=default_window,
+                                     timeout=default_timeout):
+        """ Call each operation with its arguments, up to window at a time, passing each result to
+        response_processor. chunk_size is the old name for window. """
+        get_engine ().execute (lambda op: op.operation (op.arguments), operations, response_processor,
+                               window=chunk_size or window, timeout=timeout)
+
+def execute_chunked_operations (operations, response_processor, chunk_size=default_window):
+    """ The way operations used to be run, for comparison: in chunks, each on a new pool, each waiting
+    for its slowest operation before the next starts. """
+    async def parallel_operation (chunk):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=chunk_size) as executor:
             loop = asyncio.get_event_loop ()
-            futures = [ loop.run_in_executor (executor, op.operation, op.arguments) for op in operations ]
+            futures = [ loop.run_in_executor (executor, op.operation, op.arguments) for op in chunk ]
             for response in await asyncio.gather (*futures):
-                process_response (response)
-    @staticmethod
-    def execute_parallel_operations (operations, response_processor, chunk_size=default_chunk_size):
-        chunks = [operations[i:i + chunk_size] for i in range(0, len(operations), chunk_size)]
-        for chunk in chunks:
-            #logger.debug (" async-op: {0}".format (len(chunk)))
-            loop = asyncio.get_event_loop()
-            loop.run_until_complete(AsyncUtil.parallel_operation(chunk, process_response=response_processor))
+                response_processor (response)
+    loop = asyncio.new_event_loop ()
+    try:
+        for i in range(0, len(operations), chunk_size):
+            loop.run_until_complete (parallel_operation (operations[i:i + chunk_size]))
+    finally:
+        loop.close ()
+
+def benchmark (count, window, latency, slow, seed=0):
+    """ Time the chunked and sliding window executions of count operations that each sleep for latency
+    seconds, except that one in slow sleeps ten times as long, as a lagging service would. """
+    rand = random.Random (seed)
+    operations = [ Operation (time.sleep, latency * (10 if rand.random () < 1.0 / slow else rand.uniform (0.5, 1.5)))
+                   for i in range(count) ]
+    results = {}
+    for name, execute in (
+            ('chunked', lambda processor: execute_chunked_operations (operations, processor, chunk_size=window)),
+            ('sliding window', lambda processor: AsyncUtil.execute_parallel_operations (operations, processor, window=window))):
+        processed = []
+        start = time.time ()
+        execute (processed.append)
+        results[name] = time.time () - start
+        print ("{0:>15}: {1} operations in {2:.3f}s".format (name, len(processed), results[name]))
+    print ("{0:>15}: {1:.2f}x".format ('speedup', results['chunked'] / results['sliding window']))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare chunked and sliding window execution of operations with uneven latency.')
+    parser.add_argument('--count', help='Number of operations.', type=int, default=200)
+    parser.add_argument('--window', help='Operations in flight (and chunk size).', type=int, default=8)
+    parser.add_argument('--latency', help='Typical latency in seconds.', type=float, default=0.05)
+    parser.add_argument('--slow', help='One operation in this many is ten times slower.', type=int, default=20)
+    args = parser.parse_args ()
+    benchmark (args.count, args.window, args.latency, args.slow)
@@ -3,8 +3,6 @@ import json
 import urllib
 from greent.service import Service
 from greent.service import ServiceContext
-from greent.mondo import Mondo
-from greent.go import GO
 from greent.util import Text
 from greent.graph_components import KNode,KEdge
 from greent import node_types
@@ -14,9 +12,30 @@ class Biolink(Service):
     """ Preliminary interface to Biolink. Will move to automated Translator Registry invocation over time. """
     def __init__(self, context):
         super(Biolink, self).__init__("biolink", context)
-        #TODO, can we just use the Mondo that's inthe core already?
-        self.checker = Mondo(ServiceContext.create_context ())
-        self.go = GO(ServiceContext.create_context ())
+        self._checker = None
+        self._go = None
+
+    @property
+    def checker(self):
+        """ Mondo, loaded the first time it's needed. With a core, this is the core's mondo service. """
+        if self._checker is None:
+            if self.context.core is not None:
+                self._checker = self.context.core.mondo
+            else:
+                from greent.mondo import Mondo
+                self._checker = Mondo(self.context)
+        return self._checker
+
+    @property
+    def go(self):
+        """ GO, loaded the first time it's needed. With a core, this is the core's go service. """
+        if self._go is None:
+            if self.context.core is not None:
+                self._go = self.context.core.go
+            else:
+                from greent.go import GO
+                self._go = GO(self.context)
+        return self._go
     def process_associations(self, r, predicate, target_node_type):
         edge_nodes = [ ]
         for association in r['associations']:
@@ -37,21 +56,22 @@ class Biolink(Service):
         """Given a gene specified as an HGNC curie, return associated diseases. """
         ehgnc = urllib.parse.quote_plus(gene_node.identifier)
         logging.getLogger('application').debug('          biolink: %s/bioentity/gene/%s/diseases' % (self.url, ehgnc))
-        r = requests.get('%s/bioentity/gene/%s/diseases' % (self.url, ehgnc)).json()
+        r = self.http_get('%s/bioentity/gene/%s/diseases' % (self.url, ehgnc)).json()
         return self.process_associations( r, 'gene_get_disease', node_types.DISEASE )
     def disease_get_phenotype(self,disease):
         url = "{0}/bioentity/disease/{1}/phenotypes/".format (self.url, disease.identifier )
-        response = requests.get (url).json ()
+        response = self.http_get (url).json ()
         return self.process_associations( response, 'disease_get_phenotype', node_types.PHENOTYPE )
     def gene_get_go(self,gene):
         #this function is very finicky.  gene must be in uniprotkb, and the curie prefix must be correctly capitalized
         url = "{0}/bioentity/gene/UniProtKB:{1}/function/".format (self.url, Text.un_curie(gene.identifier) )
-        response = requests.get (url).json ()
+        response = self.http_get (url).json ()
         #return [ (a['object']['id'] , a['object']['label']) for a in response['associations'] ]
         return self.process_associations(response, 'gene_get_go', node_types.PROCESS)
     def gene_get_function (self, gene):
         edges_nodes = self.gene_get_go( gene )
-        process_results = list( filter( lambda x: self.go.is_molecular_function(x[1].identifier), edges_nodes ) )
+        is_function = self.go.is_molecular_function_batch( [ node.identifier for edge, node in edges_nodes ] )
+        process_results = [ edge_node for edge_node, keep in zip( edges_nodes, is_function ) if keep ]
         for edge, node in process_results:
             edge.predicate='gene_get_molecular_function'
             node.identifier.replace('GO:', 'GO.MOLECULAR_FUNCTION:')
@@ -59,7 +79,8 @@ class Biolink(Service):
         return process_results
     def gene_get_process ( self, gene):
         edges_nodes = self.gene_get_go( gene )
-        process_results = list( filter( lambda x: self.go.is_biological_process(x[1].identifier), edges_nodes ) )
+        is_process = self.go.is_biological_process_batch( [ node.identifier for edge, node in edges_nodes ] )
+        process_results = [ edge_node for edge_node, keep in zip( edges_nodes, is_process ) if keep ]
         for edge, node in process_results:
             edge.predicate='gene_get_biological_process'
             node.identifier.replace('GO:', 'GO.BIOLOGICAL_PROCESS:')
@@ -70,10 +91,9 @@ class Biolink(Service):
         """Given a gene specified as an HGNC curie, return associated genetic conditions.
         A genetic condition is specified as a disease that descends from a ndoe for genetic disease in MONDO."""
         disease_relations = self.gene_get_disease(gene)
-        #checker = Mondo(ServiceContext.create_context ())
         relations = []
-        for relation, obj in disease_relations:
-            is_genetic_condition, new_object_ids = self.checker.is_genetic_disease(obj)
+        classes = self.checker.is_genetic_disease_batch( [ obj for relation, obj in disease_relations ] )
+        for (relation, obj), (is_genetic_condition, new_object_ids) in zip( disease_relations, classes ):
             if is_genetic_condition:
                 obj.properties['mondo_identifiers'] = new_object_ids
                 obj.node_type = node_types.GENETIC_CONDITION
@@ -83,6 +103,7 @@ class Biolink(Service):
 
 def test():
     """What do we get back for HBB"""
+    from greent.mondo import Mondo
     relations = gene_get_disease(('HGNC:4827',))
     checker = Mondo(ServiceContext.create_context ())
     for p, a in relations:
@@ -0,0 +1,178 @@
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from collections import OrderedDict
+from greent.mapped import MappedFileError
+from greent.mapped import read_header
+from greent.util import LoggingUtil
+from greent.util import Resource
+
+logger = LoggingUtil.init_logging (__name__, level=logging.DEBUG)
+
+class OperatorCache:
+    """ Cache operator results, ie the lists of (KEdge, KNode) pairs operators return.
+    Entries are keyed by operator name, input identifier and node type, and the version of the source
+    behind the operator, so bumping a source's version in greent.conf retires its entries. Results are
+    stored pickled and compressed, in a bounded in-memory LRU in front of a sqlite file. Each hit
+    unpickles a fresh copy, so callers are free to modify what they get back.
+
+    Configuration comes from the cache section of greent.conf:
+        path           : the sqlite file. Omit to keep the memory tier only.
+        memory_entries : the most entries held in memory.
+        ttl            : seconds before an entry expires.
+        negative_ttl   : seconds before an empty result expires, shorter than ttl since an upstream
+                         problem that doesn't raise, such as an empty response, can look like one.
+    A service's own entry may set cache_ttl, overriding ttl (0 disables caching for the service),
+    cache_negative_ttl, overriding negative_ttl (0 leaves its empty results uncached), and
+    version, identifying the release of the data it serves. Without one, a service serving from a snapshot
+    or store file is versioned by the version and build time in the file's header, so rebuilding the file
+    retires its entries. """
+
+    # Settings naming the files services serve their data from.
+    data_files = [ 'snapshot', 'store' ]
+
+    def __init__(self, config):
+        self.config = config
+        cache_conf = config.get_section ('cache')
+        self.ttl = cache_conf.get ('ttl', 86400)
+        self.negative_ttl = cache_conf.get ('negative_ttl', 300)
+        self.memory_entries = cache_conf.get ('memory_entries', 10000)
+        self.memory = OrderedDict ()
+        self.stats = Counter ()
+        self.lock = threading.Lock ()
+        self.file_versions = {}
+        self.db = None
+        path = cache_conf.get ('path', None)
+        if path:
+            try:
+                self.db = sqlite3.connect (Resource.get_resource_path (path), check_same_thread=False)
+                self.db.execute ("""CREATE TABLE IF NOT EXISTS results (
+                                       key TEXT PRIMARY KEY, expires REAL, value BLOB)""")
+                self.db.commit ()
+            except sqlite3.Error as e:
+                logger.warning ("Operator cache {0} unavailable, using memory only: {1}".format (path, e))
+                self.db = None
+
+    def get_service_config (self, service):
+        try:
+            return self.config.get_service (service)
+        except KeyError:
+            return {}
+
+    def get_ttl (self, service):
+        return self.get_service_config (service).get ('cache_ttl', self.ttl)
+
+    def get_negative_ttl (self, service):
+        """ Get how long a service's empty results are kept: never longer than its other results. """
+        negative_ttl = self.get_service_config (service).get ('cache_negative_ttl', self.negative_ttl)
+        return min (negative_ttl, self.get_ttl (service))
+
+    def get_version (self, service):
+        """ Get the version of a service's data: the version set in greent.conf, or else the versions of the
+        files it serves from, or '' if it has neither. """
+        service_conf = self.get_service_config (service)
+        if 'version' in service_conf:
+            return str (service_conf['version'])
+        return ','.join ([ self.get_file_version (Resource.get_resource_path (service_conf[setting]))
+                           for setting in self.data_files if setting in service_conf ])
+
+    def get_file_version (self, path):
+        """ Get the version of a snapshot or store from its header, read again only when the file changes. """
+        try:
+            modified = os.path.getmtime (path)
+        except OSError:
+            return ''
+        known = self.file_versions.get (path, None)
+        if known and known[0] == modified:
+            return known[1]
+        try:
+            header = read_header (path)
+            version = "{0}@{1}".format (header['version'], header['built']) if 'version' in header else header['built']
+        except (OSError, KeyError, MappedFileError) as e:
+            logger.debug ("Unable to read the version of {0}: {1}".format (path, e))
+            version = ''
+        self.file_versions[path] = (modified, version)
+        return version
+
+    def make_key (self, service, op, node):
+        """ Make the key for an operator invoked on a node. service is the name of the service the operator
+        belongs to, as in greent.conf. """
+        version = self.get_version (service)
+        return "{0}|{1}|{2}|{3}".format (op, version, node.node_type, node.identifier)
+
+    def get (self, service, op, node):
+        """ Get the cached result of an operator invoked on a node, or None. """
+        if not self.get_ttl (service):
+            return None
+        key = self.make_key (service, op, node)
+        now = time.time ()
+        tier = None
+        with self.lock:
+            entry = self.memory.get (key, None)
+            if entry:
+                self.memory.move_to_end (key)
+                tier = 'memory'
+            elif self.db:
+                row = self.db.execute ("SELECT expires, value FROM results WHERE key = ?", (key,)).fetchone ()
+                entry = (row[0], row[1]) if row else None
+                tier = 'disk'
+            if entry and entry[0] < now:
+                self.memory.pop (key, None)
+                entry = None
+            if not entry:
+                self.stats[(service, 'miss')] += 1
+                return None
+            if tier == 'disk':
+                self.remember (key, entry)
+            self.stats[(service, tier)] += 1
+        return pickle.loads (zlib.decompress (entry[1]))
+
+    def put (self, service, op, node, result):
+        """ Cache the result of an operator invoked on a node. """
+        if result is None:
+            return
+        ttl = self.get_ttl (service) if len(result) > 0 else self.get_negative_ttl (service)
+        if not ttl:
+            return
+        key = self.make_key (service, op, node)
+        try:
+            entry = (time.time () + ttl, zlib.compress (pickle.dumps (result, pickle.HIGHEST_PROTOCOL)))
+        except Exception as e:
+            logger.debug ("Not caching unpicklable result of {0}({1}): {2}".format (op, node.identifier, e))
+            return
+        with self.lock:
+            self.remember (key, entry)
+            if self.db:
+                self.db.execute ("INSERT OR REPLACE INTO results (key, expires, value) VALUES (?, ?, ?)",
+                                 (key, entry[0], sqlite3.Binary (entry[1])))
+                self.db.commit ()
+
+    def remember (self, key, entry):
+        """ Add an entry to the memory tier, evicting the least recently used entries if it is full. """
+        self.memory[key] = entry
+        self.memory.move_to_end (key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem (last=False)
+
+    def purge (self):
+        """ Remove expired entries from both tiers. """
+        now = time.time ()
+        with self.lock:
+            for key in [ k for k, v in self.memory.items () if v[0] < now ]:
+                del self.memory[key]
+            if self.db:
+                self.db.execute ("DELETE FROM results WHERE expires < ?", (now,))
+                self.db.commit ()
+
+    def get_stats (self):
+        """ Get hit and miss counts by service, eg { 'pharos' : { 'memory' : 3, 'disk' : 1, 'miss' : 5 } }. """
+        result = {}
+        with self.lock:
+            for (service, kind), count in self.stats.items ():
+                result.setdefault (service, {})[kind] = count
+        return result
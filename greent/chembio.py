@@ -1,4 +1,5 @@
 from greent.service import Service
+from greent.service import batch_operator
 from greent.triplestore import TripleStore
 from greent.util import LoggingUtil
 from greent.util import Text
@@ -76,20 +77,56 @@ class ChemBioKS(Service):
             }""")
         return result
 
+    @batch_operator ('get_drugs_by_condition_graph_batch')
     def get_drugs_by_condition_graph (self, conditions):
         drugs = self.get_drugs_by_condition (conditions.identifier)
         results = []
         for r in drugs:
-            edge = KEdge ('c2b2r', 'conditionToDrug',
-                          { 'cid' : r['pubChemCID'], 'pmids' : r['diseasePMIDs'] })
-            node = KNode (r['drugID'].split('/')[-1:][0],
-                          #"http://chem2bio2rdf.org/drugbank/resource/drugbank_drug",
-                          node_types.DRUG,
-                          r['drugGenericName'])
-            results.append ( (edge, node) )
+            results.append (self.drug_by_condition_edge (r))
         #logger.debug ("chembio drugs by condition: {}".format (results))
         return results
 
+    def get_drugs_by_condition_graph_batch (self, conditions):
+        """ Batch form of get_drugs_by_condition_graph. Query drugs for a list of condition nodes at once,
+        returning a dict from each node's identifier to its (edge, drug node) pairs. """
+        curies = {}
+        for condition in conditions:
+            curie = condition.identifier.replace ("MESH:", "mesh:")
+            curie = curie if curie.startswith ("mesh:") else "mesh:{0}".format (curie)
+            curies[curie.lower ()] = condition.identifier
+        drugs = self.triplestore.query_template (
+            inputs = { "diseaseIds" : ' '.join ([ "( {0} )".format (c) for c in curies ]) },
+            outputs = [ 'diseaseId', 'drugID', 'drugGenericName', 'pubChemCID', 'diseasePMIDs' ],
+            template_text="""
+            prefix mesh:           <http://bio2rdf.org/mesh:> 
+            prefix ctd:            <http://chem2bio2rdf.org/ctd/resource/>
+            prefix db_resource:    <http://chem2bio2rdf.org/drugbank/resource/>
+            select ?diseaseId ?drugID ?drugGenericName ?diseasePMIDs ?ctdChemDis ?pubChemCID where {
+               values ( ?diseaseId ) { $diseaseIds }
+               ?ctdChemDis  ctd:cid                        ?pubChemCID;
+                            ctd:diseaseid                  ?diseaseId;
+                            ctd:pubmedids                  ?diseasePMIDs.
+               ?dbInter     db_resource:Name               ?name ;
+	                    db_resource:DBID               ?drugID .
+               ?drugID      db_resource:CID                ?pubChemCID ;
+  	                    db_resource:Generic_Name       ?drugGenericName .
+            }""")
+        results = {}
+        for r in drugs:
+            curie = "mesh:{0}".format (r['diseaseId'].split ("mesh:")[-1]).lower ()
+            if curie in curies:
+                results.setdefault (curies[curie], []).append (self.drug_by_condition_edge (r))
+        return results
+
+    def drug_by_condition_edge (self, r):
+        edge = KEdge ('c2b2r', 'conditionToDrug',
+                      { 'cid' : r['pubChemCID'], 'pmids' : r['diseasePMIDs'] })
+        node = KNode (r['drugID'].split('/')[-1:][0],
+                      #"http://chem2bio2rdf.org/drugbank/resource/drugbank_drug",
+                      node_types.DRUG,
+                      r['drugGenericName'])
+        return (edge, node)
+
     def get_genes_pathways_by_disease (self, diseases):
         """ Get genes and pathways associated with specified conditions.
 
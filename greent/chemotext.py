@@ -2,6 +2,7 @@ import json
 import os
 import unittest
 from collections import defaultdict
+from greent.crosswalk import get_crosswalk
 from greent.mesh import MeSH
 from greent.neo4j import Neo4JREST
 from greent.util import LoggingUtil
@@ -21,12 +22,7 @@ class Chemotext(Neo4JREST):
         self.load_synonym_cache()
 
     def load_synonym_cache( self ):
-        self.term_map = {}
-        with open(self.cache,'r') as infile:
-            h = infile.readline()
-            for line in infile:
-                x = line.strip().split('\t')
-                self.term_map[x[0]] = x[1]
+        self.term_map = get_crosswalk(self.cache, 'QUERY', 'KEY')
         
     def term_to_term (self, A, of_type=None, limit=100):
         response = self.query (
@@ -70,10 +66,9 @@ class Chemotext(Neo4JREST):
         return result
 
     def get_chemotext_term(self, input_term):
-        qterm = input_term.upper()
-        if qterm not in self.term_map:
-            return None
-        return self.term_map[qterm]
+        terms = self.term_map.get(input_term.upper())
+        #The last mapping of a query in the cache wins.
+        return terms[-1] if terms else None
     
 
 def build_synonym_cache(ctext = None):
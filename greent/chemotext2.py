@@ -2,7 +2,6 @@ import gensim.models
 import json
 import logging
 import os
-import requests
 import time
 from greent.service import Service
 from greent.service import ServiceContext
@@ -28,7 +27,7 @@ class Chemotext2 (Service):
                 continue
             logger.debug ("  --downloading word embedding model component: {0}".format (f))
             url = "{0}/{1}".format (self.url, f)
-            r = requests.get (url, stream=True)
+            r = self.http_get (url, stream=True)
             with open (f, 'wb') as f:
                 for chunk in r.iter_content(chunk_size=1024): 
                     if chunk: # filter out keep-alive new chunks
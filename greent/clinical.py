@@ -53,7 +53,7 @@ class Clinical (Service):
         if live_api_enabled:
             print ("query: {}".format (query_string))
             try:            
-                r = requests.get (query_string)
+                r = self.http_get (query_string)
                 r.raise_for_status()
                 result = r.json ()
             except requests.exceptions.RequestException as e:  # This is the correct syntax
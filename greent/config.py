@@ -13,3 +13,6 @@ class Config:
             self.conf = yaml.safe_load (f)
     def get_service (self, service):
         return self.conf['translator']['services'][service]
+    def get_section (self, section):
+        """ Get a top level section of the translator configuration, or an empty dict if it's absent. """
+        return self.conf['translator'].get (section, None) or {}
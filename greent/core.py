@@ -1,34 +1,21 @@
+import argparse
+import concurrent.futures
 import datetime
+import importlib
 import json
 import logging
 import os
 import pprint
+import subprocess
+import sys
+import threading
+import time
 import unittest
+from collections import OrderedDict
 from collections import defaultdict
-from greent.biolink import Biolink
-from greent.chembio import ChemBioKS
-from greent.chemotext import Chemotext
-from greent.ctd import CTD
-from greent.clinical import Clinical
-from greent.cmaq import CMAQ
-from greent.config import Config
-from greent.disease_ont import DiseaseOntology
-from greent.endotype import Endotype
-from greent.go import GO
-from greent.hetio import HetIO
-from greent.hgnc import HGNC
-from greent.hpo import HPO
-from greent.oxo import OXO
-from greent.mondo import Mondo
-from greent.pharos import Pharos
-from greent.quickgo import QuickGo
+from greent.admission import ServiceUnavailable
 from greent.service import ServiceContext
-from greent.tkba import TranslatorKnowledgeBeaconAggregator
-from greent.translator import Translator
-from greent.transreg import TranslatorRegistry
-from greent.triplestore import TripleStore
 from greent.util import LoggingUtil
-from greent.uberongraph import UberonGraphKS
 from pprint import pprint
 
 logger = LoggingUtil.init_logging (__file__)
@@ -36,34 +23,123 @@ logger = LoggingUtil.init_logging (__file__)
 class GreenT:
 
     ''' The Green Translator API - a single Python interface aggregating access mechanisms for 
-    all Green Translator services. '''
+    all Green Translator services. Services, and the modules implementing them, are loaded the
+    first time they are used, so a process only pays for the services its queries need. Long running
+    processes can instead warm up, loading every service up front, concurrently. '''
 
-    def __init__(self, config=None, override={}):
-        self.service_context = ServiceContext.create_context (config)
-        service_context = self.service_context
-        
-        self.clinical = Clinical (service_context)
+    # Attribute name, module and class of each service.
+    service_classes = OrderedDict ([
+        ( 'clinical',            ( 'greent.clinical',      'Clinical' ) ),
         #temporarly taken out because of http errors
-        #self.exposures = CMAQ (service_context)
-        self.endotype = Endotype (service_context)
-
-        self.chembio = ChemBioKS (self.service_context)
-        self.chemotext = Chemotext (self.service_context)
-        self.disease_ontology = DiseaseOntology (self.service_context)
-        self.pharos = Pharos (self.service_context)
-        self.oxo = OXO (self.service_context)
-        self.hpo = HPO (self.service_context)
-        self.hetio = HetIO (self.service_context)
-        self.biolink = Biolink (self.service_context)
-        self.mondo = Mondo(self.service_context)
-        self.go = GO(self.service_context)
-        self.tkba = TranslatorKnowledgeBeaconAggregator (self.service_context)
-        self.translator_registry = TranslatorRegistry (self.service_context)
-        self.quickgo = QuickGo (self.service_context)
-        self.translator = Translator (core=self)
-        self.hgnc = HGNC(self.service_context)
-        self.uberongraph = UberonGraphKS(self.service_context)
-        self.ctd = CTD(self.service_context)
+        #( 'exposures',          ( 'greent.cmaq',          'CMAQ' ) ),
+        ( 'endotype',            ( 'greent.endotype',      'Endotype' ) ),
+        ( 'chembio',             ( 'greent.chembio',       'ChemBioKS' ) ),
+        ( 'chemotext',           ( 'greent.chemotext',     'Chemotext' ) ),
+        ( 'disease_ontology',    ( 'greent.disease_ont',   'DiseaseOntology' ) ),
+        ( 'pharos',              ( 'greent.pharos',        'Pharos' ) ),
+        ( 'oxo',                 ( 'greent.oxo',           'OXO' ) ),
+        ( 'hpo',                 ( 'greent.hpo',           'HPO' ) ),
+        ( 'hetio',               ( 'greent.hetio',         'HetIO' ) ),
+        ( 'biolink',             ( 'greent.biolink',       'Biolink' ) ),
+        ( 'mondo',               ( 'greent.mondo',         'Mondo' ) ),
+        ( 'go',                  ( 'greent.go',            'GO' ) ),
+        ( 'tkba',                ( 'greent.tkba',          'TranslatorKnowledgeBeaconAggregator' ) ),
+        ( 'translator_registry', ( 'greent.transreg',      'TranslatorRegistry' ) ),
+        ( 'quickgo',             ( 'greent.quickgo',       'QuickGo' ) ),
+        ( 'translator',          ( 'greent.translator',    'Translator' ) ),
+        ( 'hgnc',                ( 'greent.hgnc',          'HGNC' ) ),
+        ( 'uberongraph',         ( 'greent.uberongraph',   'UberonGraphKS' ) ),
+        ( 'ctd',                 ( 'greent.ctd',           'CTD' ) )
+    ])
+
+    # Services whose greent.conf name differs from their attribute name.
+    service_names = {
+        'disease_ontology' : 'diseaseontology',
+        'translator_registry' : 'transreg'
+    }
+
+    def __init__(self, config=None, override={}, warm_up=None):
+        """ Create the core. If warm_up is set, or is None and the core section of greent.conf sets it,
+        load every service before returning. See warm_up. """
+        self.service_context = ServiceContext.create_context (config)
+        self.service_context.core = self
+        self.lock = threading.Lock ()
+        self.service_locks = {}
+        self.unavailable = {}
+        self.service_status = OrderedDict ()
+        core_conf = self.service_context.config.get_section ('core')
+        if warm_up if warm_up is not None else core_conf.get ('warm_up', False):
+            self.warm_up (concurrency=core_conf.get ('warm_up_concurrency', None))
+
+    def __getattr__(self, name):
+        """ Called for attributes not found the usual way, which includes services not yet created. """
+        if name in GreenT.service_classes:
+            return self.get_service (name)
+        raise AttributeError ("'{0}' object has no attribute '{1}'".format (type(self).__name__, name))
+
+    def get_service (self, name):
+        """ Get a service, creating it if this is the first time it's been asked for. Services are created
+        once even if several threads ask at once, while different services can be created concurrently.
+        Raises ServiceUnavailable for a service that failed to load during warm up. """
+        with self.lock:
+            service_lock = self.service_locks.setdefault (name, threading.Lock ())
+            if name in self.unavailable:
+                raise ServiceUnavailable (name, reason=self.unavailable[name])
+        with service_lock:
+            service = self.__dict__.get (name, None)
+            if service is None:
+                service = self.create_service (name)
+                setattr (self, name, service)
+        return service
+
+    def create_service (self, name):
+        module_name, class_name = GreenT.service_classes[name]
+        logger.debug ("-- Creating service {0}".format (name))
+        service_class = getattr (importlib.import_module (module_name), class_name)
+        # The translator routes requests to other services, so it's given the core rather than the context.
+        return service_class (core=self) if name == 'translator' else service_class (self.service_context)
+
+    @staticmethod
+    def get_service_name (name):
+        """ Get the greent.conf name of the service with the given attribute name, without creating it. """
+        return GreenT.service_names.get (name, name)
+
+    def get_loaded_services (self):
+        """ Get the names of the services created so far. """
+        return [ name for name in GreenT.service_classes if name in self.__dict__ ]
+
+    def warm_up (self, services=None, concurrency=None):
+        """ Load services, by default all of them, on concurrency threads (one per service by default).
+        A service that fails to load doesn't stop the others; it is marked unavailable and using it raises
+        ServiceUnavailable until a later warm up loads it. Returns, and keeps in service_status, each
+        service's load time in seconds and the error it failed with, if any. """
+        services = list (services if services else GreenT.service_classes.keys ())
+        with self.lock:
+            for name in services:
+                self.unavailable.pop (name, None)
+        def load (name):
+            start = time.time ()
+            try:
+                self.get_service (name)
+                return name, time.time () - start, None
+            except Exception as e:
+                return name, time.time () - start, e
+        workers = max (1, int (concurrency if concurrency else len(services)))
+        with concurrent.futures.ThreadPoolExecutor (max_workers=workers) as pool:
+            outcomes = list (pool.map (load, services))
+        for name, seconds, error in outcomes:
+            self.service_status[name] = {
+                'seconds' : seconds,
+                'error'   : None if error is None else "{0}: {1}".format (type(error).__name__, error)
+            }
+            if error is None:
+                logger.info ("Loaded {0} in {1:.2f}s".format (name, seconds))
+            else:
+                logger.error ("Unable to load {0} after {1:.2f}s; marking it unavailable: {2}".format (
+                    name, seconds, self.service_status[name]['error']))
+                with self.lock:
+                    self.unavailable[name] = self.service_status[name]['error']
+        return OrderedDict ([ (name, self.service_status[name]) for name in services ])
 
     # Exposure API
     def get_exposure_scores (self, exposure_type, start_date, end_date, exposure_point):
@@ -108,3 +184,45 @@ class GreenT:
 
     def execute (self, request):
         return self.translator.translate_chain (request)
+
+def measure_startup (services, config=None):
+    """ Create a GreenT and use the named services in a fresh interpreter, so that imports and memory are
+    measured from scratch. Returns the seconds taken and the peak resident set size in kilobytes. """
+    code = """
+import json, resource, sys, time
+start = time.time ()
+from greent.core import GreenT
+core = GreenT (config=sys.argv[2] if len(sys.argv) > 2 else None)
+for name in json.loads (sys.argv[1]):
+    getattr (core, name)
+print (json.dumps ({
+    'seconds' : time.time () - start,
+    'max_rss' : resource.getrusage (resource.RUSAGE_SELF).ru_maxrss
+}))
+"""
+    command = [ sys.executable, "-c", code, json.dumps (services) ] + ([ config ] if config else [])
+    output = subprocess.check_output (command, cwd=os.path.dirname (os.path.dirname (os.path.abspath (__file__))))
+    return json.loads (output.decode ('utf-8').strip ().split ('\n')[-1])
+
+def benchmark_startup (services=[ 'oxo', 'tkba' ], config=None):
+    """ Compare starting GreenT and using a few services with starting it and creating every service,
+    which is what GreenT used to do on construction. """
+    for label, names in [ ("{0} services".format (', '.join (services)), services),
+                          ("all services", list (GreenT.service_classes.keys ())) ]:
+        measured = measure_startup (names, config)
+        print ("{0:>40}: {1:8.2f}s {2:10d}KB max RSS".format (label, measured['seconds'], measured['max_rss']))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='GreenT core.')
+    parser.add_argument('--benchmark-startup', help='Compare startup time and memory of lazy and full service loading.',
+                        action="store_true", default=False)
+    parser.add_argument('--services', help='Comma separated services the lazy benchmark case uses.', default='oxo,tkba')
+    parser.add_argument('--config', help='GreenT config file.', default=None)
+    parser.add_argument('--warm-up', help='Load every service concurrently and report how long each took.',
+                        action="store_true", default=False)
+    args = parser.parse_args()
+    if args.benchmark_startup:
+        benchmark_startup (services=args.services.split (','), config=args.config)
+    if args.warm_up:
+        for name, status in GreenT (config=args.config, warm_up=False).warm_up ().items ():
+            print ("{0:>20}: {1:8.2f}s {2}".format (name, status['seconds'], status['error'] or 'ok'))
@@ -0,0 +1,144 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from greent.mapped import MappedFile
+from greent.mapped import MappedFileError
+from greent.mapped import SectionWriter
+from greent.util import LoggingUtil
+from greent.util import Resource
+
+logger = LoggingUtil.init_logging (__name__, level=logging.DEBUG)
+
+class Crosswalk(MappedFile):
+    """ A static mapping between two kinds of identifier, usable in both directions. It's built once from
+    two columns of a tab separated file into a memory mapped file of sorted keys, each with its values in
+    the order the source gave them, so lookups are a binary search. The sections are, for the forward
+    direction and, prefixed with inverse_, the other:
+        keys, key_offsets     : the distinct keys, sorted by their utf-8 bytes.
+        value_index, values   : each key's values, places in terms.
+        terms, term_offsets   : the distinct strings of both columns. """
+
+    magic = b'GTXWALK.'
+    format_version = 1
+
+    def get (self, key):
+        """ Get the values key maps to, in source order. """
+        return self.get_values ('', key)
+
+    def get_batch (self, keys):
+        return [ self.get (key) for key in keys ]
+
+    def get_inverse (self, value):
+        """ Get the keys that map to value, in source order. """
+        return self.get_values ('inverse_', value)
+
+    def get_values (self, direction, key):
+        index = self.lookup (direction + 'keys', direction + 'key_offsets', key)
+        if index is None:
+            return []
+        value_index = self.sections[direction + 'value_index']
+        return [ self.string ('terms', 'term_offsets', v)
+                 for v in self.sections[direction + 'values'][value_index[index]:value_index[index + 1]] ]
+
+class MemoryCrosswalk:
+    """ A Crosswalk kept in dictionaries, for when there's nowhere to write one. """
+
+    def __init__(self, pairs, header={}):
+        self.header = header
+        self.forward = {}
+        self.inverse = {}
+        for key, value in pairs:
+            self.forward.setdefault (key, []).append (value)
+            self.inverse.setdefault (value, []).append (key)
+
+    def get (self, key):
+        return list (self.forward.get (key, []))
+
+    def get_batch (self, keys):
+        return [ self.get (key) for key in keys ]
+
+    def get_inverse (self, value):
+        return list (self.inverse.get (value, []))
+
+def read_pairs (source, key_column, value_column, split=None, upper=False):
+    """ Read (key, value) pairs from two columns, named in its header, of a tab separated file. split
+    splits cells holding several keys; upper upper cases keys. """
+    with open (source, 'r') as stream:
+        header = stream.readline ().rstrip ('\r\n').split ('\t')
+        key_at = header.index (key_column)
+        value_at = header.index (value_column)
+        for line in stream:
+            x = line.rstrip ('\r\n').split ('\t')
+            if len(x) <= max (key_at, value_at) or x[key_at] == '':
+                continue
+            for key in (x[key_at].split (split) if split else [ x[key_at] ]):
+                yield (key.upper () if upper else key), x[value_at]
+
+def build_crosswalk (path, pairs, header={}):
+    """ Build a Crosswalk at path from (key, value) pairs. """
+    terms = {}
+    forward = {}
+    inverse = {}
+    for key, value in pairs:
+        k = terms.setdefault (key, len(terms))
+        v = terms.setdefault (value, len(terms))
+        forward.setdefault (key, []).append (v)
+        inverse.setdefault (value, []).append (k)
+    writer = SectionWriter ()
+    for direction, mapping in (('', forward), ('inverse_', inverse)):
+        keys = sorted (mapping, key=lambda k: k.encode ('utf-8'))
+        writer.add_strings (direction + 'keys', direction + 'key_offsets', keys)
+        writer.add_array (direction + 'values', writer.add_lists (direction + 'value_index', [ mapping[k] for k in keys ]))
+    writer.add_strings ('terms', 'term_offsets', sorted (terms, key=terms.get))
+    writer.write (path, Crosswalk.magic, Crosswalk.format_version,
+                  dict (header, built=time.strftime ('%Y-%m-%dT%H:%M:%S'),
+                        counts={ 'keys' : len(forward), 'values' : len(inverse) }))
+
+def build_first (paths, source, key_column, value_column, split, upper):
+    """ Build a crosswalk at the first of paths that can be written, or in memory if none can. """
+    header = { 'source' : os.path.basename (source), 'options' : [ split, upper ] }
+    for path in paths:
+        try:
+            logger.debug ("Building crosswalk {0}".format (path))
+            os.makedirs (os.path.dirname (path), exist_ok=True)
+            build_crosswalk (path, read_pairs (source, key_column, value_column, split, upper), header=header)
+            return Crosswalk (path)
+        except OSError as e:
+            logger.warning ("Unable to build crosswalk {0}: {1}".format (path, e))
+    return MemoryCrosswalk (read_pairs (source, key_column, value_column, split, upper), header=header)
+
+# Where crosswalks are built when the source's directory, usually the installed package, isn't writable.
+cache_dir = os.environ.get ('GREENT_CACHE_DIR', os.path.join (tempfile.gettempdir (), 'greent'))
+crosswalks = {}
+crosswalks_lock = threading.Lock ()
+
+def get_crosswalk (source, key_column, value_column, split=None, upper=False):
+    """ Get the crosswalk between two columns of a tab separated file with a header row, relative to the
+    greent package unless absolute. It's built into a file alongside the source the first time it's asked
+    for, and again whenever the source is newer, and kept for the life of the process. If the source's
+    directory isn't writable it's built in cache_dir instead, and if that isn't either, in memory. """
+    source = Resource.get_resource_path (source)
+    key = (source, key_column, value_column, split, upper)
+    with crosswalks_lock:
+        crosswalk = crosswalks.get (key, None)
+        if crosswalk is None:
+            modified = os.path.getmtime (source)
+            name = "{0}.{1}-{2}.xwalk".format (os.path.basename (source), key_column, value_column)
+            paths = [ os.path.join (os.path.dirname (source), name), os.path.join (cache_dir, name) ]
+            for path in paths:
+                try:
+                    if os.path.getmtime (path) < modified:
+                        raise MappedFileError ("{0} is older than {1}".format (path, source))
+                    crosswalk = Crosswalk (path)
+                    if crosswalk.header['options'] != [ split, upper ]:
+                        raise MappedFileError ("{0} was built with other options".format (path))
+                    break
+                except (OSError, MappedFileError) as e:
+                    logger.debug ("Not using crosswalk {0}: {1}".format (path, e))
+                    crosswalk = None
+            if crosswalk is None:
+                crosswalk = build_first (paths, source, key_column, value_column, split, upper)
+            crosswalks[key] = crosswalk
+    return crosswalk
@@ -1,89 +1,306 @@
+import argparse
 import json
 import logging
 import os
-import requests
+import threading
 import time
-from collections import defaultdict
+import zlib
+from collections import OrderedDict
+from greent.mapped import BuildLock
+from greent.mapped import MappedFile
+from greent.mapped import MappedFileError
+from greent.mapped import SectionWriter
 from greent.service import Service
 from greent.service import ServiceContext
 from greent.util import LoggingUtil
+from greent.util import Resource
 from greent.graph_components import KNode, KEdge
 from greent.util import Text
 from greent import node_types
 
 logger = LoggingUtil.init_logging (__file__, level=logging.DEBUG)
 
+class CTDStore(MappedFile):
+    """ CTD's human chemical-gene interactions and chemical names, as interned columns in a file built
+    once from CTD's TSVs and memory mapped by each worker, so workers share its pages and nothing is
+    parsed at startup. Chemicals and names are sorted and found by binary search. The sections are:
+        chemicals, chemical_offsets        : chemicals with human gene interactions, sorted.
+        interaction_index                  : each chemical's range of interactions.
+        interaction_genes                  : each interaction's gene, a place in genes.
+        action_index, interaction_actions  : each interaction's actions, places in actions.
+        publication_index, interaction_publications : each interaction's publications, places in publications.
+        genes, actions, publications and their offsets : the distinct values of each.
+        names, name_offsets                : lower cased chemical names and synonyms, sorted.
+        name_index, name_chemicals         : each name's chemicals, places in chemical_names.
+        chemical_names, chemical_name_offsets : the distinct chemicals of CTD_chemicals.tsv. """
+
+    magic = b'GTCTDSTO'
+    format_version = 1
+
+    def get_interactions (self, chemical):
+        """ Get the gene id, actions and publications of each human interaction of a chemical. """
+        index = self.lookup ('chemicals', 'chemical_offsets', chemical)
+        if index is None:
+            return []
+        interaction_index = self.sections['interaction_index']
+        genes = self.sections['interaction_genes']
+        result = []
+        for row in range (interaction_index[index], interaction_index[index + 1]):
+            result.append ((
+                self.string ('genes', 'gene_offsets', genes[row]),
+                [ self.string ('actions', 'action_offsets', a)
+                  for a in self.items ('action_index', 'interaction_actions', row) ],
+                [ self.string ('publications', 'publication_offsets', p)
+                  for p in self.items ('publication_index', 'interaction_publications', row) ]))
+        return result
+
+    def get_chemicals (self, name):
+        """ Get the chemicals with name, lower cased, as their name or a synonym. """
+        index = self.lookup ('names', 'name_offsets', name)
+        if index is None:
+            return []
+        return [ self.string ('chemical_names', 'chemical_name_offsets', c)
+                 for c in self.items ('name_index', 'name_chemicals', index) ]
+
+    def items (self, index, values, item):
+        index = self.sections[index]
+        return self.sections[values][index[item]:index[item + 1]]
+
+class Interner:
+    """ Number distinct strings in the order they're first seen. """
+    def __init__(self):
+        self.numbers = {}
+        self.values = []
+    def intern (self, value):
+        number = self.numbers.get (value, None)
+        if number is None:
+            number = self.numbers[value] = len(self.values)
+            self.values.append (value)
+        return number
+
+def data_rows (lines):
+    """ Split the lines of a CTD TSV into fields, skipping its comments. """
+    for line in lines:
+        if not line.startswith ('#'):
+            yield line.strip ().split ('\t')
+
+def build_store (path, chemical_lines, interaction_lines, header={}):
+    """ Build a CTDStore at path from the lines of CTD_chemicals.tsv and CTD_chem_gene_ixns.tsv. """
+    chemical_names = Interner ()
+    names = {}
+    for x in data_rows (chemical_lines):
+        chemical = chemical_names.intern (x[0])
+        names.setdefault (x[0].lower (), []).append (chemical)
+        if len(x) > 7:
+            for synonym in x[7].split ('|'):
+                names.setdefault (synonym.lower (), []).append (chemical)
+    genes = Interner ()
+    actions = Interner ()
+    publications = Interner ()
+    interactions = {}
+    for x in data_rows (interaction_lines):
+        if x[7] != '9606':
+            continue
+        interactions.setdefault (x[0], []).append ((
+            genes.intern ('NCBIGENE:{}'.format (x[4])),
+            [ actions.intern (a) for a in (x[9].split ('|') if len(x) > 9 else []) ],
+            [ publications.intern (p) for p in (x[10].split ('|') if len(x) > 10 else []) ]))
+    chemicals = sorted (interactions, key=lambda c: c.encode ('utf-8'))
+    rows = [ row for chemical in chemicals for row in interactions[chemical] ]
+    name_keys = sorted (names, key=lambda n: n.encode ('utf-8'))
+    writer = SectionWriter ()
+    writer.add_strings ('chemicals', 'chemical_offsets', chemicals)
+    writer.add_lists ('interaction_index', [ interactions[chemical] for chemical in chemicals ])
+    writer.add_array ('interaction_genes', [ row[0] for row in rows ])
+    writer.add_array ('interaction_actions', writer.add_lists ('action_index', [ row[1] for row in rows ]))
+    writer.add_array ('interaction_publications', writer.add_lists ('publication_index', [ row[2] for row in rows ]))
+    writer.add_strings ('genes', 'gene_offsets', genes.values)
+    writer.add_strings ('actions', 'action_offsets', actions.values)
+    writer.add_strings ('publications', 'publication_offsets', publications.values)
+    writer.add_strings ('names', 'name_offsets', name_keys)
+    writer.add_array ('name_chemicals', writer.add_lists ('name_index', [ names[n] for n in name_keys ]))
+    writer.add_strings ('chemical_names', 'chemical_name_offsets', chemical_names.values)
+    header = dict (header, built=time.strftime ('%Y-%m-%dT%H:%M:%S'),
+                   counts={ 'chemicals' : len(chemicals), 'interactions' : len(rows), 'names' : len(name_keys) })
+    writer.write (path, CTDStore.magic, CTDStore.format_version, header)
+    logger.info ("Wrote CTD store of {0} interactions to {1}".format (len(rows), path))
+
 class CTD (Service):
-    """ """
+    """ Chemical-gene interactions and chemical names from the Comparative Toxicogenomics Database. """
+
+    files = [ 'CTD_chemicals.tsv', 'CTD_chem_gene_ixns.tsv' ]
+
     def __init__(self, context): 
         super(CTD, self).__init__("ctd", context)
-        logger.debug ("Ensuring presence of CTD files: {0}".format (self.url))
-        files = [
-            'CTD_chem_gene_ixns.tsv','CTD_chemicals.tsv'
-        ]
-        for f in files:
-            fname = os.path.join (os.path.dirname (__file__), f)
-            if os.path.exists (fname):
-                continue
-            logger.debug ("  --downloading CTD component: {0}".format (f))
-            gzname = fname+'.gz'
-            url = "{0}/{1}.gz".format (self.url, f )
-            r = requests.get (url, stream=True)
-            with open (fname+'.gz', 'wb') as outf:
-                for chunk in r.iter_content(chunk_size=1024): 
-                    if chunk: # filter out keep-alive new chunks
-                        outf.write (chunk)
-            import gzip
-            import shutil
-            with gzip.open(fname+'.gz','rb') as f_in, open(fname,'wb') as f_out:
-                shutil.copyfileobj(f_in,f_out)
-        self.load_names()
-        self.load_genes()
-
-    def load_names(self):
-        self.name_to_id = defaultdict(list)
-        fname = os.path.join (os.path.dirname (__file__), 'CTD_chemicals.tsv') 
-        with open(fname,'r') as inf:
-            line = inf.readline()
-            while line.startswith('#'):
-                line = inf.readline()
-            for line in inf:
-                x = line.strip().split('\t')
-                indexname = x[0]
-                self.name_to_id[ indexname.lower() ].append(indexname)
-                if len(x) > 7:
-                    synonyms = x[7].split('|')
-                    for synonym in synonyms:
-                        self.name_to_id[ synonym.lower() ].append(indexname)
-
-    def load_genes(self):
-        self.drug_genes = defaultdict(list)
-        fname = os.path.join (os.path.dirname (__file__), 'CTD_chem_gene_ixns.tsv') 
-        with open(fname,'r') as inf:
-            line = inf.readline()
-            while line.startswith('#'):
-                line = inf.readline()
-            for line in inf:
-                x = line.strip().split('\t')
-                organismid = x[7]
-                if organismid != '9606':
-                    continue
-                chemname = x[0]
-                result = {}
-                result['gene_id'] = 'NCBIGENE:{}'.format(x[4])
-                if len(x) > 9:
-                    result['actions'] = x[9].split('|')
-                else:
-                    result['actions'] = []
-                if len(x) > 10:
-                    result['publications'] = x[10].split('|')
-                else:
-                    result['publications'] = []
-                self.drug_genes[chemname].append(result)
+        ctd_conf = context.config.get_service (self.name)
+        self.store_path = Resource.get_resource_path (ctd_conf.get ('store', 'ctd.store'))
+        self.refresh_ttl = ctd_conf.get ('refresh_ttl', 604800)
+        self.buffer_size = ctd_conf.get ('buffer_size', 1048576)
+        self.check_interval = ctd_conf.get ('check_interval', 60)
+        self.store_lock = threading.Lock ()
+        self.refresh_thread = None
+        self.checked = 0
+        self._store = None
+
+    @property
+    def store (self):
+        """ The CTD store, built first if it's missing or of an old format. See check_store. """
+        if not self._store:
+            with self.store_lock:
+                if not self._store:
+                    self._store = self.open_store ()
+        self.check_store ()
+        return self._store
+
+    def open_store (self):
+        """ Open the store, building it if it's missing or of an old format. If another process is building
+        it, wait for that process and use what it built. """
+        try:
+            return CTDStore (self.store_path)
+        except (OSError, MappedFileError) as e:
+            logger.debug ("Building CTD store: {0}".format (e))
+        with BuildLock (self.store_path):
+            try:
+                return CTDStore (self.store_path)
+            except (OSError, MappedFileError):
+                self.update (force=True)
+                return CTDStore (self.store_path)
+
+    def check_store (self):
+        """ At most every check_interval seconds, reopen the store if another process has rebuilt it, and
+        if it was last checked against CTD more than refresh_ttl seconds ago, refresh it in the background
+        while it's used. """
+        now = time.time ()
+        if now - self.checked < self.check_interval:
+            return
+        with self.store_lock:
+            if now - self.checked < self.check_interval:
+                return
+            self.checked = now
+            try:
+                stat = os.stat (self.store_path)
+            except OSError as e:
+                logger.warning ("Unable to check CTD store: {0}".format (e))
+                return
+            if stat.st_ino != self._store.inode:
+                try:
+                    self._store = CTDStore (self.store_path)
+                except (OSError, MappedFileError) as e:
+                    logger.warning ("Unable to reopen CTD store: {0}".format (e))
+            if now - stat.st_mtime > self.refresh_ttl and not (self.refresh_thread and self.refresh_thread.is_alive ()):
+                self.refresh_thread = threading.Thread (target=self.refresh_quietly, name="ctd-refresh", daemon=True)
+                self.refresh_thread.start ()
+
+    def refresh_quietly (self):
+        try:
+            self.refresh (wait=False)
+        except Exception as e:
+            logger.warning ("Unable to refresh CTD store: {0}".format (e))
+
+    def refresh (self, force=False, wait=True):
+        """ Rebuild the store if CTD has released new files since it was built, or unconditionally if
+        force. One process refreshes at a time; others wait for it, or if not wait, leave it to it and
+        return False. Returns whether the store was rebuilt. """
+        lock = BuildLock (self.store_path)
+        if not lock.acquire (wait=wait):
+            logger.debug ("CTD store is being refreshed by another process")
+            return False
+        try:
+            if not self.update (force=force):
+                return False
+        finally:
+            lock.release ()
+        self._store = CTDStore (self.store_path)
+        return True
+
+    def update (self, force=False):
+        """ Rebuild the store if CTD has released new files since it was built, or unconditionally if
+        force, holding the build lock. Each file is first asked about conditionally on the ETag and
+        Last-Modified it was built from, so an unchanged release is never downloaded. New files are then
+        downloaded one after the other, decompressed and parsed as they stream in, straight into the
+        store, without touching the disk. Returns whether the store was rebuilt. """
+        store = None
+        if not force:
+            try:
+                store = CTDStore (self.store_path)
+            except (OSError, MappedFileError):
+                pass
+        if store:
+            sources = store.header.get ('sources', {})
+            if not any (self.is_changed (f, sources.get (f, {})) for f in self.files):
+                logger.debug ("CTD is unchanged since {0}".format (store.header['built']))
+                os.utime (self.store_path)
+                return False
+        # Filled in as each file starts streaming, before build_store writes the header.
+        validators = OrderedDict ()
+        build_store (self.store_path, self.stream_file ('CTD_chemicals.tsv', validators),
+                     self.stream_file ('CTD_chem_gene_ixns.tsv', validators), header={ 'sources' : validators })
+        return True
+
+    def get_file_url (self, f):
+        return "{0}/{1}.gz".format (self.url, f)
+
+    def is_changed (self, f, validators):
+        """ Ask, without downloading it, whether one of CTD's gzipped TSVs differs from the version
+        validators identify. """
+        headers = {}
+        if validators.get ('etag', None):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get ('last_modified', None):
+            headers['If-Modified-Since'] = validators['last_modified']
+        response = self.http_request ('HEAD', self.get_file_url (f), headers=headers)
+        if response.status_code == 304:
+            return False
+        response.raise_for_status ()
+        etag = response.headers.get ('ETag', None)
+        return not (etag and etag == validators.get ('etag', None))
+
+    def stream_file (self, f, validators):
+        """ Download one of CTD's gzipped TSVs, yielding its lines as they arrive and recording the ETag
+        and Last-Modified it came with in validators. The request is made when the first line is asked
+        for, so nothing waits on an open response while another file is read. """
+        logger.debug ("  --requesting CTD component: {0}".format (f))
+        response = self.http_get (self.get_file_url (f), stream=True)
+        try:
+            response.raise_for_status ()
+            validators[f] = { 'etag' : response.headers.get ('ETag', None),
+                              'last_modified' : response.headers.get ('Last-Modified', None) }
+            for line in self.stream_lines (response):
+                yield line
+        finally:
+            response.close ()
+
+    def stream_lines (self, response):
+        """ Decompress a streamed gzipped response and yield its lines as they arrive, reading buffer_size
+        bytes at a time. Every member of a multi-member gzip is read, and a stream that ends before its
+        last member does raises EOFError, so a truncated download never makes a truncated store. """
+        decompressor = zlib.decompressobj (16 + zlib.MAX_WBITS)
+        pending = b''
+        for chunk in response.raw.stream (self.buffer_size, decode_content=False):
+            data = []
+            while chunk:
+                if decompressor.eof:
+                    # Another member follows, perhaps after zero padding.
+                    chunk = chunk.lstrip (b'\0')
+                    if not chunk:
+                        break
+                    decompressor = zlib.decompressobj (16 + zlib.MAX_WBITS)
+                data.append (decompressor.decompress (chunk))
+                chunk = decompressor.unused_data
+            lines = (pending + b''.join (data)).split (b'\n')
+            pending = lines.pop ()
+            for line in lines:
+                yield line.decode ('utf-8')
+        pending += decompressor.flush ()
+        if not decompressor.eof:
+            raise EOFError ("{0} ended before the end of its gzip stream".format (response.url))
+        for line in pending.split (b'\n'):
+            if line:
+                yield line.decode ('utf-8')
 
     def drugname_string_to_ctd_string(self,drugname):
         """This is exposed so that it can be used to look up names without the KNode structure"""
-        identifiers = self.name_to_id[ drugname.lower() ]
+        identifiers = self.store.get_chemicals( drugname.lower() )
         results = [ 'CTD:{}'.format(ident) for ident in identifiers ]
         return results
 
@@ -102,11 +319,10 @@ class CTD (Service):
         ctdid = Text.un_curie (subject.identifier)
         actions = set()
         edge_nodes=[]
-        for link in self.drug_genes[ctdid]:
-            target_id = link['gene_id']
-            edge_properties = { 'actions' : link['actions'],
-                                'publications': link ['publications'] }
-            actions.update( link['actions'] )
+        for target_id, link_actions, publications in self.store.get_interactions(ctdid):
+            edge_properties = { 'actions' : link_actions,
+                                'publications': publications }
+            actions.update( link_actions )
             edge = KEdge( 'ctd', 'drug_get_gene', {'properties': edge_properties } )
             node = KNode (target_id, node_types.GENE)
             edge_nodes.append( (edge, node) )
@@ -149,4 +365,14 @@ def test_all_drugs():
     print( '{} good ({})'.format( ngood, ngood/len(uniq) ) )
 
 if __name__ == "__main__":
-    test_all_drugs()
+    parser = argparse.ArgumentParser(description='CTD service.')
+    parser.add_argument('--build', help='Rebuild the CTD store from the latest CTD release.',
+                        action="store_true", default=False)
+    parser.add_argument('--refresh', help='Rebuild the CTD store if CTD has released new files.',
+                        action="store_true", default=False)
+    args = parser.parse_args ()
+    if args.build or args.refresh:
+        ctd = CTD(ServiceContext.create_context())
+        print ("Rebuilt" if ctd.refresh (force=args.build) else "Unchanged")
+    else:
+        test_all_drugs()
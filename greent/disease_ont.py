@@ -1,12 +1,12 @@
 from collections import defaultdict
-from csv import DictReader
 import logging
 import pronto
-import requests
 import os
 from greent.graph_components import KNode,KEdge,elements_to_json
 from greent import node_types
 from greent.service import Service
+from greent.crosswalk import get_crosswalk
+from greent.ontologies import registry
 
 class DiseaseOntology (Service):
     """ We use the Translator Disease Ontology service for other purposes but here, we fill a few gaps
@@ -16,21 +16,19 @@ class DiseaseOntology (Service):
         super(DiseaseOntology, self).__init__('diseaseontology', context)
         self.disease_ontology_data = 'doid.obo'
         self.initialized = False
-        self.pharos_map = None
-        self.pmap = None
 
     def load (self):
         """ Load the ontolgy. """
         if not os.path.exists (self.disease_ontology_data):
             url = self.url
             print ("Downloading disease ontology: {0}".format (url))
-            r = requests.get(url, stream=True)
+            r = self.http_get(url, stream=True)
             with open(self.disease_ontology_data, 'wb') as f:
                 for chunk in r.iter_content(chunk_size=1024): 
                     if chunk: # filter out keep-alive new chunks
                         f.write(chunk)
 
-        self.ont = pronto.Ontology (self.disease_ontology_data)
+        self.ont = registry.get ('doid', loader=lambda: pronto.Ontology (self.disease_ontology_data))
         self.doid_to_mesh_map = defaultdict(lambda:[])
         for term in self.ont:
             xref = None
@@ -54,16 +52,8 @@ class DiseaseOntology (Service):
     def doid_or_umls_to_pharos(self,doid):
         """ Convert a doid to a pharos id. Perhaps there's a public service that does this but in the
         mean time, we'll roll our own. """
-        if not self.pmap:
-            self.pmap = defaultdict(list)
-            with open(os.path.join(os.path.dirname(__file__), 'pharos.id.all.txt'),'r') as inf:     #'pharos.id.txt','r') as inf:
-                rows = DictReader(inf,dialect='excel-tab')
-                for row in rows:
-                    if row['DOID'] != '':
-                        doidlist = row['DOID'].split(',')
-                        for d in doidlist:
-                            self.pmap[d.upper()].append(row['PharosID'])
-        pharos_list = self.pmap[doid.identifier]
+        pmap = get_crosswalk('pharos.id.all.txt', 'DOID', 'PharosID', split=',', upper=True)
+        pharos_list = pmap.get(doid.identifier)
         if len(pharos_list) == 0:
             #logging.getLogger('application').warn('Unable to translate doid: %s into a Pharos ID' % doid)
             return []
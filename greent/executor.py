@@ -0,0 +1,94 @@
+import concurrent.futures
+import logging
+from collections import namedtuple
+from greent.admission import AdmissionController
+from greent.util import LoggingUtil
+
+logger = LoggingUtil.init_logging (__name__, level=logging.DEBUG)
+
+Call = namedtuple ('Call', [ 'service', 'function', 'argument', 'key' ])
+Call.__new__.__defaults__ = (None,)
+Outcome = namedtuple ('Outcome', [ 'result', 'error' ])
+
+class Deferred:
+    """ A future for a call made without a pool. The call runs on the calling thread when its result
+    is first requested, so abandoning a deferred call means it is never made. """
+
+    def __init__(self, function, call):
+        self.function = function
+        self.call = call
+        self.finished = False
+        self.cancelled = False
+        self.value = None
+
+    def result (self):
+        if self.cancelled:
+            raise concurrent.futures.CancelledError ()
+        if not self.finished:
+            self.value = self.function (self.call)
+            self.finished = True
+        return self.value
+
+    def done (self):
+        return self.finished or self.cancelled
+
+    def cancel (self):
+        if not self.finished:
+            self.cancelled = True
+        return self.cancelled
+
+class LevelExecutor:
+    """ Execute the operator calls making up one level of a Rosetta program.
+    With a concurrency of one, calls run serially on the calling thread, and only when their results
+    are requested. Otherwise they run on a bounded pool of worker threads. Either way each call is
+    admitted by the admission controller, which adapts the number of in-flight calls to each service
+    to how it is responding and skips calls to services that are down. Calls with a key are coalesced
+    through flights, if given: a call whose key matches one already in flight, from this executor or
+    any other sharing the flights, waits for that call's outcome rather than being made again. """
+
+    def __init__(self, concurrency=1, admission=None, flights=None):
+        """ Create an executor. Pass an admission controller to share what it has learned about services
+        across executors. """
+        self.concurrency = max (1, int (concurrency))
+        self.admission = admission if admission else AdmissionController ()
+        self.flights = flights
+        self.pool = None
+        if self.concurrency > 1:
+            self.pool = concurrent.futures.ThreadPoolExecutor (max_workers=self.concurrency)
+
+    def invoke (self, call):
+        """ Invoke one call, capturing its result or the exception it raised. """
+        try:
+            if self.flights and call.key is not None:
+                return Outcome (self.flights.do (call.key, self.admission.call,
+                                                 call.service, call.function, call.argument), None)
+            return Outcome (self.admission.call (call.service, call.function, call.argument), None)
+        except Exception as e:
+            return Outcome (None, e)
+
+    def submit (self, call):
+        """ Submit a call, returning a future for its Outcome. """
+        if self.pool:
+            return self.pool.submit (self.invoke, call)
+        return Deferred (self.invoke, call)
+
+    def as_completed (self, futures):
+        """ Iterate over futures as they complete. Without a pool, that is the order they were submitted. """
+        if self.pool:
+            return concurrent.futures.as_completed (futures)
+        return iter (futures)
+
+    def execute (self, calls):
+        """ Execute a list of calls, returning a list of Outcomes in the same order. """
+        return [ future.result () for future in [ self.submit (call) for call in calls ] ]
+
+    def shutdown (self):
+        if self.pool:
+            self.pool.shutdown (wait=True)
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.shutdown ()
@@ -1,6 +1,6 @@
 from greent.service import Service
 from greent.service import ServiceContext
-from ontobio.ontol_factory import OntologyFactory
+from greent.ontologies import registry
 
 CELLULAR_COMPONENT='GO:0005575'
 MOLECULAR_FUNCTION='GO:0005674'
@@ -12,15 +12,13 @@ class GO(Service):
     """ A pragmatic class to query the gene  ontology. Until better sources emerge, we roll our own. """ 
     def __init__(self, context ):
         super(GO, self).__init__("go", context)
-        ofactory = OntologyFactory()
-        try:
-            #sometimes the ontology world is down :(
-            self.ont = ofactory.create('go')
-        except:
-            self.ont = ofactory.create('obo:go')
-        #self.ont = ofactory.create('./mondo.owl')
-        #This seems to be required to make the ontology actually load:
-        _ = self.ont.get_level(0)
+        #Shared with every other user of go in the process, so read only.
+        self.ont = registry.get('go', snapshot=context.config.get_service('go').get('snapshot'))
+
+    @property
+    def closure(self):
+        """The ancestor closure index of go, built the first time it's needed."""
+        return registry.get_closure('go')
         
     def get_label(self,identifier):
         """Return the label for an identifier"""
@@ -28,9 +26,11 @@ class GO(Service):
 
     def has_ancestor(self,identifier, term):
         """Determine whether a term has a particular ancestor"""
-        #TODO: The return signature is funky, fix it.
-        ancestors = self.ont.ancestors(identifier)
-        return term in ancestors
+        return self.closure.is_descendant(identifier, term)
+
+    def has_ancestor_batch(self,identifiers, term):
+        """Determine, for each of a list of terms in turn, whether it has a particular ancestor"""
+        return [ len(roots) > 0 for roots in self.closure.classify(identifiers, [term]) ]
 
     def is_cellular_component(self,identifier):
         """Checks go to find whether the subject is a cellular component"""
@@ -38,7 +38,11 @@ class GO(Service):
     def is_biological_process(self,identifier):
         """Checks go to find whether the subject is a cellular component"""
         return self.has_ancestor(identifier, BIOLOGICAL_PROCESS)
+    def is_biological_process_batch(self,identifiers):
+        return self.has_ancestor_batch(identifiers, BIOLOGICAL_PROCESS)
     def is_molecular_function(self,identifier):
         """Checks go to find whether the subject is a cellular component"""
         return self.has_ancestor(identifier, MOLECULAR_FUNCTION)
+    def is_molecular_function_batch(self,identifiers):
+        return self.has_ancestor_batch(identifiers, MOLECULAR_FUNCTION)
 
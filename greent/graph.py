@@ -1,11 +1,19 @@
+import copy
+import json
 import logging
+import os
+import threading
+import time
 import traceback
+import uuid
+from collections import defaultdict
 
 from neo4jrestclient.client import GraphDatabase
 from neo4jrestclient.exceptions import TransactionException
 
 from greent.service import Service
 from greent.util import LoggingUtil
+from greent.util import Resource
 
 logger = LoggingUtil.init_logging(__file__, level=logging.DEBUG)
 
@@ -21,8 +29,13 @@ class TypeGraph(Service):
            * Receives a label for the connected concept
            * Is the source of an is_a link connecting to the concept node.
         This enables queries between concept spaces to return alternative paths of operations
+        Programs compiled from path queries are cached by query text, in memory and on disk, along with the
+        version of the type graph they were compiled from. The version is stored in the graph and changed
+        whenever the graph is, so every process using the graph drops programs compiled from an old one.
     """
 
+    SET_VERSION = "MERGE (v:TypeGraphVersion) SET v.version = $version"
+
     def __init__(self, service_context):
         """ Construct a type graph, registering labels for concepts and types. """
         super(TypeGraph, self).__init__("rosetta-graph", service_context)
@@ -31,6 +44,12 @@ class TypeGraph(Service):
         self.concepts = {}
         self.type_to_concept = {}
         self.concept_metadata = None
+        self.program_cache_path = Resource.get_resource_path(
+            service_context.config.get_service(self.name).get("program_cache", "rosetta_programs.json"))
+        self.version_check_interval = service_context.config.get_service(self.name).get("version_check_interval", 60)
+        self.version_checked = 0
+        self.program_cache_lock = threading.Lock()
+        self.program_cache_version, self.program_cache = self.load_program_cache()
 
     def initialize_connection(self):
         logger.debug("Creating type labels")
@@ -38,6 +57,69 @@ class TypeGraph(Service):
         self.types = self.db.labels.create("Type")
         self.concept_label = self.db.labels.create("Concept")
 
+    def load_program_cache(self):
+        """ Load programs compiled by an earlier process, returning the type graph version they were
+        compiled from and the programs. """
+        version, programs = None, {}
+        if os.path.exists(self.program_cache_path):
+            try:
+                with open(self.program_cache_path, 'r') as stream:
+                    cache = json.load(stream)
+                version, programs = cache['version'], cache['programs']
+                logger.debug("Loaded {0} cached programs from {1}".format(len(programs), self.program_cache_path))
+            except Exception as e:
+                logger.warning("Ignoring unreadable program cache {0}: {1}".format(self.program_cache_path, e))
+        return version, programs
+
+    def save_program_cache(self):
+        """ Write compiled programs to disk. Write a temporary file and move it so readers never see a partial file. """
+        try:
+            temp_path = "{0}.{1}.tmp".format(self.program_cache_path, os.getpid())
+            with open(temp_path, 'w') as stream:
+                json.dump({ 'version' : self.program_cache_version, 'programs' : self.program_cache }, stream, indent=2)
+            os.replace(temp_path, self.program_cache_path)
+        except Exception as e:
+            logger.warning("Unable to save program cache {0}: {1}".format(self.program_cache_path, e))
+
+    def get_version(self):
+        """ Get the version of the type graph stored in it, or None if it has none. """
+        rows = self.select("MATCH (v:TypeGraphVersion) RETURN v.version")
+        return rows[0] if len(rows) > 0 else None
+
+    def set_version(self, version=None):
+        """ Record that the type graph has changed, giving it a new version, or the version given. Programs
+        compiled from the old graph are dropped here, and by other processes when they next check. """
+        version = version if version else uuid.uuid4().hex
+        self.db.query(self.SET_VERSION, params={ 'version' : version })
+        self.reset_program_cache(version)
+        return version
+
+    def reset_program_cache(self, version):
+        """ Drop compiled programs, which will next be compiled from the given version of the graph. """
+        with self.program_cache_lock:
+            self.program_cache_version = version
+            self.program_cache = {}
+            self.version_checked = time.time()
+
+    def check_version(self):
+        """ Drop compiled programs if the type graph's version has changed since they were compiled. The
+        graph is asked at most once every version_check_interval seconds. """
+        with self.program_cache_lock:
+            if time.time() < self.version_checked + self.version_check_interval:
+                return
+            self.version_checked = time.time()
+        try:
+            version = self.get_version()
+        except Exception as e:
+            logger.warning("Unable to get the type graph version: {0}".format(e))
+            return
+        with self.program_cache_lock:
+            if version != self.program_cache_version:
+                logger.debug("Type graph version is {0}; dropping programs compiled from {1}".format(
+                    version, self.program_cache_version))
+                self.program_cache_version = version
+                self.program_cache = {}
+
     def delete_all(self):
         """ Delete the type-graph only.  Leave result graphs alone. """
         try:
@@ -45,6 +127,7 @@ class TypeGraph(Service):
                 self.db.query("MATCH (n:Concept) DETACH DELETE n")
                 self.db.query("MATCH (n:Type) DETACH DELETE n")
             self.initialize_connection()
+            self.set_version()
         except Exception as e:
             traceback.print_exc()
 
@@ -74,6 +157,7 @@ class TypeGraph(Service):
                 self.concepts[concept].add(n)
                 concept_node = self._find_or_create_concept(concept)
                 n.relationships.create("is_a", concept_node)
+            self.set_version()
         return n
 
     def add_edge(self, a, b, rel_name, predicate, op):
@@ -102,6 +186,7 @@ class TypeGraph(Service):
                 concept_rels = a_concept_node.relationships.outgoing(CONCEPT_RELATION_NAME)
                 if b_concept_node not in [rel.end for rel in concept_rels]:
                     a_concept_node.relationships.create(CONCEPT_RELATION_NAME, b_concept_node)
+            self.set_version()
 
     def _find_or_create_concept(self, concept):
         """ Find or create a concept object which will be linked to member type object. """
@@ -116,6 +201,146 @@ class TypeGraph(Service):
             concept_node = self.concept_label.create(name=concept)
         return concept_node
 
+    def bulk_load(self, graph):
+        """ Write a type graph built client side, eg a MemoryTypeGraph, to Neo4j, making Neo4j's match it.
+        Existing concepts, types and transitions are read first so only what changed is written: what's gone
+        from the graph is deleted, what's new is created, and types whose iri or concept changed are updated.
+        Writes are grouped into a few UNWIND statements, one per label or relationship type, executed in one
+        transaction. """
+        existing_concepts = set(self.select("MATCH (c:Concept) RETURN c.name"))
+        existing_types = { name : (iri, concept) for name, iri, concept in self.select(
+            "MATCH (n:Type) OPTIONAL MATCH (n)-[:is_a]->(c:Concept) RETURN n.name, n.iri, c.name") }
+        existing_transitions = set(map(tuple, self.select(
+            "MATCH (a:Type)-[r]->(b:Type) RETURN a.name, type(r), r.op, b.name")))
+        existing_translations = set(map(tuple, self.select(
+            "MATCH (a:Concept)-[:translation]->(b:Concept) RETURN a.name, b.name")))
+
+        transitions = {}
+        for a, edges in graph.transitions.items():
+            for b, rel_name, properties in edges:
+                transitions[(a, rel_name, properties['op'], b)] = dict(properties, a=a, b=b)
+        translations = set()
+        for a, b in graph.concept_transitions:
+            if not a or not b:
+                logger.error("Not linking concepts {0} and {1}. Every transition type needs a concept.".format(a, b))
+            else:
+                translations.add((a, b))
+
+        statements = []
+        old_transitions = defaultdict(list)
+        for a, rel_name, op, b in existing_transitions - set(transitions.keys()):
+            old_transitions[rel_name].append({ 'a' : a, 'op' : op, 'b' : b })
+        for rel_name, edges in old_transitions.items():
+            statements.append((
+                "UNWIND $transitions AS t MATCH (:Type {{name: t.a}})-[r:{0}]->(:Type {{name: t.b}}) " \
+                "WHERE r.op = t.op DELETE r".format(self.quote(rel_name)),
+                { 'transitions' : edges }))
+        old_translations = [ { 'a' : a, 'b' : b } for a, b in existing_translations - translations ]
+        if len(old_translations) > 0:
+            statements.append((
+                "UNWIND $translations AS t MATCH (:Concept {name: t.a})-[r:translation]->(:Concept {name: t.b}) DELETE r",
+                { 'translations' : old_translations }))
+
+        old_types = [ name for name in existing_types if not name in graph.types ]
+        if len(old_types) > 0:
+            statements.append(("UNWIND $names AS name MATCH (n:Type {name: name}) DETACH DELETE n", { 'names' : old_types }))
+        new_types = defaultdict(list)
+        changed_iris = []
+        unlinked_types = defaultdict(list)
+        relinked_types = defaultdict(list)
+        for name, node in graph.types.items():
+            concept = graph.type_to_concept.get(name)
+            if not name in existing_types:
+                new_types[concept].append({ 'name' : name, 'iri' : node['iri'] })
+                continue
+            iri, existing_concept = existing_types[name]
+            if node['iri'] and iri != node['iri']:
+                changed_iris.append({ 'name' : name, 'iri' : node['iri'] })
+            if concept != existing_concept:
+                if existing_concept:
+                    unlinked_types[existing_concept].append(name)
+                if concept:
+                    relinked_types[concept].append(name)
+        for concept, names in unlinked_types.items():
+            statements.append((
+                "UNWIND $names AS name MATCH (n:Type {{name: name}})-[r:is_a]->(:Concept) DELETE r REMOVE n:{0}".format(
+                    self.quote(concept)),
+                { 'names' : names }))
+
+        old_concepts = [ c for c in existing_concepts if not c in graph.concepts ]
+        if len(old_concepts) > 0:
+            statements.append(("UNWIND $names AS name MATCH (c:Concept {name: name}) DETACH DELETE c", { 'names' : old_concepts }))
+        concepts = [ c for c in graph.concepts if not c in existing_concepts ]
+        if len(concepts) > 0:
+            statements.append(("UNWIND $names AS name CREATE (:Concept {name: name})", { 'names' : concepts }))
+
+        for concept, types in new_types.items():
+            if concept:
+                statements.append((
+                    "MATCH (c:Concept {{name: $concept}}) UNWIND $types AS t " \
+                    "CREATE (n:Type:{0} {{name: t.name, iri: t.iri}})-[:is_a]->(c)".format(self.quote(concept)),
+                    { 'concept' : concept, 'types' : types }))
+            else:
+                statements.append(("UNWIND $types AS t CREATE (:Type {name: t.name, iri: t.iri})", { 'types' : types }))
+        if len(changed_iris) > 0:
+            statements.append(("UNWIND $types AS t MATCH (n:Type {name: t.name}) SET n.iri = t.iri",
+                               { 'types' : changed_iris }))
+        for concept, names in relinked_types.items():
+            statements.append((
+                "MATCH (c:Concept {{name: $concept}}) UNWIND $names AS name MATCH (n:Type {{name: name}}) " \
+                "SET n:{0} CREATE (n)-[:is_a]->(c)".format(self.quote(concept)),
+                { 'concept' : concept, 'names' : names }))
+
+        new_transitions = defaultdict(list)
+        for key, properties in transitions.items():
+            if not key in existing_transitions:
+                new_transitions[key[1]].append(properties)
+        for rel_name, edges in new_transitions.items():
+            statements.append((
+                "UNWIND $transitions AS t MATCH (a:Type {{name: t.a}}), (b:Type {{name: t.b}}) " \
+                "CREATE (a)-[:{0} {{predicate: t.predicate, op: t.op, enabled: t.enabled, synonym: t.synonym}}]->(b)".format(
+                    self.quote(rel_name)),
+                { 'transitions' : edges }))
+        new_translations = [ { 'a' : a, 'b' : b } for a, b in translations - existing_translations ]
+        if len(new_translations) > 0:
+            statements.append((
+                "UNWIND $translations AS t MATCH (a:Concept {name: t.a}), (b:Concept {name: t.b}) " \
+                "CREATE (a)-[:translation]->(b)",
+                { 'translations' : new_translations }))
+
+        version = graph.get_version()
+        if version != self.get_version():
+            statements.append((self.SET_VERSION, { 'version' : version }))
+
+        logger.debug("-- Writing type graph: {0} concepts, {1} types, {2} transitions, {3} translations created; " \
+                     "{4} concepts, {5} types, {6} transitions, {7} translations deleted; {8} types changed; {9} statements".format(
+            len(concepts), sum(map(len, new_types.values())), sum(map(len, new_transitions.values())), len(new_translations),
+            len(old_concepts), len(old_types), sum(map(len, old_transitions.values())), len(old_translations),
+            len(set([ t['name'] for t in changed_iris ] + sum(unlinked_types.values(), []) + sum(relinked_types.values(), []))),
+            len(statements)))
+        if len(statements) == 0:
+            return
+        transaction = self.db.transaction(for_query=True)
+        try:
+            for statement, params in statements:
+                transaction.append(statement, params=params)
+            transaction.execute()
+            transaction.commit()
+        except Exception:
+            transaction.rollback()
+            raise
+        self.reset_program_cache(version)
+
+    def select(self, query):
+        """ Run a read query, returning its rows. Single column rows are flattened to values. """
+        result = self.db.query(query, data_contents=True)
+        rows = result.rows if result.rows else []
+        return [ row[0] if len(row) == 1 else row for row in rows ]
+
+    def quote(self, name):
+        """ Quote a label or relationship type for use in a cypher statement. """
+        return "`{0}`".format(name.replace("`", "``"))
+
     def run_cypher_query(self,query):
         try:
             result = self.db.query(query, data_contents=True)
@@ -126,13 +351,31 @@ class TypeGraph(Service):
         return result
 
     def get_transitions(self, query):
-        """ Execute a cypher query and walk the results to build a set of transitions to execute. """
+        """ Execute a cypher query and walk the results to build a set of transitions to execute.
+        Compiled programs are cached by query. Callers get a copy they are free to modify. """
+        self.check_version()
+        with self.program_cache_lock:
+            version = self.program_cache_version
+            programs = self.program_cache.get(query, None)
+        if programs is None:
+            result = self.db.query(query, data_contents=True)
+            programs = TypeGraph.compile_programs(result.rows)
+            with self.program_cache_lock:
+                if version == self.program_cache_version:
+                    self.program_cache[query] = programs
+                    self.save_program_cache()
+        return copy.deepcopy(programs)
+
+    @staticmethod
+    def compile_programs(rows):
+        """ Build programs from path query result rows. Each row set is a path; each program is a list of
+        levels, one per node type along the path, holding the operators leading out of that type. """
         programs = []
-        result = self.db.query(query, data_contents=True)
-        if result.rows is None:
-            return []
-        for row_set in result.rows:
+        if rows is None:
+            return programs
+        for row_set in rows:
             program = []
+            levels = {}
             for row in row_set:
                 # logger.debug (json.dumps (row, indent=2))
                 node_type = None
@@ -144,26 +387,18 @@ class TypeGraph(Service):
                             # logger.debug ("  --result type: {0}".format (col))
                             node_type = col['name']
                         elif 'op' in col:
-                            op = col['op']
-                            predicate = col['predicate']
-                            is_new = True
-                            for level in program:
-                                if level['node_type'] == node_type:
-                                    level['ops'].append({
-                                        'link': predicate,
-                                        'op': op
-                                    })
-                                    is_new = False
-                            if is_new:
-                                program.append({
+                            op = {
+                                'link': col['predicate'],
+                                'op': col['op']
+                            }
+                            if node_type in levels:
+                                levels[node_type]['ops'].append(op)
+                            else:
+                                levels[node_type] = {
                                     'node_type': node_type,
-                                    'ops': [
-                                        {
-                                            'link': predicate,
-                                            'op': op
-                                        }
-                                    ],
+                                    'ops': [ op ],
                                     'collector': []
-                                })
+                                }
+                                program.append(levels[node_type])
             programs.append(program)
         return programs
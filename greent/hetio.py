@@ -7,6 +7,7 @@ from greent.util import Text
 from greent.graph_components import KEdge, KNode
 from greent import node_types 
 from greent.service import ServiceContext
+from greent.service import batch_operator
 
 class HetIO(Neo4JREST):
 
@@ -16,43 +17,67 @@ class HetIO(Neo4JREST):
     def munge_gene (self, gene):
         return gene.split ("/")[-1:][0] if gene.startswith ("http://") else gene
 
+    @batch_operator ('gene_to_anatomy_batch')
     def gene_to_anatomy (self, gene):
-        result = self.query (
-            "MATCH (a:Anatomy)-[ar]-(g:Gene) WHERE g.name='{0}' RETURN a, ar, g LIMIT 200".format (Text.un_curie (gene.identifier)),
+        return self.gene_to_anatomy_batch ([ gene ]).get (gene.identifier, [])
+
+    def gene_to_anatomy_batch (self, genes):
+        """ Batch form of gene_to_anatomy, querying for all the genes in one request. """
+        results = self.query_batch (
+            [ "MATCH (a:Anatomy)-[ar]-(g:Gene) WHERE g.name='{0}' RETURN a, ar, g LIMIT 200".format (Text.un_curie (gene.identifier))
+              for gene in genes ],
             labels=['Anatomy'],
             node_properties=['identifier'])
-        print (result)
-        return [ ( self.get_edge ({ 'res', r }, predicate='involved_in'), KNode(r['identifier'],  node_types.ANATOMY) ) for r in result ]
-    
+        return { gene.identifier : [ ( self.get_edge ({ 'res' : r }, predicate='involved_in'), KNode(r['identifier'],  node_types.ANATOMY) ) for r in result ]
+                 for gene, result in zip (genes, results) }
+
+    @batch_operator ('gene_to_cell_batch')
     def gene_to_cell (self, gene):
-        result = self.query (
-            "MATCH (g:Gene)-[r]-(c:CellularComponent) WHERE g.name='{0}' RETURN g, r, c LIMIT 200".format (Text.un_curie (gene.identifier)),
+        return self.gene_to_cell_batch ([ gene ]).get (gene.identifier, [])
+
+    def gene_to_cell_batch (self, genes):
+        """ Batch form of gene_to_cell, querying for all the genes in one request. """
+        results = self.query_batch (
+            [ "MATCH (g:Gene)-[r]-(c:CellularComponent) WHERE g.name='{0}' RETURN g, r, c LIMIT 200".format (Text.un_curie (gene.identifier))
+              for gene in genes ],
             labels=['CellularComponent'],
             node_properties=['identifier'])
-        return [ ( self.get_edge ({ 'res' : r }, predicate='affects'), KNode(r['identifier'], node_types.CELLULAR_COMPONENT) ) for r in result ]
+        return { gene.identifier : [ ( self.get_edge ({ 'res' : r }, predicate='affects'), KNode(r['identifier'], node_types.CELLULAR_COMPONENT) ) for r in result ]
+                 for gene, result in zip (genes, results) }
 
+    @batch_operator ('gene_to_disease_batch')
     def gene_to_disease (self, gene):
-        if not Text.get_curie(gene.identifier) in [ 'HGNC', 'UNIPROT', 'PHAROS' ]:
-            return []
-        result = self.query (
-            "MATCH (d:Disease)-[a1]-(g:Gene) WHERE g.name='{0}' RETURN a1,d".format (Text.un_curie(gene.identifier)),
+        return self.gene_to_disease_batch ([ gene ]).get (gene.identifier, [])
+
+    def gene_to_disease_batch (self, genes):
+        """ Batch form of gene_to_disease, querying for all the genes with a suitable curie in one request. """
+        genes = [ gene for gene in genes if Text.get_curie(gene.identifier) in [ 'HGNC', 'UNIPROT', 'PHAROS' ] ]
+        if len(genes) == 0:
+            return {}
+        results = self.query_batch (
+            [ "MATCH (d:Disease)-[a1]-(g:Gene) WHERE g.name='{0}' RETURN a1,d".format (Text.un_curie(gene.identifier))
+              for gene in genes ],
             labels=['Disease'])
-        #        result = self.nodes_and_edges (result)
-        for r in result:
-            print (r)
-            print (result)
-            print (type(result))
-        #print ("-------------------> {}".format (json.dumps (result, indent=2)))
-        return [ ( self.get_edge ({ 'res' : r }, predicate='affects'), KNode(r['identifier'], node_types.DISEASE) ) for r in result ]
-    
+        return { gene.identifier : [ ( self.get_edge ({ 'res' : r }, predicate='affects'), KNode(r['identifier'], node_types.DISEASE) ) for r in result ]
+                 for gene, result in zip (genes, results) }
+
+    @batch_operator ('disease_to_phenotype_batch')
     def disease_to_phenotype (self, disease):
-        query = """MATCH (d:Disease{identifier:'%s'})-[r]-(s:Symptom) RETURN d,r,s""" % (disease.identifier)
-        result = self.query (query, labels=['Symptom'], node_properties=None)
-        edge_node = []
-        for r in result:
-            if r['source'] == 'MeSH':
-                edge_node.append ( ( self.get_edge ({ 'res' : r }, predicate='affects'), KNode("MESH:{0}".format (r['identifier']), node_types.PHENOTYPE) ) )
-        return edge_node
+        return self.disease_to_phenotype_batch ([ disease ]).get (disease.identifier, [])
+
+    def disease_to_phenotype_batch (self, diseases):
+        """ Batch form of disease_to_phenotype, querying for all the diseases in one request. """
+        results = self.query_batch (
+            [ """MATCH (d:Disease{identifier:'%s'})-[r]-(s:Symptom) RETURN d,r,s""" % (disease.identifier) for disease in diseases ],
+            labels=['Symptom'],
+            node_properties=None)
+        edge_nodes = {}
+        for disease, result in zip (diseases, results):
+            edge_node = edge_nodes.setdefault (disease.identifier, [])
+            for r in result:
+                if r['source'] == 'MeSH':
+                    edge_node.append ( ( self.get_edge ({ 'res' : r }, predicate='affects'), KNode("MESH:{0}".format (r['identifier']), node_types.PHENOTYPE) ) )
+        return edge_nodes
     
         #return [ ( self.get_edge ({ 'res' : r }, predicate='affects'), KNode("MESH:{0}".format (r['identifier']), 'PH') ) for r in result ]
         
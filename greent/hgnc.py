@@ -1,5 +1,4 @@
 import json
-import requests
 from greent import node_types
 from greent.graph_components import KNode, KEdge
 from greent.service import Service
@@ -23,7 +22,7 @@ class HGNC(Service):
             raise ValueError('Node must represent an HGNC or NCBIGene id.')
         hgnc_id = identifier_parts[1]
         headers = {'Accept':'application/json'}
-        r = requests.get('%s/%s/%s' % (self.url, query_string, hgnc_id), headers= headers).json()
+        r = self.http_get('%s/%s/%s' % (self.url, query_string, hgnc_id), headers= headers).json()
         symbol = r['response']['docs'][0]['symbol']
         return symbol 
 
@@ -37,7 +36,7 @@ class HGNC(Service):
             raise ValueError('Node must represent an NCBIGENE identifier.')
         hgnc_id = identifier_parts[1]
         headers = {'Accept':'application/json'}
-        r = requests.get('{0}/entrez_id/{1}'.format(self.url, hgnc_id), headers= headers).json()
+        r = self.http_get('{0}/entrez_id/{1}'.format(self.url, hgnc_id), headers= headers).json()
         try:
             uniprots = r['response']['docs'][0]['uniprot_ids']
             return  [  ( KEdge( 'hgnc', 'ncbigene_to_uniprotkb', is_synonym=True ),\
@@ -56,7 +55,7 @@ class HGNC(Service):
             raise ValueError('Node must represent an HGNC identifier.')
         hgnc_id = identifier_parts[1]
         headers = {'Accept':'application/json'}
-        r = requests.get('{0}/hgnc_id/{1}'.format(self.url, hgnc_id), headers= headers).json()
+        r = self.http_get('{0}/hgnc_id/{1}'.format(self.url, hgnc_id), headers= headers).json()
         try:
             uniprots = r['response']['docs'][0]['uniprot_ids']
             return  [  ( KEdge( 'hgnc', 'ncbigene_to_uniprotkb', is_synonym=True ),\
@@ -1,6 +1,6 @@
 from greent.service import Service
 from greent.service import ServiceContext
-from ontobio.ontol_factory import OntologyFactory
+from greent.ontologies import registry
 from greent.graph_components import KNode, KEdge
 from greent.util import LoggingUtil
 from greent import node_types
@@ -16,30 +16,31 @@ class HPO(Service):
     """ A pragmatic class to query the mondo ontology. Until better sources emerge, we roll our own. """ 
     def __init__(self, context ):
         super(HPO, self).__init__("hpo", context)
-        ofactory = OntologyFactory()
-        try:
-            #sometimes the ontology world is down :(
-            self.ont = ofactory.create('hp')
-        except:
-            logger.warn('Problem reaching sparql endpoint, falling back to obo')
-            try:
-                self.ont = ofactory.create('obo:hp')
-            except:
-                logger.error('Problem reaching obo, add local owl file')
-                import sys
-                sys.exit(1)
-                #self.ont = ofactory.create('onto_cache/hpo.owl')
-        #This seems to be required to make the ontology actually load:
-        _ = self.ont.get_level(0)
+        #Shared with every other user of hp in the process, so read only.
+        self.ont = registry.get('hp', snapshot=context.config.get_service('hpo').get('snapshot'))
+
+    @property
+    def closure(self):
+        """The ancestor closure index of hp, built the first time it's needed."""
+        return registry.get_closure('hp')
+
+    @property
+    def xref_index(self):
+        """The xref index of hp, built the first time it's needed."""
+        return registry.get_xrefs('hp')
+
+    @property
+    def label_index(self):
+        """The label and synonym index of hp, built the first time it's needed."""
+        return registry.get_labels('hp')
         
 
     def hp_get_synonym(self,hp_identifier,curie_prefix):
-        xref_ids = self.ont.xrefs(hp_identifier)
-        doids = []
-        for xref_id in xref_ids:
-            if xref_id.startswith(curie_prefix):
-                doids.append( xref_id )
-        return doids
+        return self.xref_index.get_xrefs(hp_identifier, curie_prefix)
+
+    def hp_get_synonym_batch(self,hp_identifiers,curie_prefix):
+        """Like hp_get_synonym, for each of a list of identifiers in turn"""
+        return self.xref_index.get_xrefs_batch(hp_identifiers, curie_prefix)
 
     def get_label(self,identifier):
         """Return the label for an identifier"""
@@ -51,9 +52,13 @@ class HPO(Service):
         if self.ont.has_node(obj_id):
             obj_ids = [obj_id]
         else:
-            obj_ids = self.ont.xrefs(obj_id, bidirectional=True)
+            obj_ids = self.xref_index.get_terms(obj_id)
         return obj_ids
 
+    def get_hp_id_batch(self,obj_ids):
+        """Like get_hp_id, for each of a list of ids in turn"""
+        return [ self.get_hp_id(obj_id) for obj_id in obj_ids ]
+
     def has_ancestor(self,obj, terms):
         """Given an object and a term in MONDO, determine whether the term is an ancestor of the object.
         
@@ -66,23 +71,29 @@ class HPO(Service):
                          ancestor.
                  The list of Mondo identifiers for the object, which have the term as an ancestor"""
         #TODO: The return signature is funky, fix it.
-        obj_id = obj.identifier
-        obj_ids = self.get_hp_id(obj_id)
-        return_objects=[]
-        for obj_id in obj_ids:
-            ancestors = self.ont.ancestors(obj_id)
-            for term in terms:
-                if term in ancestors:
-                    return_objects.append( obj_id )
-        return len(return_objects) > 0, return_objects
+        return self.has_ancestor_batch([obj], terms)[0]
+
+    def has_ancestor_batch(self,objs, terms):
+        """Like has_ancestor, for each of a list of objects in turn, classifying them all in one pass over
+        the closure index."""
+        obj_ids = self.get_hp_id_batch([ obj.identifier for obj in objs ])
+        classes = iter(self.closure.classify([ i for ids in obj_ids for i in ids ], terms))
+        results = []
+        for ids in obj_ids:
+            return_objects = []
+            for obj_id in ids:
+                return_objects.extend( [ obj_id ] * len(next(classes)) )
+            results.append( (len(return_objects) > 0, return_objects) )
+        return results
 
     def substring_search(self,name):
-        ciname = '(?i){}'.format(name)
-        results = self.ont.search(ciname,synonyms=True,is_regex=True)
+        return self.label_index.search_substring(name)
 
     def case_insensitive_search(self,name):
-        ciname = '(?i)^{}$'.format(name)
-        return self.ont.search(ciname,synonyms=True,is_regex=True)
+        return self.label_index.search(name)
+
+    def fuzzy_search(self,name,threshold=0.5,limit=10):
+        return self.label_index.search_fuzzy(name,threshold,limit)
 
     def search(self, name):
         #Exact match 
@@ -96,6 +107,10 @@ class HPO(Service):
                 results = self.case_insensitive_search(newname)
         return results
 
+    def search_batch(self, names):
+        """Resolve each of a list of names in turn, as search does"""
+        return [ self.search(name) for name in names ]
+
 
 
 def test():
@@ -1,5 +1,4 @@
 import pronto
-import requests
 import os
 from collections import defaultdict
 from greent.graph_components import KEdge,KNode
@@ -13,7 +12,7 @@ class HumanPhenotypeOntology (Service):
         if not os.path.exists (hpo_data):
             #url = "http://purl.obolibrary.org/obo/hp.obo"
             print ("Downloading human phenotype ontology: {0}".format (self.url))
-            r = requests.get(self.url, stream=True)
+            r = self.http_get(self.url, stream=True)
             with open(hpo_data, 'wb') as f:
                 for chunk in r.iter_content(chunk_size=1024): 
                     if chunk: # filter out keep-alive new chunks
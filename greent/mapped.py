@@ -0,0 +1,192 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+class MappedFileError(Exception):
+    """ Raised for a file that isn't a mapped file of the expected kind and format. """
+    pass
+
+class SectionWriter:
+    """ Lay out and write a file MappedFile can read: MAGIC, the format version and the length of a JSON
+    header, followed by the header and 8 byte aligned sections. Sections are either utf-8 blobs or arrays
+    of unsigned ints. Strings go in a blob with an offsets array of one more entry than there are strings,
+    string i being blob[offsets[i]:offsets[i+1]]. A list per item goes in a flat list with an index array
+    giving each item's range in it. """
+
+    def __init__(self):
+        self.sections = []
+
+    def add_strings (self, blob_name, offsets_name, values):
+        blob = bytearray ()
+        offsets = array ('I', [ 0 ])
+        for value in values:
+            blob.extend (value.encode ('utf-8'))
+            offsets.append (len(blob))
+        self.sections.append ((blob_name, bytes (blob), None))
+        self.sections.append ((offsets_name, offsets.tobytes (), 'I'))
+
+    def add_array (self, section, values):
+        self.sections.append ((section, array ('I', values).tobytes (), 'I'))
+
+    def add_lists (self, index_name, values):
+        """ Add the index of a list per item, returning the flattened list for the caller to add. """
+        index = [ 0 ]
+        flat = []
+        for value in values:
+            flat.extend (value)
+            index.append (len(flat))
+        self.add_array (index_name, index)
+        return flat
+
+    def write (self, path, magic, format_version, header):
+        """ Write the sections and header to path. The file is written alongside path and moved into place,
+        so processes that have the old file mapped keep a consistent view. """
+        header = dict (header, byteorder=sys.byteorder, sections={})
+        # Section offsets depend on the header's length, which depends on the offsets. Lay the sections
+        # out with room for the header to grow until it fits.
+        reserve = 4096
+        start = len(magic) + 8
+        while True:
+            offset = start + reserve
+            for section, data, typecode in self.sections:
+                header['sections'][section] = [ offset, len(data), typecode ]
+                offset += len(data) + (-len(data) % 8)
+            encoded = json.dumps (header).encode ('utf-8')
+            if len(encoded) <= reserve:
+                break
+            reserve *= 2
+        temp = "{0}.{1}.tmp".format (path, os.getpid ())
+        with open (temp, 'wb') as stream:
+            stream.write (magic)
+            stream.write (struct.pack ('<II', format_version, len(encoded)))
+            stream.write (encoded.ljust (reserve, b' '))
+            for section, data, typecode in self.sections:
+                stream.write (data)
+                stream.write (b'\0' * (-len(data) % 8))
+        os.replace (temp, path)
+        return header
+
+class BuildLock:
+    """ Keep processes from building the same file at once: a lock file alongside it, created only if it
+    doesn't exist, holding the builder's pid. A lock file older than stale seconds was left by a builder
+    that died, and is removed. Use it in a with statement to wait for the lock, or acquire (wait=False)
+    to give up if another process has it. """
+
+    def __init__(self, path, stale=3600, poll=1):
+        self.path = "{0}.lock".format (path)
+        self.stale = stale
+        self.poll = poll
+
+    def acquire (self, wait=True):
+        """ Take the lock, waiting for it unless wait is false. Returns whether the lock was taken. """
+        while True:
+            try:
+                fd = os.open (self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                try:
+                    if time.time () - os.path.getmtime (self.path) > self.stale:
+                        os.remove (self.path)
+                        continue
+                except OSError:
+                    continue
+                if not wait:
+                    return False
+                time.sleep (self.poll)
+                continue
+            with os.fdopen (fd, 'w') as stream:
+                stream.write (str (os.getpid ()))
+            return True
+
+    def release (self):
+        try:
+            os.remove (self.path)
+        except OSError:
+            pass
+
+    def __enter__ (self):
+        self.acquire ()
+        return self
+
+    def __exit__ (self, *args):
+        self.release ()
+
+def read_header (path):
+    """ Read the header of a file written by SectionWriter, of any kind, without mapping it. Every kind's
+    magic is eight bytes. """
+    with open (path, 'rb') as stream:
+        start = stream.read (16)
+        if len(start) < 16:
+            raise MappedFileError ("{0} is not a mapped file".format (path))
+        format_version, header_length = struct.unpack ('<II', start[8:])
+        try:
+            return json.loads (stream.read (header_length).decode ('utf-8'))
+        except ValueError:
+            raise MappedFileError ("{0} is not a mapped file".format (path))
+
+class MappedFile:
+    """ Read a file written by SectionWriter by memory mapping it. Nothing is parsed beyond the header, so
+    opening one is quick whatever its size, and processes mapping the same file share its pages. Subclasses
+    set magic, format_version and the error they raise. """
+
+    magic = None
+    format_version = None
+    error = MappedFileError
+
+    def __init__(self, path):
+        self.path = path
+        start = len(self.magic) + 8
+        with open (path, 'rb') as stream:
+            stat = os.fstat (stream.fileno ())
+            if stat.st_size < start:
+                raise self.error ("{0} is not a {1} file".format (path, self.magic.decode ()))
+            # A rebuilt file is moved into place, so a different inode at path means this one is old.
+            self.inode = stat.st_ino
+            self.mm = mmap.mmap (stream.fileno (), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(self.magic)] != self.magic:
+            raise self.error ("{0} is not a {1} file".format (path, self.magic.decode ()))
+        format_version, header_length = struct.unpack ('<II', self.mm[len(self.magic):start])
+        if format_version != self.format_version:
+            raise self.error ("{0} has format {1}; expected {2}. Rebuild it.".format (
+                path, format_version, self.format_version))
+        self.header = json.loads (self.mm[start:start + header_length].decode ('utf-8'))
+        if self.header['byteorder'] != sys.byteorder:
+            raise self.error ("{0} was built on a {1} endian machine".format (path, self.header['byteorder']))
+        view = memoryview (self.mm)
+        self.sections = {}
+        for section, (offset, length, typecode) in self.header['sections'].items ():
+            data = view[offset:offset + length]
+            self.sections[section] = data.cast (typecode) if typecode else data
+
+    def string (self, blob, offsets, index):
+        offsets = self.sections[offsets]
+        return bytes (self.sections[blob][offsets[index]:offsets[index + 1]]).decode ('utf-8')
+
+    def strings (self, blob, offsets, index, item):
+        """ Get an item's list of strings, given the list's index and the blob and offsets of its strings. """
+        index = self.sections[index]
+        return [ self.string (blob, offsets, i) for i in range (index[item], index[item + 1]) ]
+
+    def find (self, blob, offsets, key):
+        """ Find the first place key could go in a blob of strings sorted by their utf-8 bytes. """
+        key = key.encode ('utf-8')
+        blob = self.sections[blob]
+        offsets = self.sections[offsets]
+        low, high = 0, len(offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if bytes (blob[offsets[middle]:offsets[middle + 1]]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def lookup (self, blob, offsets, key):
+        """ Get the place of key in a sorted blob of unique strings, or None if it isn't there. """
+        index = self.find (blob, offsets, key)
+        if index < len(self.sections[offsets]) - 1 and self.string (blob, offsets, index) == key:
+            return index
+        return None
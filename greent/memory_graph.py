@@ -0,0 +1,162 @@
+import copy
+import hashlib
+import json
+import logging
+import re
+import threading
+from collections import defaultdict
+from collections import deque
+from greent.graph import TypeGraph
+from greent.util import LoggingUtil
+
+logger = LoggingUtil.init_logging(__file__, level=logging.DEBUG)
+
+class MemoryTypeGraph:
+    """ An in-process alternative to the Neo4j backed TypeGraph.
+        It holds the same concepts, types and transitions and is populated through the same interface,
+        but lives in the Rosetta process, so it must be rebuilt each time the process starts.
+        Shortest paths between every pair of types are computed once the graph is built. Path queries
+        of the form issued by Rosetta, ie
+
+           MATCH (a{name:"NAME.DISEASE"}),(b:Gene), p = allShortestPaths((a)-[*]->(b))
+           WHERE NONE (r IN relationships(p) WHERE type(r)='UNKNOWN')
+           RETURN p
+
+        are answered from those, producing the same programs as the Neo4j backend.
+    """
+    PATH_QUERY = re.compile(
+        r'MATCH\s*\(\s*a\s*\{\s*name\s*:\s*"(?P<source>[^"]+)"\s*\}\s*\)\s*,\s*' +
+        r'\(\s*b\s*:\s*(?P<concept>\w+)\s*\)\s*,\s*p\s*=\s*allShortestPaths\s*\(\s*\(\s*a\s*\)\s*-\s*\[\s*\*\s*\]\s*->\s*\(\s*b\s*\)\s*\)',
+        re.IGNORECASE)
+
+    def __init__(self, service_context):
+        """ Construct an empty type graph. Unlike the Neo4j TypeGraph it isn't a service, so it's not
+        registered on the service context, where it would replace the one Rosetta's TypeGraph is under. """
+        self.context = service_context
+        self.lock = threading.RLock()
+        self.delete_all()
+
+    def delete_all(self):
+        """ Delete all concepts, types and transitions. """
+        with self.lock:
+            self.concepts = {}
+            self.type_to_concept = {}
+            self.concept_metadata = None
+            self.types = {}
+            self.transitions = defaultdict(list)
+            self.concept_transitions = set()
+            self.clear_program_cache()
+
+    def clear_program_cache(self):
+        """ Drop shortest paths and compiled programs. Called whenever the graph is modified. """
+        with self.lock:
+            self.shortest_paths = None
+            self.program_cache = {}
+
+    def set_concept_metadata(self, concept_metadata):
+        """ Set the concept metadata. """
+        logger.debug("-- Initializing bio types.")
+        with self.lock:
+            self.clear_program_cache()
+            self.concept_metadata = concept_metadata
+            for concept, instances in self.concept_metadata.items():
+                self.concepts[concept] = set()
+                for instance in instances:
+                    self.type_to_concept[instance] = concept
+
+    def find_or_create(self, name, iri=None):
+        """ Find a type node, creating it if necessary. """
+        with self.lock:
+            node = self.types.get(name, None)
+            if not node:
+                self.clear_program_cache()
+                node = { 'name' : name, 'iri' : iri }
+                self.types[name] = node
+                concept = self.type_to_concept.get(name)
+                if concept:
+                    self.concepts[concept].add(name)
+        return node
+
+    def add_edge(self, a, b, rel_name, predicate, op):
+        """ Create a transition edge between two type nodes, storing the semantic predicate
+        and transition operation.  Also create an edge between the two concepts."""
+        with self.lock:
+            self.find_or_create(a)
+            self.find_or_create(b)
+            exists = any(map(lambda t : t[0] == b and t[1] == rel_name and t[2].get('op') == op,
+                             self.transitions[a]))
+            if not exists:
+                self.clear_program_cache()
+                enabled = predicate != "UNKNOWN"
+                synonym = predicate == "SYNONYM"
+                if enabled:
+                    self.transitions[a].append((b, rel_name, {
+                        'predicate' : predicate,
+                        'op'        : op,
+                        'enabled'   : enabled,
+                        'synonym'   : synonym
+                    }))
+                if enabled and not synonym:
+                    self.concept_transitions.add((self.type_to_concept.get(a), self.type_to_concept.get(b)))
+
+    def get_version(self):
+        """ Get a hash of the graph's contents, the same for the same graph in any process. """
+        with self.lock:
+            contents = {
+                'concepts'    : { name : sorted(types) for name, types in self.concepts.items() },
+                'types'       : self.types,
+                'transitions' : { a : sorted(t, key=json.dumps) for a, t in self.transitions.items() if t },
+                'translations': sorted(map(list, self.concept_transitions), key=json.dumps)
+            }
+            return hashlib.sha1(json.dumps(contents, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def compute_shortest_paths(self):
+        """ Compute all shortest paths from every type to every other type reachable from it. """
+        logger.debug("-- Computing shortest paths between {0} types".format(len(self.types)))
+        self.shortest_paths = {}
+        for source in sorted(self.types.keys()):
+            self.shortest_paths[source] = self.find_shortest_paths(source)
+
+    def find_shortest_paths(self, source):
+        """ Breadth first search from a type recording, for each type reached, every transition that
+        lies on a shortest path to it. Then expand those into the paths themselves, alternating type
+        and transition property dicts as Neo4j returns them. """
+        distance = { source : 0 }
+        predecessors = defaultdict(list)
+        queue = deque([ source ])
+        while queue:
+            current = queue.popleft()
+            for target, rel_name, properties in self.transitions[current]:
+                if rel_name == 'UNKNOWN':
+                    continue
+                if not target in distance:
+                    distance[target] = distance[current] + 1
+                    queue.append(target)
+                if distance[target] == distance[current] + 1:
+                    predecessors[target].append((current, properties))
+        def expand(target):
+            if target == source:
+                return [ [ self.types[source] ] ]
+            return [ path + [ properties, self.types[target] ]
+                     for previous, properties in predecessors[target]
+                     for path in expand(previous) ]
+        return { target : expand(target) for target in sorted(distance.keys()) if target != source }
+
+    def get_transitions(self, query):
+        """ Answer a shortest path query from precomputed paths and compile the result into programs.
+        Callers get a copy they are free to modify. """
+        match = self.PATH_QUERY.search(query)
+        if not match:
+            raise ValueError("Unsupported type graph query: {0}".format(query))
+        with self.lock:
+            programs = self.program_cache.get(query, None)
+            if programs is None:
+                if self.shortest_paths is None:
+                    self.compute_shortest_paths()
+                source = match.group('source')
+                targets = self.concepts.get(match.group('concept'), set())
+                paths = self.shortest_paths.get(source, {})
+                rows = [ [ path ] for target in sorted(targets) for path in paths.get(target, []) ]
+                programs = TypeGraph.compile_programs(rows)
+                self.program_cache[query] = programs
+        return copy.deepcopy(programs)
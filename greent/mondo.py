@@ -1,6 +1,6 @@
 from greent.service import Service
 from greent.service import ServiceContext
-from ontobio.ontol_factory import OntologyFactory
+from greent.ontologies import registry
 from greent.graph_components import KNode, KEdge
 from greent.util import LoggingUtil
 from greent import node_types
@@ -13,27 +13,30 @@ logger = LoggingUtil.init_logging (__file__)
 #TODO: LOOKUP all the terms that map to this... or use an ancestor call that doesn't require such stuff (i.e. that handles this)
 GENETIC_DISEASE=('DOID:630','http://purl.obolibrary.org/obo/EFO_0000508','MONDO:0003847','http://purl.obolibrary.org/obo/MONDO_0003847')
 #GENETIC_DISEASE='EFO:0000508'
-MONOGENIC_DISEASE='DOID:0050177'
+MONOGENIC_DISEASE=('DOID:0050177',)
 
 class Mondo(Service):
     
     """ A pragmatic class to query the mondo ontology. Until better sources emerge, we roll our own. """ 
     def __init__(self, context ):
         super(Mondo, self).__init__("mondo", context)
-        ofactory = OntologyFactory()
-        try:
-            #sometimes the ontology world is down :(
-            self.ont = ofactory.create('mondo')
-        except:
-            logger.warn('Problem reaching sparql endpoint, falling back to obo')
-            try:
-                self.ont = ofactory.create('obo:mondo')
-            except:
-                logger.warn('Problem reaching obo, falling back to local owl file')
-                self.ont = ofactory.create('onto_cache/mondo.owl')
-        #self.ont = ofactory.create('./mondo.owl')
-        #This seems to be required to make the ontology actually load:
-        _ = self.ont.get_level(0)
+        #Shared with every other user of mondo in the process, so read only.
+        self.ont = registry.get('mondo', snapshot=context.config.get_service('mondo').get('snapshot'))
+
+    @property
+    def closure(self):
+        """The ancestor closure index of mondo, built the first time it's needed."""
+        return registry.get_closure('mondo')
+
+    @property
+    def xref_index(self):
+        """The xref index of mondo, built the first time it's needed."""
+        return registry.get_xrefs('mondo')
+
+    @property
+    def label_index(self):
+        """The label and synonym index of mondo, built the first time it's needed."""
+        return registry.get_labels('mondo')
         
     def get_doid(self,identifier):
         """We have an identifier, and we are going to use MONDO to try to convert it to a DOID"""
@@ -48,10 +51,7 @@ class Mondo(Service):
             return doids
         #Didn't get anything, so get the xrefs and find DOIDS
         for obj_id in obj_ids:
-            xref_ids = self.ont.xrefs(obj_id)
-            for xref_id in xref_ids:
-                if xref_id.startswith('DOID:'):
-                    doids.append( xref_id )
+            doids.extend( self.xref_index.get_xrefs(obj_id, 'DOID:') )
         return doids
 
 
@@ -65,12 +65,11 @@ class Mondo(Service):
         return self.mondo_get_synonym(mondo_identifier,'EFO')
 
     def mondo_get_synonym(self,mondo_identifier,curie_prefix):
-        xref_ids = self.ont.xrefs(mondo_identifier)
-        doids = []
-        for xref_id in xref_ids:
-            if xref_id.startswith(curie_prefix):
-                doids.append( xref_id )
-        return doids
+        return self.xref_index.get_xrefs(mondo_identifier, curie_prefix)
+
+    def mondo_get_synonym_batch(self,mondo_identifiers,curie_prefix):
+        """Like mondo_get_synonym, for each of a list of identifiers in turn"""
+        return self.xref_index.get_xrefs_batch(mondo_identifiers, curie_prefix)
 
     def get_label(self,identifier):
         """Return the label for an identifier"""
@@ -82,9 +81,13 @@ class Mondo(Service):
         if self.ont.has_node(obj_id):
             obj_ids = [obj_id]
         else:
-            obj_ids = self.ont.xrefs(obj_id, bidirectional=True)
+            obj_ids = self.xref_index.get_terms(obj_id)
         return obj_ids
 
+    def get_mondo_id_batch(self,obj_ids):
+        """Like get_mondo_id, for each of a list of ids in turn"""
+        return [ self.get_mondo_id(obj_id) for obj_id in obj_ids ]
+
     def has_ancestor(self,obj, terms):
         """Given an object and a term in MONDO, determine whether the term is an ancestor of the object.
         
@@ -97,20 +100,29 @@ class Mondo(Service):
                          ancestor.
                  The list of Mondo identifiers for the object, which have the term as an ancestor"""
         #TODO: The return signature is funky, fix it.
-        obj_id = obj.identifier
-        obj_ids = self.get_mondo_id(obj_id)
-        return_objects=[]
-        for obj_id in obj_ids:
-            ancestors = self.ont.ancestors(obj_id)
-            for term in terms:
-                if term in ancestors:
-                    return_objects.append( obj_id )
-        return len(return_objects) > 0, return_objects
+        return self.has_ancestor_batch([obj], terms)[0]
+
+    def has_ancestor_batch(self,objs, terms):
+        """Like has_ancestor, for each of a list of objects in turn, classifying them all in one pass over
+        the closure index."""
+        obj_ids = self.get_mondo_id_batch([ obj.identifier for obj in objs ])
+        classes = iter(self.closure.classify([ i for ids in obj_ids for i in ids ], terms))
+        results = []
+        for ids in obj_ids:
+            return_objects = []
+            for obj_id in ids:
+                return_objects.extend( [ obj_id ] * len(next(classes)) )
+            results.append( (len(return_objects) > 0, return_objects) )
+        return results
 
     def is_genetic_disease(self,obj):
         """Checks mondo to find whether the subject has DOID:630 as an ancestor"""
         return self.has_ancestor(obj, GENETIC_DISEASE)
 
+    def is_genetic_disease_batch(self,objs):
+        """Like is_genetic_disease, for each of a list of objects in turn"""
+        return self.has_ancestor_batch(objs, GENETIC_DISEASE)
+
     def is_monogenic_disease(self,obj):
         """Checks mondo to find whether the subject has DOID:0050177 as an ancestor"""
         return self.has_ancestor(obj, MONOGENIC_DISEASE)
@@ -140,12 +152,13 @@ class Mondo(Service):
         return [ r for r in results if r[1].identifier.startswith ('DOID.GENETIC_CONDITION') ]
 
     def substring_search(self,name):
-        ciname = '(?i){}'.format(name)
-        results = self.ont.search(ciname,synonyms=True,is_regex=True)
+        return self.label_index.search_substring(name)
 
     def case_insensitive_search(self,name):
-        ciname = '(?i)^{}$'.format(name)
-        return self.ont.search(ciname,synonyms=True,is_regex=True)
+        return self.label_index.search(name)
+
+    def fuzzy_search(self,name,threshold=0.5,limit=10):
+        return self.label_index.search_fuzzy(name,threshold,limit)
 
     def search(self, name):
         #Exact match 
@@ -159,6 +172,10 @@ class Mondo(Service):
                 results = self.case_insensitive_search(newname)
         return results
 
+    def search_batch(self, names):
+        """Resolve each of a list of names in turn, as search does"""
+        return [ self.search(name) for name in names ]
+
 
 def test_both():
     q1in='q1-disease-list.txt'
@@ -1,4 +1,3 @@
-import requests
 import json
 from greent.service import Service
 from greent.service import ServiceContext
@@ -13,33 +12,50 @@ class Neo4JREST(Service):
 
     def request (self, url, obj):
         """ Make a request and return response. """
-        return requests.post (url = url,
-                             data = json.dumps (obj, indent=2),
-                             headers={ "Content-Type" : "application/json" }).json ()
+        return self.http_post (url = url,
+                               data = json.dumps (obj, indent=2),
+                               headers={ "Content-Type" : "application/json" }).json ()
         
+    def statement (self, query):
+        return {
+            "statement": query,
+            "resultDataContents": [
+                "row",
+                "graph"
+            ],
+            "includeStats": True
+        }
+
     def query (self, query, labels=None, node_properties=None, kinds=[ 'node' ]):
         """ Format a query. """
         response = self.request (
             url = self.query_endpoint,
             obj = {
-                "statements": [
-                    {
-                        "statement": query,
-                        "resultDataContents": [
-                            "row",
-                            "graph"
-                        ],
-                        "includeStats": True
-                }
-                ]
+                "statements": [ self.statement (query) ]
             })
         #print (json.dumps (response, indent=2))
         if node_properties or labels:
             response = self.filter_nodes (response, labels, node_properties, kinds)
         return response
 
+    def query_batch (self, queries, labels=None, node_properties=None, kinds=[ 'node' ]):
+        """ Run several queries in one request, as its statements, returning what query would return for
+        each of them, in order. Neo4j runs the statements in one transaction, so if any fails they all do. """
+        response = self.request (
+            url = self.query_endpoint,
+            obj = {
+                "statements": [ self.statement (query) for query in queries ]
+            })
+        errors = response.get ('errors', [])
+        if len(errors) > 0:
+            raise ValueError ("Neo4j statements failed: {0}".format (errors))
+        responses = [ { 'results' : [ result ], 'errors' : [] } for result in response.get ('results', []) ]
+        if node_properties or labels:
+            responses = [ self.filter_nodes (r, labels, node_properties, kinds) for r in responses ]
+        return responses
+
     def execute_cypher (self, statement):
-        response = requests.post (
+        response = self.http_post (
             url = self.cypher_uri,
             data = json.dumps({
                 "statements" : [{
@@ -0,0 +1,410 @@
+import logging
+import os
+import re
+import resource
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from collections import OrderedDict
+from greent.util import LoggingUtil
+from greent.util import Resource
+
+logger = LoggingUtil.init_logging (__name__, level=logging.DEBUG)
+
+class ClosureIndex:
+    """ Answer whether one term descends from another without walking the ontology. Built once from the
+    ontology's edges, which run from parent to child, over all relations, as ontobio's ancestors does.
+
+    Terms are numbered from zero. Cycles, which some relations make, are collapsed into their strongly
+    connected components. The components are numbered in post order over a depth first spanning forest,
+    so the descendants of a component reached through tree edges get a contiguous range of numbers ending
+    at its own. Descendants reached otherwise add further ranges, merged where they touch. A term descends
+    from another if its component's number falls in one of the other's ranges, a binary search over what
+    is, for ontologies, a handful of ranges. """
+
+    def __init__(self, size, children, index_of):
+        """ Build the index of size terms, where children(term) gives the numbers of a term's children and
+        index_of(identifier) gives the number of the term with that identifier, or None. """
+        self.index_of = index_of
+        self.component = ClosureIndex.find_components (size, children)
+        count = max (self.component) + 1 if size else 0
+        successors = [ set () for c in range (count) ]
+        has_parent = bytearray (count)
+        for term in range (size):
+            for child in children (term):
+                component, child_component = self.component[term], self.component[child]
+                if component != child_component:
+                    successors[component].add (child_component)
+                    has_parent[child_component] = 1
+        self.number = array ('l', [ 0 ]) * count
+        self.intervals = [ None ] * count
+        visited = bytearray (count)
+        number = 0
+        for root in [ c for c in range (count) if not has_parent[c] ]:
+            visited[root] = 1
+            low = { root : number }
+            stack = [ (root, iter (successors[root])) ]
+            while stack:
+                component, components = stack[-1]
+                child = next (components, None)
+                if child is None:
+                    stack.pop ()
+                    self.number[component] = number
+                    ranges = [ (low.pop (component), number) ]
+                    for successor in successors[component]:
+                        ranges.extend (zip (*self.intervals[successor]))
+                    self.intervals[component] = ClosureIndex.merge (ranges)
+                    number += 1
+                elif not visited[child]:
+                    visited[child] = 1
+                    low[child] = number
+                    stack.append ((child, iter (successors[child])))
+
+    @staticmethod
+    def from_graph (graph):
+        """ Build the index of a networkx graph with an edge from each parent to its child. """
+        identifiers = list (graph.nodes ())
+        place = { identifier : term for term, identifier in enumerate (identifiers) }
+        children = [ [ place[child] for child in graph.successors (identifier) ] for identifier in identifiers ]
+        return ClosureIndex (len(identifiers), children.__getitem__, place.get)
+
+    @staticmethod
+    def find_components (size, children):
+        """ Get the number of each term's strongly connected component, by Tarjan's algorithm without
+        recursion. Components are numbered in the order they're completed. """
+        index = array ('l', [ -1 ]) * size
+        low = array ('l', [ 0 ]) * size
+        component = array ('l', [ -1 ]) * size
+        stack = []
+        order = 0
+        count = 0
+        for start in range (size):
+            if index[start] >= 0:
+                continue
+            index[start] = low[start] = order
+            order += 1
+            stack.append (start)
+            work = [ (start, iter (children (start))) ]
+            while work:
+                term, terms = work[-1]
+                child = next (terms, None)
+                if child is not None:
+                    if index[child] < 0:
+                        index[child] = low[child] = order
+                        order += 1
+                        stack.append (child)
+                        work.append ((child, iter (children (child))))
+                    elif component[child] < 0:
+                        low[term] = min (low[term], index[child])
+                    continue
+                work.pop ()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min (low[parent], low[term])
+                if low[term] == index[term]:
+                    while True:
+                        member = stack.pop ()
+                        component[member] = count
+                        if member == term:
+                            break
+                    count += 1
+        return component
+
+    @staticmethod
+    def merge (ranges):
+        """ Merge inclusive ranges that overlap or touch, giving a list of lows and a list of highs, sorted. """
+        lows = []
+        highs = []
+        for low, high in sorted (ranges):
+            if highs and low <= highs[-1] + 1:
+                highs[-1] = max (highs[-1], high)
+            else:
+                lows.append (low)
+                highs.append (high)
+        return lows, highs
+
+    def is_descendant (self, identifier, ancestor):
+        """ Determine whether identifier is a proper descendant of ancestor. Terms the ontology doesn't have
+        descend from nothing. """
+        term = self.index_of (identifier)
+        ancestor_term = self.index_of (ancestor)
+        if term is None or ancestor_term is None or identifier == ancestor:
+            return False
+        return ClosureIndex.covers (self.intervals[self.component[ancestor_term]], self.number[self.component[term]])
+
+    @staticmethod
+    def covers (intervals, number):
+        lows, highs = intervals
+        index = bisect_right (lows, number) - 1
+        return index >= 0 and number <= highs[index]
+
+    def classify (self, identifiers, roots):
+        """ Get, for each identifier in turn, the list of the roots it descends from, in the order the roots
+        were given. """
+        root_terms = [ (root, self.index_of (root)) for root in roots ]
+        root_intervals = [ (root, self.intervals[self.component[term]]) for root, term in root_terms if term is not None ]
+        result = []
+        for identifier in identifiers:
+            term = self.index_of (identifier)
+            if term is None:
+                result.append ([])
+                continue
+            number = self.number[self.component[term]]
+            result.append ([ root for root, intervals in root_intervals
+                             if root != identifier and ClosureIndex.covers (intervals, number) ])
+        return result
+
+class XrefIndex:
+    """ Map between an ontology's terms and the identifiers other sources use for them, built once from
+    the terms' xrefs. Each term's xrefs are grouped by curie prefix, and each xref maps back to the terms
+    that have it, so both directions are dictionary lookups rather than scans of the ontology. """
+
+    def __init__(self, ontology):
+        self.terms = {}
+        self.xrefs = {}
+        for node in ontology.nodes ():
+            for xref in ontology.xrefs (node):
+                self.xrefs.setdefault (node, OrderedDict ()).setdefault (xref.split (':', 1)[0], []).append (xref)
+                self.terms.setdefault (xref, []).append (node)
+
+    def get_terms (self, xref):
+        """ Get the terms that have xref as an xref. """
+        return list (self.terms.get (xref, []))
+
+    def get_terms_batch (self, xrefs):
+        return [ self.get_terms (xref) for xref in xrefs ]
+
+    def get_xrefs (self, identifier, prefix=None):
+        """ Get a term's xrefs, or those of them starting with prefix. A curie prefix, with or without its
+        colon, is a lookup; anything else filters the term's xrefs. """
+        groups = self.xrefs.get (identifier, {})
+        if prefix is None:
+            return [ xref for values in groups.values () for xref in values ]
+        if prefix.rstrip (':') in groups:
+            return list (groups[prefix.rstrip (':')])
+        return [ xref for values in groups.values () for xref in values if xref.startswith (prefix) ]
+
+    def get_xrefs_batch (self, identifiers, prefix=None):
+        return [ self.get_xrefs (identifier, prefix) for identifier in identifiers ]
+
+class LabelIndex:
+    """ Find terms by label or synonym without scanning the ontology. Labels and synonyms are lower cased
+    and each distinct text is indexed twice: in a hash of whole texts, for exact matches, and under each
+    of its trigrams, for substring and fuzzy matches.
+
+    Names used to be matched as case insensitive regular expressions. Names with no regex syntax in them
+    are looked up; the rest are still matched as regular expressions, against the distinct indexed texts
+    rather than every term, so results are the same either way. """
+
+    gram_size = 3
+    regex_syntax = re.compile (r'[.^$*+?{}\[\]\\|()]')
+
+    def __init__(self, ontology):
+        texts = OrderedDict ()
+        for node in ontology.nodes ():
+            names = [ ontology.label (node) ] + [ getattr (s, 'val', s) for s in ontology.synonyms (node) ]
+            for name in names:
+                if name:
+                    terms = texts.setdefault (name.lower (), [])
+                    if node not in terms:
+                        terms.append (node)
+        self.texts = list (texts.keys ())
+        self.terms = list (texts.values ())
+        self.exact = { text : i for i, text in enumerate (self.texts) }
+        grams = {}
+        for i, text in enumerate (self.texts):
+            for gram in LabelIndex.get_grams (text):
+                grams.setdefault (gram, array ('I')).append (i)
+        self.grams = grams
+
+    @staticmethod
+    def get_grams (text):
+        return set (text[i:i + LabelIndex.gram_size] for i in range (len(text) - LabelIndex.gram_size + 1))
+
+    def collect (self, indices):
+        """ Get the terms of the given texts, once each, in the order of the texts. """
+        result = []
+        seen = set ()
+        for i in sorted (indices):
+            for term in self.terms[i]:
+                if term not in seen:
+                    seen.add (term)
+                    result.append (term)
+        return result
+
+    def match_regex (self, pattern):
+        pattern = re.compile (pattern)
+        return self.collect ([ i for i, text in enumerate (self.texts) if pattern.search (text) ])
+
+    def search (self, name):
+        """ Get the terms with a label or synonym equal to name, ignoring case. """
+        if self.regex_syntax.search (name):
+            return self.match_regex ('(?i)^{0}$'.format (name))
+        return self.lookup (name)
+
+    def lookup (self, name):
+        """ Like search, taking name literally even if it looks like a regular expression. """
+        index = self.exact.get (name.lower (), None)
+        return [] if index is None else list (self.terms[index])
+
+    def search_batch (self, names):
+        return [ self.search (name) for name in names ]
+
+    def search_substring (self, name):
+        """ Get the terms with a label or synonym containing name, ignoring case. """
+        if self.regex_syntax.search (name):
+            return self.match_regex ('(?i){0}'.format (name))
+        return self.lookup_substring (name)
+
+    def lookup_substring (self, name):
+        """ Like search_substring, taking name literally even if it looks like a regular expression. """
+        name = name.lower ()
+        if len(name) < self.gram_size:
+            return self.collect ([ i for i, text in enumerate (self.texts) if name in text ])
+        candidates = None
+        for gram in sorted (LabelIndex.get_grams (name), key=lambda g: len(self.grams.get (g, ()))):
+            postings = self.grams.get (gram, ())
+            candidates = set (postings) if candidates is None else candidates.intersection (postings)
+            if not candidates:
+                return []
+        return self.collect ([ i for i in candidates if name in self.texts[i] ])
+
+    def search_fuzzy (self, name, threshold=0.5, limit=10):
+        """ Get up to limit (term, score) pairs for the labels and synonyms most like name, best first,
+        scoring texts by the Dice coefficient of their trigrams and name's, and keeping those scoring at
+        least threshold. """
+        grams = LabelIndex.get_grams (name.lower ())
+        if not grams:
+            return []
+        shared = Counter ()
+        for gram in grams:
+            shared.update (self.grams.get (gram, ()))
+        scores = {}
+        for i, count in shared.items ():
+            score = 2.0 * count / (len(grams) + len(LabelIndex.get_grams (self.texts[i])))
+            if score >= threshold:
+                for term in self.terms[i]:
+                    scores[term] = max (score, scores.get (term, 0))
+        return sorted (scores.items (), key=lambda item: (-item[1], item[0]))[:limit]
+
+class OntologyRegistry:
+    """ Hand out one loaded ontology per name for the whole process. Services asking for an ontology
+    another service already loaded share that instance, so it must be treated as read only.
+
+    Ontologies named in sources are loaded from a snapshot file, if one is given and exists, or else
+    with ontobio, trying each handle in turn since the ontology world is sometimes down. Others are
+    loaded by the loader passed the first time they're asked for. Different ontologies can load
+    concurrently; a second request for an ontology that's loading waits for it. An ontobio ontology's
+    ClosureIndex, XrefIndex and LabelIndex are kept alongside it, under the ontology's name followed by
+    .closure, .xrefs and .labels. """
+
+    sources = {
+        'mondo' : [ 'mondo', 'obo:mondo', 'onto_cache/mondo.owl' ],
+        'go'    : [ 'go', 'obo:go' ],
+        'hp'    : [ 'hp', 'obo:hp' ]
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock ()
+        self.locks = {}
+        self.ontologies = {}
+        self.stats = OrderedDict ()
+
+    def get (self, name, loader=None, snapshot=None):
+        """ Get the named ontology, loading it if this is the first time it's been asked for. snapshot is
+        the path of an OntologySnapshot to prefer, relative to the greent package unless absolute. """
+        ontology = self.ontologies.get (name, None)
+        if ontology is not None:
+            return ontology
+        with self.lock:
+            name_lock = self.locks.setdefault (name, threading.Lock ())
+        with name_lock:
+            ontology = self.ontologies.get (name, None)
+            if ontology is None:
+                start = time.time ()
+                rss = OntologyRegistry.get_rss ()
+                ontology = loader () if loader else self.load_ontobio (name, snapshot)
+                self.stats[name] = {
+                    'seconds' : time.time () - start,
+                    'rss'     : max (0, OntologyRegistry.get_rss () - rss)
+                }
+                logger.debug ("Loaded ontology {0} in {1:.2f}s".format (name, self.stats[name]['seconds']))
+                self.ontologies[name] = ontology
+        return ontology
+
+    def get_closure (self, name):
+        """ Get the closure index of the named ontobio ontology, building it the first time it's asked for.
+        A snapshot builds its own, from its parent sections. """
+        def load ():
+            ontology = self.get (name)
+            if hasattr (ontology, 'get_closure_index'):
+                return ontology.get_closure_index ()
+            return ClosureIndex.from_graph (ontology.get_graph ())
+        return self.get ("{0}.closure".format (name), loader=load)
+
+    def get_xrefs (self, name):
+        """ Get the xref index of the named ontobio ontology, building it the first time it's asked for. """
+        return self.get ("{0}.xrefs".format (name), loader=lambda: XrefIndex (self.get (name)))
+
+    def get_labels (self, name):
+        """ Get the label index of the named ontobio ontology, building it the first time it's asked for.
+        A snapshot's is the one it searches with. """
+        def load ():
+            ontology = self.get (name)
+            if hasattr (ontology, 'get_label_index'):
+                return ontology.get_label_index ()
+            return LabelIndex (ontology)
+        return self.get ("{0}.labels".format (name), loader=load)
+
+    def load_ontobio (self, name, snapshot=None):
+        if snapshot and os.path.exists (Resource.get_resource_path (snapshot)):
+            from greent.snapshot import OntologySnapshot, SnapshotError
+            try:
+                ontology = OntologySnapshot (Resource.get_resource_path (snapshot))
+                logger.debug ("Using {0} snapshot version {1}".format (name, ontology.version))
+                return ontology
+            except SnapshotError as e:
+                logger.warning ("Not using {0} snapshot: {1}".format (name, e))
+        from ontobio.ontol_factory import OntologyFactory
+        handles = self.sources.get (name, [ name ])
+        ofactory = OntologyFactory ()
+        for index, handle in enumerate (handles):
+            try:
+                ontology = ofactory.create (handle)
+                #This seems to be required to make the ontology actually load:
+                _ = ontology.get_level (0)
+                return ontology
+            except Exception as e:
+                if index == len(handles) - 1:
+                    raise
+                logger.warning ("Problem loading {0} from {1}, falling back to {2}: {3}".format (
+                    name, handle, handles[index + 1], e))
+
+    def get_memory_report (self):
+        """ Get, per loaded ontology, the seconds it took to load and the growth in resident memory, in
+        bytes, while it loaded. The latter is approximate: other threads allocate too, notably when
+        several ontologies load at once. For ontobio ontologies, the node and edge counts are included. """
+        report = OrderedDict ()
+        for name, stats in list (self.stats.items ()):
+            report[name] = dict (stats)
+            version = getattr (self.ontologies.get (name), 'version', None)
+            if version:
+                report[name]['version'] = version
+            graph = getattr (self.ontologies.get (name), 'graph', None)
+            if graph is not None:
+                report[name]['nodes'] = graph.number_of_nodes ()
+                report[name]['edges'] = graph.number_of_edges ()
+        return report
+
+    @staticmethod
+    def get_rss ():
+        """ Get the process' current resident set size in bytes, or its peak where current isn't available. """
+        try:
+            with open ('/proc/self/statm', 'r') as stream:
+                return int (stream.read ().split ()[1]) * os.sysconf ('SC_PAGE_SIZE')
+        except (OSError, ValueError):
+            return resource.getrusage (resource.RUSAGE_SELF).ru_maxrss * 1024
+
+registry = OntologyRegistry ()
@@ -1,34 +1,107 @@
 import json
-import requests
+import os
+import threading
+import time
+from collections import OrderedDict
 from greent.service import Service
+from greent.service import batch_operator
+from greent.util import LoggingUtil
+from greent.util import Resource
 from greent.graph_components import KNode, KEdge
 from greent import node_types
 
+logger = LoggingUtil.init_logging (__name__)
+
 class OXO(Service):
 
-    """ Generic id translation service. Essentially a highly generic synonym finder. """
+    """ Generic id translation service. Essentially a highly generic synonym finder.
+    Synonyms are fetched out to the greatest distance we use, max_distance, for up to batch_size
+    identifiers per request, and cached per identifier. Lookups at shorter distances filter those.
+
+    The curie prefixes OXO knows are kept in a local file, prefix_cache. Construction loads that file and,
+    if it's missing or older than prefix_ttl seconds, refreshes it from OXO on a background thread. Until
+    there's a table every prefix is taken to be valid, so queries are tried rather than refused, and a
+    failed refresh is retried after prefix_retry seconds. """
+
+    max_distance = 3
+
     def __init__(self, context): #url="https://www.ebi.ac.uk/spot/oxo/api/search?size=500"):
         super(OXO, self).__init__("oxo", context)
-        self.build_valid_curie_prefixes()
+        oxo_conf = context.config.get_service (self.name)
+        self.batch_size = oxo_conf.get ('batch_size', 100)
+        self.synonym_cache_size = oxo_conf.get ('synonym_cache_size', 10000)
+        self.synonym_cache = OrderedDict ()
+        self.synonym_cache_lock = threading.Lock ()
+        self.prefix_cache = Resource.get_resource_path (oxo_conf.get ('prefix_cache', 'oxo_prefixes.json'))
+        self.prefix_ttl = oxo_conf.get ('prefix_ttl', 604800)
+        self.prefix_retry = oxo_conf.get ('prefix_retry', 300)
+        self.curies = None
+        self.refresh_lock = threading.Lock ()
+        self.refresh_thread = None
+        self.refresh_attempted = 0
+        self.load_valid_curie_prefixes()
+
+    def load_valid_curie_prefixes(self):
+        """ Load the prefix table from the local file, refreshing it in the background if it's missing or stale. """
+        try:
+            with open (self.prefix_cache, 'r') as stream:
+                self.curies = frozenset (json.load (stream))
+            age = time.time () - os.path.getmtime (self.prefix_cache)
+        except (OSError, ValueError) as e:
+            logger.debug ("No usable OXO prefix table at {0}: {1}".format (self.prefix_cache, e))
+            age = None
+        if age is None or age > self.prefix_ttl:
+            self.start_refresh ()
+
+    def start_refresh(self):
+        """ Refresh the prefix table on a background thread, unless a refresh is running or one was tried
+        in the last prefix_retry seconds. """
+        with self.refresh_lock:
+            if self.refresh_thread and self.refresh_thread.is_alive ():
+                return
+            if time.time () < self.refresh_attempted + self.prefix_retry:
+                return
+            self.refresh_attempted = time.time ()
+            self.refresh_thread = threading.Thread (target=self.refresh_valid_curie_prefixes,
+                                                    name="oxo-prefix-refresh", daemon=True)
+            self.refresh_thread.start ()
+
+    def refresh_valid_curie_prefixes(self):
+        """ Rebuild the prefix table from OXO and save it. On failure the current table, if any, is kept. """
+        try:
+            self.build_valid_curie_prefixes()
+            temp = "{0}.{1}.tmp".format (self.prefix_cache, os.getpid ())
+            with open (temp, 'w') as stream:
+                json.dump (sorted (self.curies), stream, indent=2)
+            os.replace (temp, self.prefix_cache)
+        except Exception as e:
+            logger.warning ("Unable to refresh OXO prefix table: {0}".format (e))
 
     def build_valid_curie_prefixes(self):
         """Query for the current valid list of input curies"""
         #size defaults to 40...
         url = "https://www.ebi.ac.uk/spot/oxo/api/datasources?size=10000"
-        response = requests.get (url).json ()
-        self.curies = set()
+        response = self.http_get (url).json ()
+        curies = set()
         for ds in response['_embedded']['datasources']:
-            self.curies.add(ds['prefix'])
-            self.curies.update( ds['alternatePrefix'] )
-        self.curies.add('MESH')
+            curies.add(ds['prefix'])
+            curies.update( ds['alternatePrefix'] )
+        curies.add('MESH')
+        self.curies = frozenset (curies)
 
     def is_valid_curie_prefix(self, cp):
-        return cp in self.curies
+        """ Is a prefix known to OXO? Never waits for the table: without one, every prefix is, and another
+        refresh is started if the last one failed long enough ago. """
+        curies = self.curies
+        if curies is None:
+            self.start_refresh ()
+            return True
+        return cp in curies
 
     def request (self, url, obj):
-        return requests.post (self.url,
-                              data=json.dumps (obj, indent=2),
-                              headers={ "Content-Type" : "application/json" }).json ()
+        return self.http_post (self.url,
+                               data=json.dumps (obj, indent=2),
+                               headers={ "Content-Type" : "application/json" }).json ()
 
     def query (self, ids, distance=2):        
         return self.request (
@@ -42,23 +115,59 @@ class OXO(Service):
     
     def get_synonyms( self, identifier, distance=2 ):
         """ Find all synonyms for a curie for a given distance . """
-        result = []
-        response = self.query (ids=[ identifier ], distance=distance)
-        searchResults = response['_embedded']['searchResults']
-        if len(searchResults) > 0 and searchResults[0]['queryId'] == identifier:
-            others = searchResults[0]['mappingResponseList']
-        return others
+        if distance <= self.max_distance:
+            synonyms = self.get_synonyms_batch( [ identifier ] )[identifier]
+            return [ s for s in synonyms if s['distance'] <= distance ]
+        return self.query_synonyms( [ identifier ], distance ).get( identifier, [] )
+
+    def query_synonyms( self, identifiers, distance ):
+        """ Query synonyms for a list of curies, returning a dict from each curie to its synonyms. """
+        response = self.query (ids=identifiers, distance=distance)
+        result = { identifier : [] for identifier in identifiers }
+        for searchResult in response.get('_embedded',{}).get('searchResults',[]):
+            if searchResult['queryId'] in result:
+                result[searchResult['queryId']] = searchResult['mappingResponseList']
+        return result
+
+    def get_synonyms_batch( self, identifiers ):
+        """ Find all synonyms out to max_distance for a list of curies, returning a dict from each curie to
+        its synonyms. Curies not already cached are queried batch_size at a time. """
+        result = {}
+        with self.synonym_cache_lock:
+            for identifier in identifiers:
+                if identifier in self.synonym_cache:
+                    self.synonym_cache.move_to_end (identifier)
+                    result[identifier] = self.synonym_cache[identifier]
+        missing = list(OrderedDict.fromkeys ([ i for i in identifiers if not i in result ]))
+        for start in range(0, len(missing), self.batch_size):
+            synonyms = self.query_synonyms( missing[start:start+self.batch_size], self.max_distance )
+            result.update (synonyms)
+            with self.synonym_cache_lock:
+                self.synonym_cache.update (synonyms)
+                while len(self.synonym_cache) > self.synonym_cache_size:
+                    self.synonym_cache.popitem (last=False)
+        return result
 
     def get_specific_synonym( self, identifier, prefix, distance=2 ):
         synonyms = self.get_synonyms( identifier, distance )
         return list( filter( lambda x: x['targetPrefix'] == prefix ,synonyms) )
 
+    def get_specific_synonym_batch( self, identifiers, prefix, distance=2 ):
+        """ Like get_specific_synonym for a list of curies, returning a dict from each curie to its synonyms. """
+        return { identifier : [ s for s in synonyms if s['targetPrefix'] == prefix and s['distance'] <= distance ]
+                 for identifier, synonyms in self.get_synonyms_batch( identifiers ).items () }
+
     def get_specific_synonym_expanding(self, identifier, prefix):
-        for i in range(1,4):
-            synonyms = self.get_specific_synonym( identifier, prefix, distance=i )
-            if len(synonyms) > 0:
-                return synonyms
-        return []
+        return self.get_specific_synonym_expanding_batch( [ identifier ], prefix )[identifier]
+
+    def get_specific_synonym_expanding_batch(self, identifiers, prefix):
+        """ Find the closest synonyms with a prefix, out to max_distance, for a list of curies. Gives the
+        same synonyms as querying at increasing distances until some are found. """
+        result = {}
+        for identifier, synonyms in self.get_specific_synonym_batch( identifiers, prefix, self.max_distance ).items ():
+            closest = min([ s['distance'] for s in synonyms ], default=None)
+            result[identifier] = [ s for s in synonyms if s['distance'] == closest ]
+        return result
 
     def mesh_to_other (self, mesh_id):
         """ Find connections from a mesh id to other vocabulary domains. """
@@ -71,22 +180,44 @@ class OXO(Service):
                            KNode(identifier=other['curie'], node_type=ntype  )) )
         return result
 
+    def compile_results_batch(self, fname, ntype, nodes, prefix):
+        """ Look up synonyms with a prefix for a list of nodes and compile each node's results. """
+        searchResults = self.get_specific_synonym_batch( [ n.identifier for n in nodes ], prefix )
+        return { identifier : self.compile_results(fname, ntype, synonyms)
+                 for identifier, synonyms in searchResults.items () }
+
+    @batch_operator ('efo_to_doid_batch')
     def efo_to_doid(self, efo_node):
         searchResults = self.get_specific_synonym( efo_node.identifier, 'DOID' )
         return self.compile_results('efo_to_doid',node_types.DISEASE, searchResults)
 
+    def efo_to_doid_batch(self, efo_nodes):
+        return self.compile_results_batch('efo_to_doid',node_types.DISEASE, efo_nodes, 'DOID')
+
+    @batch_operator ('efo_to_umls_batch')
     def efo_to_umls(self, efo_node):
         searchResults = self.get_specific_synonym( efo_node.identifier, 'UMLS' )
         return self.compile_results('efo_to_umls',node_types.DISEASE, searchResults)
 
+    def efo_to_umls_batch(self, efo_nodes):
+        return self.compile_results_batch('efo_to_umls',node_types.DISEASE, efo_nodes, 'UMLS')
+
+    @batch_operator ('umls_to_doid_batch')
     def umls_to_doid(self, umls_node):
         searchResults = self.get_specific_synonym( umls_node.identifier, 'DOID' )
         return self.compile_results('umls_to_doid',node_types.DISEASE, searchResults)
 
+    def umls_to_doid_batch(self, umls_nodes):
+        return self.compile_results_batch('umls_to_doid',node_types.DISEASE, umls_nodes, 'DOID')
+
+    @batch_operator ('ncit_to_hp_batch')
     def ncit_to_hp(self, ncit_node):
         searchResults = self.get_specific_synonym( ncit_node.identifier, 'HP' )
         return self.compile_results('efo_to_umls',node_types.DISEASE, searchResults)
 
+    def ncit_to_hp_batch(self, ncit_nodes):
+        return self.compile_results_batch('efo_to_umls',node_types.DISEASE, ncit_nodes, 'HP')
+
 def test():
     from service import ServiceContext
     oxo = OXO(ServiceContext.create_context())
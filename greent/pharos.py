@@ -1,34 +1,136 @@
+import argparse
 import asyncio
 import concurrent.futures
 import requests
 import json
 import logging
+import os
 import sys
+import threading
 import traceback
 import datetime
 from cachier import cachier
-from collections import defaultdict
-from collections import namedtuple
-from csv import DictReader
+from greent import crosswalk
+from greent.crosswalk import get_crosswalk
 from greent.util import Munge
 from greent.util import Text
 from greent.service import Service
 from greent.util import LoggingUtil
 from greent.async import AsyncUtil
-from greent.async import Operation
 from greent.graph_components import KEdge, KNode
 from greent import node_types
 from simplejson.scanner import JSONDecodeError
 
 logger = LoggingUtil.init_logging (__name__, logging.DEBUG)
 
+class TargetTable:
+    """ Pharos target ids mapped to HGNC ids, kept in a tab separated file with PharosTargetID and HGNC
+    columns. An empty HGNC column records a target Pharos has no HGNC id for. Mappings are only ever
+    appended to the file, so it's read once and then, whenever it has grown, from where reading left
+    off, picking up mappings added by other processes sharing it. A target is then looked up at Pharos
+    once however many processes share the file. """
+
+    header = 'PharosTargetID\tHGNC\n'
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock ()
+        self.table = {}
+        self.inode = None
+        self.offset = 0
+
+    def load (self):
+        """ Get the table, after reading any lines added to the file since it was last read. A file that
+        has been replaced or has shrunk is read again from the start. """
+        with self.lock:
+            try:
+                stat = os.stat (self.path)
+            except OSError:
+                if self.inode is not None:
+                    logger.debug ("No pharos target table at {0}; starting one.".format (self.path))
+                    self.table, self.inode, self.offset = {}, None, 0
+                return self.table
+            if stat.st_ino != self.inode or stat.st_size < self.offset:
+                self.table, self.inode, self.offset = {}, stat.st_ino, 0
+            if stat.st_size > self.offset:
+                try:
+                    with open (self.path, 'rb') as stream:
+                        stream.seek (self.offset)
+                        data = stream.read ()
+                except OSError as e:
+                    logger.warning ("Unable to read pharos target table {0}: {1}".format (self.path, e))
+                    return self.table
+                # Leave a line another process is part way through writing for next time.
+                data = data[:data.rfind (b'\n') + 1]
+                self.offset += len(data)
+                for line in data.decode ('utf-8').splitlines ():
+                    x = line.split ('\t')
+                    if len(x) == 2 and x[0].isdigit ():
+                        self.table[int(x[0])] = x[1]
+            return self.table
+
+    def get_batch (self, target_ids):
+        """ Get a dict of target ids to HGNC ids, '' for targets known to have none and None for targets
+        not in the table. """
+        table = self.load ()
+        return { target_id : table.get (target_id, None) for target_id in target_ids }
+
+    def add (self, mappings):
+        """ Add a dict of target ids to HGNC ids, '' for none, appending the new ones to the file in one
+        write. """
+        table = self.load ()
+        with self.lock:
+            new = [ (target_id, hgnc) for target_id, hgnc in mappings.items () if table.get (target_id, None) != hgnc ]
+            if not new:
+                return
+            text = ''.join ('{0}\t{1}\n'.format (target_id, hgnc) for target_id, hgnc in new)
+            try:
+                os.makedirs (os.path.dirname (self.path), exist_ok=True)
+                if not os.path.exists (self.path):
+                    text = self.header + text
+                with open (self.path, 'a') as stream:
+                    stream.write (text)
+            except OSError as e:
+                logger.warning ("Unable to add {0} targets to {1}: {2}".format (len(new), self.path, e))
+            table.update (new)
+
+target_tables = {}
+target_tables_lock = threading.Lock ()
+
+def get_target_table (path):
+    """ Get the target table at path, relative to the crosswalk cache directory unless absolute, shared by
+    every Pharos in the process. The table is written as targets are looked up, so it can't live in the
+    package, which may not be writable. """
+    if not os.path.isabs (path):
+        path = os.path.join (crosswalk.cache_dir, path)
+    with target_tables_lock:
+        if path not in target_tables:
+            target_tables[path] = TargetTable (path)
+        return target_tables[path]
+
 class Pharos(Service):
+    hgnc_pool_lock = threading.Lock ()
+
     def __init__(self, context):
         super(Pharos,  self).__init__("pharos", context)
+        service_conf = context.config.get_service (self.name)
+        self.hgnc_table = get_target_table (service_conf.get ('hgnc_table', 'pharos.hgnc.txt'))
+        self.hgnc_concurrency = service_conf.get ('hgnc_concurrency', 8)
+        self._hgnc_pool = None
+
+    @property
+    def hgnc_pool (self):
+        """ The pool fetching HGNC ids missing from the target table, created on first use and kept. """
+        if not self._hgnc_pool:
+            with self.hgnc_pool_lock:
+                if not self._hgnc_pool:
+                    self._hgnc_pool = concurrent.futures.ThreadPoolExecutor (max_workers=self.hgnc_concurrency)
+        return self._hgnc_pool
+
     def request (self, url):
         response = None
         try:
-            response = requests.get (url).json ()
+            response = self.http_get (url).json ()
         except:
             traceback.print_exc ()
         return response
@@ -72,16 +174,9 @@ class Pharos(Service):
         """Convert a subject with a DOID or UMLS into a Pharos Disease ID"""
         #TODO: This relies on a pretty ridiculous caching of a map between pharos ids and doids.  
         #      As Pharos improves, this will not be required, but for the moment I don't know a better way.
-        pmap = defaultdict(list)
-        with open('pharos.id.txt','r') as inf:
-            rows = DictReader(inf,dialect='excel-tab')
-            for row in rows:
-                if row['DOID'] != '':
-                    doidlist = row['DOID'].split(',')
-                    for d in doidlist:
-                        pmap[d.upper()].append(row['PharosID'])
+        pmap = get_crosswalk('pharos.id.txt', 'DOID', 'PharosID', split=',', upper=True)
         doid = subject_node.identifier
-        pharos_list = pmap[doid]
+        pharos_list = pmap.get(doid)
         if len(pharos_list) == 0:
             #logging.getLogger('application').warn('Unable to translate %s into Pharos ID' % doid)
             return None
@@ -91,20 +186,56 @@ class Pharos(Service):
         """Convert a pharos target id into an HGNC ID.
         The call does not return the actual name for the gene, so we do not provide it.
         There are numerous other synonyms that we could also cache, but I don't see much benefit here. """
-        result = None
+        return self.targets_to_hgnc ([ target_id ])[target_id]
+
+    def targets_to_hgnc(self, target_ids):
+        """Convert pharos target ids into a dict of HGNC IDs, None for targets without one.
+        Targets missing from the target table are fetched from Pharos concurrently, and what's found,
+        including targets without an HGNC ID, is written back to the table. """
+        known = self.hgnc_table.get_batch (target_ids)
+        result = { target_id : hgnc or None for target_id, hgnc in known.items () }
+        misses = [ target_id for target_id, hgnc in known.items () if hgnc is None ]
+        if misses:
+            found = dict (zip (misses, self.hgnc_pool.map (self.fetch_hgnc, misses)))
+            self.hgnc_table.add ({ target_id : hgnc for target_id, hgnc in found.items () if hgnc is not None })
+            result.update ({ target_id : hgnc or None for target_id, hgnc in found.items () })
+        return result
+
+    def fetch_hgnc(self, target_id):
+        """Get a target's HGNC ID from Pharos, '' if it has none, or None if the request fails."""
+        hgnc = None
         try:
-            r = requests.get('https://pharos.nih.gov/idg/api/v1/targets(%s)/synonyms' % target_id)
-            result = r.json()
-            for synonym in result:
+            response = self.http_get ('{0}/targets({1})/synonyms'.format (self.url, target_id))
+            response.raise_for_status ()
+            hgnc = ''
+            for synonym in response.json ():
                 if synonym['label'] == 'HGNC':
-                    result = synonym['term']
-        except:
-            pass
-        return result
+                    hgnc = synonym['term']
+        except Exception as e:
+            logger.debug ("Failed to get HGNC for pharos target {0}: {1}".format (target_id, e))
+            hgnc = None
+        return hgnc
+
+    def resolve_targets(self, predicate, links):
+        """Make (edge, gene node) pairs from the target links of a pharos drug or disease, converting
+        all the targets to HGNC IDs together. """
+        targets = [ (KEdge( 'pharos', predicate, {'properties': link['properties']} ), int(link['refid']))
+                    for link in links if link['kind'] == 'ix.idg.models.Target' ]
+        #Pharos returns target ids in its own numbering system. Collect other names for it.
+        hgnc_ids = self.targets_to_hgnc ([ target_id for edge, target_id in targets ])
+        resolved_edge_nodes = []
+        for pharos_edge, pharos_target_id in targets:
+            hgnc = hgnc_ids[pharos_target_id]
+            if hgnc is not None:
+                hgnc_node = KNode (hgnc, node_types.GENE)
+                resolved_edge_nodes.append( (pharos_edge, hgnc_node) )
+            else:
+                logging.getLogger('application').warn('Did not get HGNC for pharosID %d' % pharos_target_id)
+        return resolved_edge_nodes
 
     def drugname_string_to_pharos_info(self,drugname):
         """Exposed for use in name lookups without KNodes"""
-        r = requests.get('https://pharos.nih.gov/idg/api/v1/ligands/search?q={}'.format(drugname)).json()
+        r = self.http_get('https://pharos.nih.gov/idg/api/v1/ligands/search?q={}'.format(drugname)).json()
         return [ ('PHAROS.DRUG:{}'.format(contents['id']),contents['name']) for contents in r['content'] ]
 
     def drugname_to_pharos(self, namenode):
@@ -123,7 +254,7 @@ class Pharos(Service):
         original_edge_nodes=[]
         for pharosid in pharosids:
             logger.debug ('pharos> https://pharos.nih.gov/idg/api/v1/diseases(%s)?view=full' % pharosid)
-            r = requests.get('https://pharos.nih.gov/idg/api/v1/diseases(%s)?view=full' % pharosid)
+            r = self.http_get('https://pharos.nih.gov/idg/api/v1/diseases(%s)?view=full' % pharosid)
             result = r.json()
             for link in result['links']:
                 if link['kind'] != 'ix.idg.models.Target':
@@ -141,50 +272,17 @@ class Pharos(Service):
     def drug_get_gene(self, subject):
         """ Get a gene from a pharos disease id. """
         pharosid = Text.un_curie (subject.identifier)
-        original_edge_nodes=[]
-        r = requests.get('https://pharos.nih.gov/idg/api/v1/ligands(%s)?view=full' % pharosid)
+        r = self.http_get('https://pharos.nih.gov/idg/api/v1/ligands(%s)?view=full' % pharosid)
         result = r.json()
-        resolved_edge_nodes = []
-        actions = set() #for testing
-        for link in result['links']:
-            if link['kind'] == 'ix.idg.models.Target':
-                pharos_target_id = int(link['refid'])
-                edge_properties = {}
-                for prop in link['properties']:
-                    if prop['label'] == 'Pharmalogical Action': #!
-                        actions.add(prop['term'] ) 
-                pharos_edge = KEdge( 'pharos', 'drug_get_gene', {'properties': link['properties']} )               
-                #Pharos returns target ids in its own numbering system. Collect other names for it.
-                hgnc = self.target_to_hgnc (pharos_target_id)
-                if hgnc is not None:
-                    hgnc_node = KNode (hgnc, node_types.GENE)
-                    resolved_edge_nodes.append( (pharos_edge, hgnc_node) )
-                else:
-                    logging.getLogger('application').warn('Did not get HGNC for pharosID %d' % pharos_target_id)
-#        for a in actions:
-#            print ('Action: {}'.format(a) ) 
-        return resolved_edge_nodes
+        return self.resolve_targets ('drug_get_gene', result['links'])
 
 #    @cachier(stale_after=datetime.timedelta(days=8))
     def disease_get_gene(self, subject):
         """ Get a gene from a pharos disease id. """
         pharosid = Text.un_curie (subject.identifier)
-        original_edge_nodes=[]
-        r = requests.get('https://pharos.nih.gov/idg/api/v1/diseases(%s)?view=full' % pharosid)
+        r = self.http_get('https://pharos.nih.gov/idg/api/v1/diseases(%s)?view=full' % pharosid)
         result = r.json()
-        resolved_edge_nodes = []
-        for link in result['links']:
-            if link['kind'] == 'ix.idg.models.Target':
-                pharos_target_id = int(link['refid'])
-                pharos_edge = KEdge( 'pharos', 'disease_get_gene', {'properties': link['properties']} )               
-                #Pharos returns target ids in its own numbering system. Collect other names for it.
-                hgnc = self.target_to_hgnc (pharos_target_id)
-                if hgnc is not None:
-                    hgnc_node = KNode (hgnc, node_types.GENE)
-                    resolved_edge_nodes.append( (pharos_edge, hgnc_node) )
-                else:
-                    logging.getLogger('application').warn('Did not get HGNC for pharosID %d' % pharos_target_id)
-        return resolved_edge_nodes
+        return self.resolve_targets ('disease_get_gene', result['links'])
 
 class AsyncPharos(Pharos):
     """ Prototype asynchronous requests. In general we plan to have asynchronous requests and
@@ -194,7 +292,7 @@ class AsyncPharos(Pharos):
         
     def disease_get_gene(self, subject):
         pharosids = subject.identifier
-        original_edge_nodes=[]
+        links=[]
         def process_pharos_response (r):
             try:
                 result = r.json()
@@ -202,41 +300,16 @@ class AsyncPharos(Pharos):
                     if link['kind'] != 'ix.idg.models.Target':
                         logger.info('Pharos disease returning new kind: %s' % link['kind'])
                     else:
-                        pharos_target_id = int(link['refid'])
-                        pharos_edge = KEdge( 'pharos', 'disease_get_gene', {'properties': link['properties']} )
-                        original_edge_nodes.append( (pharos_edge, pharos_target_id) )
+                        links.append (link)
             except JSONDecodeError as e:
                 pass #logger.error ("got exception %s", e)
         AsyncUtil.execute_parallel_requests (
             urls=[ "https://pharos.nih.gov/idg/api/v1/diseases(%s)?view=full" % p for p in pharosids ],
-            response_processor=process_pharos_response)
+            response_processor=process_pharos_response,
+            http_get=self.http_get)
 
         logger.debug ("        Getting hgnc ids for pharos id: {}".format (pharosids))
-        resolved_edge_nodes = []
-        HGNCRequest = namedtuple ('HGNCRequest', [ 'pharos_target_id', 'edge' ])
-        index = 0
-        def process_hgnc_request (request):
-            nonlocal index
-            index += 1
-            url = "https://pharos.nih.gov/idg/api/v1/targets(%s)/synonyms" % request.pharos_target_id
-            if index < 3:
-                logger.debug ("      hgnc_url:  {0}".format (url))
-            return (requests.get (url).json (), request.edge)
-        def process_hgnc_response (response):
-            result = response[0]
-            edge = response[1]
-            hgnc = None
-            for synonym in result:
-                if synonym['label'] == 'HGNC':
-                    hgnc = synonym['term']
-            if hgnc is not None:
-                hgnc_node = KNode(hgnc, node_types.GENE)
-                resolved_edge_nodes.append((edge,hgnc_node))
-        AsyncUtil.execute_parallel_operations (
-            operations=[ Operation(process_hgnc_request, HGNCRequest(pharos_target_id, edge)) for edge, pharos_target_id in original_edge_nodes ], #[:1],
-            response_processor=process_hgnc_response)
-        
-        return resolved_edge_nodes
+        return self.resolve_targets ('disease_get_gene', links)
 
 #Poking around on the website there are about 10800 ( a few less )
 def build_disease_translation():
@@ -256,6 +329,18 @@ def build_disease_translation():
                 doids.append('')
             pfile.write('%d\t%s\n' % (pharosid, doids[0]))
 
+#Pharos has about 20200 targets, one per human protein
+def build_target_translation(last_target=20500, batch_size=1000):
+    """Fill the table mapping Pharos target ID to HGNC ID that drug_get_gene and disease_get_gene read,
+    so they seldom need to ask Pharos. Targets already in the table are skipped, so it can be rerun."""
+    from greent.service import ServiceContext
+    pharos = Pharos(ServiceContext.create_context())
+    target_ids = range(1, last_target)
+    for start in range(0, len(target_ids), batch_size):
+        hgnc_ids = pharos.targets_to_hgnc (target_ids[start:start + batch_size])
+        logger.info ("Targets {0} to {1}: {2} with HGNC ids.".format (
+            start + 1, start + batch_size, len([ h for h in hgnc_ids.values () if h is not None ])))
+
 def test_disese_gene_for_output():
     """Call a function so that we can examine the output"""
     pharosid=455
@@ -320,5 +405,12 @@ def test_all_drugs():
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the tables Pharos uses to translate its ids.')
+    parser.add_argument('table', choices=[ 'diseases', 'targets' ], nargs='?', default='diseases',
+                        help='diseases writes pharos.id.all.txt; targets fills the pharos target to HGNC table.')
+    args = parser.parse_args ()
     #test_all_drugs()
-    build_disease_translation()
+    if args.table == 'targets':
+        build_target_translation()
+    else:
+        build_disease_translation()
@@ -1,5 +1,4 @@
 import logging
-import requests
 import pprint
 import urllib
 from greent.service import Service
@@ -17,7 +16,7 @@ class QuickGo(Service):
         #Many of the nodes coming in will be something like GO.BIOLOGICAL_PROCESS:0042626 and
         # need to be downgraded to just GO
         url = "{0}/QuickGO/services/ontology/go/terms/GO:{1}/xontologyrelations".format (self.url, Text.un_curie(node.identifier))
-        response = requests.get(url).json ()
+        response = self.http_get(url).json ()
         results = []
         for r in response['results']:
             if 'xRelations' in r:
@@ -32,7 +31,7 @@ class QuickGo(Service):
         particular gene/go combination.  But it's the only way to traverse from neurotransmitter release to neurons 
         that is currently available"""
         url = '{0}/QuickGO/services/annotation/search?includeFields=goName&goId=GO:{1}&taxonId=9606&extension=occurs_in(CL)'.format( self.url, Text.un_curie(node.identifier)) 
-        response = requests.get(url).json()
+        response = self.http_get(url).json()
         results = []
         cell_ids = set()
         for r in response['results']:
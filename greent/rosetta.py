@@ -1,4 +1,5 @@
 import argparse
+import copy
 import json
 import logging
 import networkx as nx
@@ -10,7 +11,8 @@ import traceback
 import unittest
 import yaml
 import requests
-import requests_cache
+from collections import OrderedDict
+from collections import defaultdict
 from enum import Enum
 
 from neo4jrestclient.exceptions import StatusException
@@ -23,6 +25,14 @@ from greent.neo4j import Neo4JREST
 from greent.service import Service
 from greent.service import ServiceContext
 from greent.graph import TypeGraph
+from greent.memory_graph import MemoryTypeGraph
+from greent.admission import AdmissionController
+from greent.admission import ServiceUnavailable
+from greent.cache import OperatorCache
+from greent.executor import Call
+from greent.executor import LevelExecutor
+from greent.executor import Outcome
+from greent.singleflight import SingleFlight
 from networkx.exception import NetworkXNoPath
 from networkx.exception import NetworkXError
 from pprint import pformat,pprint
@@ -39,25 +49,38 @@ class Rosetta:
     to transition between the connected types. The engine can then accept requests to 
     translate a term from one domain to another. It does this by collecting transitions
     from the graph and executing the list of transitions. """
+
+    # Operator calls in flight, shared by every Rosetta in the process so concurrent queries asking
+    # for the same operator on the same node make one upstream call between them.
+    flights = SingleFlight ()
     
     def __init__(self, greentConf="greent.conf",
                  config_file=os.path.join (os.path.dirname (__file__), "rosetta.yml"),
                  override={},
                  delete_type_graph=False,
-                 init_db=False):
+                 init_db=False,
+                 type_graph_backend=None):
 
         """ The constructor loads the config file an prepares the type graph. If the delete_type_graph 
         flag is true, the graph is deleted entirely. If the init_db flag is true, the type_graph will
-        be loaded from the config file. """
+        be loaded from the config file. The type graph backend is neo4j or memory, defaulting to the
+        rosetta-graph backend in greent.conf. A memory type graph is always loaded from the config file. """
         """ Load the config file and set up a DiGraph representing the types we know 
         about and how to transition between them. """
         from greent.core import GreenT
         self.debug = False
-        self.cache_path = 'rosetta_cache'
 
         logger.debug ("-- Initialize GreenT service core.")
         self.core = GreenT (config=greentConf, override=override)
 
+        rosetta_conf = self.core.service_context.config.get_section ('rosetta')
+        self.concurrency = rosetta_conf.get ('concurrency', 1)
+        self.service_concurrency = rosetta_conf.get ('service_concurrency', 4)
+        self.batch_size = rosetta_conf.get ('batch_size', 50)
+        self.admission_policy = rosetta_conf.get ('admission', None) or {}
+        self.admission = AdmissionController (policy=self.service_admission_policy)
+        self.cache = OperatorCache (self.core.service_context.config)
+
         logger.debug ("-- Loading Rosetta graph schematic config: {0}".format (config_file))
         with open (config_file, 'r') as stream:
             self.config = yaml.load (stream)
@@ -71,7 +94,12 @@ class Rosetta:
 
         logger.debug ("-- Initializing Rosetta type graph")
         self.concepts = self.config["@concepts"]
-        self.type_graph = TypeGraph (self.core.service_context)
+        self.type_graph_backend = type_graph_backend if type_graph_backend else \
+            self.core.service_context.config.get_service ('rosetta-graph').get ('backend', 'neo4j')
+        if self.type_graph_backend == 'memory':
+            self.type_graph = MemoryTypeGraph (self.core.service_context)
+        else:
+            self.type_graph = TypeGraph (self.core.service_context)
 
         logger.debug ("-- Extending curie map with uber_context.")
         uber = Resource.get_resource_obj (os.path.join ("jsonld", "uber_context.jsonld"))
@@ -95,14 +123,26 @@ class Rosetta:
             logger.debug ("--Deleting type graph")
             self.type_graph.delete_all ()
         
-        if not init_db:
-            return
+        if init_db or self.type_graph_backend == 'memory':
+            self.initialize_type_graph ()
 
+    def initialize_type_graph (self):
+        """ Load the type graph. A Neo4j type graph is built in memory first, then written in bulk. """
+        if isinstance (self.type_graph, MemoryTypeGraph):
+            self.build_type_graph (self.type_graph)
+        else:
+            staged = MemoryTypeGraph (self.core.service_context)
+            self.build_type_graph (staged)
+            self.type_graph.bulk_load (staged)
+
+    def build_type_graph (self, type_graph):
+        """ Build a type graph from the config file's concepts, vocabulary and transitions, then
+        connect translator registry subscriptions to it. """
         logger.debug ("--Initialize concept graph metadata and create type nodes.")
-        self.type_graph.set_concept_metadata (self.concepts)
+        type_graph.set_concept_metadata (self.concepts)
         for k, v in self.vocab.items ():
             if isinstance (v, str):
-                self.type_graph.find_or_create (k, v)
+                type_graph.find_or_create (k, v)
         
         logger.debug ("-- Initializing Rosetta transition graph.")
         transitions = self.config["@transitions"]
@@ -121,10 +161,10 @@ class Rosetta:
                 transition_dict = transitions[L][R]
                 transition_obj = DataStructure.to_named_tuple ('TransitionTuple', transitions[L][R])
                 if 'link' in transition_dict and 'op' in transition_dict:
-                    self.type_graph.add_edge (L, R,
-                                              rel_name=transition_obj.link.upper (),
-                                              predicate=transition_obj.link.upper (),
-                                              op=transition_obj.op)
+                    type_graph.add_edge (L, R,
+                                         rel_name=transition_obj.link.upper (),
+                                         predicate=transition_obj.link.upper (),
+                                         op=transition_obj.op)
         if errors > 0:
             logger.error ("** Encountered {0} errors. exiting.".format (errors))
             sys.exit (errors)
@@ -147,32 +187,59 @@ class Rosetta:
             elif not t_b:
                 logger.debug ("Unable to find curie for {}".format (t_b))
             else:
-                self.type_graph.find_or_create (t_a, iri=t_a_iri)
-                self.type_graph.find_or_create (t_b, iri=t_b_iri)
+                type_graph.find_or_create (t_a, iri=t_a_iri)
+                type_graph.find_or_create (t_b, iri=t_b_iri)
                 if link and op:
-                    self.type_graph.add_edge (t_a, t_b, rel_name=link, predicate=link, op=op)
+                    type_graph.add_edge (t_a, t_b, rel_name=link, predicate=link, op=op)
         '''
-        from transreg import MethodMetadata
-        self.core.translator_registry.set_rosetta (self)
-        subscriptions = self.core.translator_registry.get_subscriptions ()
-        for sub in subscriptions:
-            in_curie = self.to_curie (self.unterminate (sub.in_type))
-            out_curie = self.to_curie (self.unterminate (sub.out_type))
-            op = "translator_registry.{0}".format (sub.op)
-            link = sub.predicate if sub.predicate else "unknown"
+        for sub in self.get_registry_subscriptions ():
+            in_curie = self.to_curie (self.unterminate (sub['in_type']))
+            out_curie = self.to_curie (self.unterminate (sub['out_type']))
+            op = "translator_registry.{0}".format (sub['op'])
+            link = sub['predicate'] if sub['predicate'] else "unknown"
             link = link.upper ()
             if not in_curie:
-                logger.debug ("Unable to find curie for {}".format (sub.in_type))
+                logger.debug ("Unable to find curie for {}".format (sub['in_type']))
             elif not out_curie:
-                logger.debug ("Unable to find curie for {}".format (sub.out_type))
+                logger.debug ("Unable to find curie for {}".format (sub['out_type']))
             else:
                 if link and op:
                     print ("--------------> {} {}".format (in_curie, out_curie))
                     try:
-                        self.type_graph.add_edge (in_curie, out_curie, rel_name=link, predicate=link, op=op)
+                        type_graph.add_edge (in_curie, out_curie, rel_name=link, predicate=link, op=op)
                     except StatusException:
                         logger.error(f"Failed to create edge from {in_curie} to {out_curie}.  One of these has an unspecified mapping to a concept")
         
+    def get_registry_subscriptions (self):
+        """ Get the translator registry's subscriptions as dicts of their method metadata. They're read from
+        the snapshot named by transreg's subscriptions setting, so building the type graph doesn't go to the
+        network. Only without a snapshot are they fetched from the registry, and then saved to one. Either
+        way, the methods invoking them are defined on TranslatorRegistry. """
+        from greent.transreg import TranslatorRegistry
+        path = Resource.get_resource_path (self.core.service_context.config.get_service ('transreg').get (
+            'subscriptions', 'transreg_subscriptions.json'))
+        try:
+            with open (path, 'r') as stream:
+                subscriptions = json.load (stream)
+        except (OSError, ValueError) as e:
+            logger.info ("No translator registry subscriptions snapshot at {0}; fetching them: {1}".format (path, e))
+            try:
+                self.core.translator_registry.set_rosetta (self)
+                subscriptions = [ vars (sub) for sub in self.core.translator_registry.get_subscriptions () ]
+            except Exception as e:
+                traceback.print_exc ()
+                logger.error ("Unable to get translator registry subscriptions: {}".format (e))
+                return []
+            try:
+                temp_path = "{0}.{1}.tmp".format (path, os.getpid ())
+                with open (temp_path, 'w') as stream:
+                    json.dump (subscriptions, stream, indent=2)
+                os.replace (temp_path, path)
+            except OSError as e:
+                logger.warning ("Unable to save translator registry subscriptions to {0}: {1}".format (path, e))
+        TranslatorRegistry.subscribe (self, subscriptions)
+        return subscriptions
+
     def terminate (self, d):
         for k, v in d.items ():
             if isinstance(v, str) and not v.endswith ("/"):
@@ -248,42 +315,143 @@ class Rosetta:
             if (text and len(text) > 0) or if_empty:
                 logger.debug ("{}".format (text))
                 
-    def graph (self, next_nodes, query):
+    def get_service_name (self, service):
+        """ Get the greent.conf name of a service named as in operator names, eg disease_ontology in
+        disease_ontology.graph_doid_to_mesh is diseaseontology. The service isn't created to find out. """
+        return self.core.get_service_name (service)
+
+    def get_service_config (self, service):
+        try:
+            return self.core.service_context.config.get_service (self.get_service_name (service))
+        except KeyError:
+            return {}
+
+    def service_concurrency_limit (self, service):
+        """ Get the cap on in-flight calls to a service. Services are named as in operator names, eg pharos
+        in pharos.drug_get_gene. A concurrency setting in the service's own greent.conf entry wins over the
+        Rosetta-wide service_concurrency default. """
+        return self.get_service_config (service).get ('concurrency', self.service_concurrency)
+
+    def service_admission_policy (self, service):
+        """ Get the settings of a service's admission limiter: the Rosetta-wide admission settings, overridden
+        by any of the same name in the service's own greent.conf entry, capped at its concurrency limit. """
+        service_conf = self.get_service_config (service)
+        policy = { k : service_conf.get (k, v) for k, v in self.admission_policy.items () }
+        policy['max_concurrency'] = self.service_concurrency_limit (service)
+        return policy
+
+    def create_executor (self, concurrency=None):
+        """ Create an executor for program levels. The concurrency defaults to the configured value. """
+        return LevelExecutor (
+            concurrency=concurrency if concurrency else self.concurrency,
+            admission=self.admission,
+            flights=self.flights)
+
+    def graph (self, next_nodes, query, concurrency=None, memo=None, metadata=None):
         """ Given a set of starting nodes and a query, execute the query to get a set of paths.
         Each path reflects a set of transitions from the starting tokens through the graph.
-        Each path is then executed and the resulting links and nodes returned. """
+        Each path is then executed and the resulting links and nodes returned. The concurrency
+        is the number of operator calls run at once within a level, defaulting to greent.conf.
+        Operator outcomes are memoized in memo, so callers running several queries can share one.
+        The edges are returned as a RosettaResult, whose metadata reports the calls that failed or were
+        skipped because their service is unavailable. Pass metadata to collect them across calls. """
+        metadata = self.create_metadata () if metadata is None else metadata
+        return RosettaResult (self.graph_stream (next_nodes, query, concurrency=concurrency, memo=memo, ordered=True,
+                                                 metadata=metadata), metadata)
+
+    def graph_stream (self, next_nodes, query, concurrency=None, memo=None, ordered=False, cancel=None,
+                      metadata=None):
+        """ Like graph, but generate edges as the operators producing them finish rather than returning
+        a list once everything is done. Unless ordered is set, edges are generated in completion order.
+        Closing the generator, or setting the cancel event, stops any further operator calls. """
         programs = self.type_graph.get_transitions (query)
-        result = []
-        for program in programs:
-            result += self.graph_inner (next_nodes, program)
-        return result
-    
-    def graph_inner (self, next_nodes, program):
+        memo = {} if memo is None else memo
+        with self.create_executor (concurrency) as executor:
+            for program in programs:
+                if cancel and cancel.is_set ():
+                    return
+                yield from self.graph_inner_stream (next_nodes, program, executor, memo, ordered, cancel, metadata)
+
+    @staticmethod
+    def create_metadata ():
+        """ Create a record of the calls a run could not make. Each of its lists holds a dict per call
+        giving the op, the node's identifier and the error: skipped for calls to services whose circuit
+        was open, failed for calls that raised an exception. """
+        return { 'skipped' : [], 'failed' : [] }
+
+    def report_call (self, metadata, key, error):
+        """ Log a call that did not produce a result and record it in metadata, if any. """
+        op, identifier, node_type = key
+        skipped = isinstance (error, ServiceUnavailable)
+        if skipped:
+            logger.warning ("Skipped {0}({1}): {2}".format (op, identifier, error))
+        else:
+            logger.error ("Error invoking {0}({1}): {2}: {3}".format (op, identifier, type(error).__name__, error))
+            logger.debug ("".join (traceback.format_exception (type(error), error, error.__traceback__)))
+        if metadata is not None:
+            metadata.setdefault ('skipped' if skipped else 'failed', []).append ({
+                'op'         : op,
+                'identifier' : identifier,
+                'error'      : str(error)
+            })
+
+    def memo_key (self, operator, node):
+        """ Identify an operator invocation. Node type is included since some operators depend on it. """
+        return (operator['op'], node.identifier, node.node_type)
+
+    def graph_inner (self, next_nodes, program, executor=None, memo=None, metadata=None):
+        """ Execute a program, returning the edges it produces as a RosettaResult. """
+        metadata = self.create_metadata () if metadata is None else metadata
+        return RosettaResult (self.graph_inner_stream (next_nodes, program, executor, memo, ordered=True,
+                                                       metadata=metadata), metadata)
+
+    def graph_inner_stream (self, next_nodes, program, executor=None, memo=None, ordered=False, cancel=None,
+                            metadata=None):
+        """ Execute a program level by level, generating edges as they are produced. Each operator of a
+        level is invoked on every node collected by the previous level. Each level collects a node once per
+        identifier and type, however many source nodes reached it, and an operator is only called once per
+        identifier per run; its outcome is recorded in memo. Edges are still attached to each source node
+        that reached a duplicate, but the edges leading on from it are generated once. Calls within a level
+        go through the executor, which may run them concurrently. If ordered is set, edges come out in the
+        order serial execution would produce them. Each level's collector is assembled in that order either
+        way. Calls that fail or are skipped are reported in metadata. """
         #print ("program: {}".format (json.dumps (program, indent=2)))
         if not program or len(program) == 0:
-            return []
+            return
+        if not executor:
+            with self.create_executor () as executor:
+                yield from self.graph_inner_stream (next_nodes, program, executor, memo, ordered, cancel, metadata)
+            return
+        memo = {} if memo is None else memo
         primed = [ { 'collector' : next_nodes } ] + program
-        linked_result = []
         for index, level in enumerate (program):
             logger.debug ("--Executing level: {0}".format (level))
             operators = level['ops']
             collector = level['collector']
-            for edge_node in primed[index]['collector']:
-                for operator in operators:
-                    op = self.get_ops (operator['op'])
+            invocations = [ (edge_node[1], operator)
+                            for edge_node in self.unique_nodes (primed[index]['collector'])
+                            for operator in operators ]
+            level_results = [ None ] * len(invocations)
+            outcomes = self.level_outcomes (invocations, executor, memo, ordered, metadata)
+            try:
+                for position, outcome in outcomes:
+                    if cancel and cancel.is_set ():
+                        return
+                    source_node, operator = invocations[position]
+                    log_text = "  -- {0}({1})".format (operator['op'], source_node.identifier)
+                    if outcome.error:
+                        continue
+                    edges = []
                     try:
-                        results = None
-                        log_text = "  -- {0}({1})".format (operator['op'], edge_node[1].identifier)
-                        source_node = edge_node[1]
-                        with requests_cache.enabled("rosetta_cache"):
-                            results = op (source_node)
+                        # Memoized results are shared, so each source node gets its own copy of the edges.
+                        results = [ (copy.copy (r[0]), r[1]) for r in outcome.result ]
                         for r in results:
                             edge = r[0]
                             if isinstance(edge,KEdge):
                                 edge.predicate = operator['link']
                                 edge.source_node = source_node
                                 edge.target_node = r[1]
-                                linked_result.append (edge)
+                                edges.append (edge)
                         logger.debug ("{0} => {1}".format (log_text, Text.short (results)))
                         for r in results:
                             if index < len(program) - 1:
@@ -291,40 +459,175 @@ class Rosetta:
                                     logger.debug (
                                         "Operator {0} wired to return type: {1} returned node with id: {2}".format (
                                             operator, program[index+1]['node_type'], r[1].identifier))
-                        collector += results
+                        level_results[position] = results
                     except Exception as e:
-                        traceback.print_exc()
-                        logger.error ("Error invoking> {0}".format (log_text))        
-        return linked_result
+                        self.report_call (metadata, self.memo_key (operator, source_node), e)
+                    yield from edges
+            finally:
+                outcomes.close ()
+            collector += self.unique_nodes ([ r for results in level_results if results for r in results ])
+
+    def unique_nodes (self, edge_nodes):
+        """ Keep the first of the (edge, node) pairs reaching each node identifier and type, in order. """
+        seen = set ()
+        result = []
+        for edge_node in edge_nodes:
+            key = (edge_node[1].identifier, edge_node[1].node_type)
+            if not key in seen:
+                seen.add (key)
+                result.append (edge_node)
+        return result
+
+    def level_outcomes (self, invocations, executor, memo, ordered, metadata=None):
+        """ Submit the calls needed for a level's (source node, operator) invocations, then generate
+        (position, outcome) pairs for the invocations, in order or as calls complete. Calls already
+        recorded in memo or found in the operator cache are not made again. Operators with a batch form
+        are called through it, with the level's nodes for the operator grouped into batches. Failed and
+        skipped calls are reported in metadata. Closing the generator cancels calls not yet started. """
+        keys = [ self.memo_key (operator, source_node) for source_node, operator in invocations ]
+        futures = OrderedDict ()
+        pending = OrderedDict ()
+        batch_forms = {}
+        for (source_node, operator), key in zip (invocations, keys):
+            if not key in memo and not key in pending:
+                op = operator['op']
+                service = op.split ('.')[0]
+                cached = self.cache.get (self.get_service_name (service), op, source_node)
+                if cached is not None:
+                    memo[key] = Outcome (cached, None)
+                    continue
+                if not op in batch_forms:
+                    batch_forms[op] = self.get_batch_form (op)
+                pending[key] = (service, op, source_node)
+                if not batch_forms[op][0]:
+                    futures[key] = executor.submit (Call (service=service,
+                                                          function=self.get_op_invoker (op),
+                                                          argument=source_node,
+                                                          key=key))
+        for op, (batch_form, batch_size) in batch_forms.items ():
+            if batch_form:
+                batch_keys = [ key for key, call in pending.items () if call[1] == op ]
+                for start in range (0, len(batch_keys), batch_size):
+                    batch = batch_keys[start:start + batch_size]
+                    future = executor.submit (Call (service=pending[batch[0]][0],
+                                                    function=batch_form,
+                                                    argument=[ pending[key][2] for key in batch ],
+                                                    key=(op, tuple ([ key[1:] for key in batch ]))))
+                    for key in batch:
+                        futures[key] = future
+        calls = list(OrderedDict.fromkeys (futures.values ()))
+        logger.debug ("  -- {0} calls for {1} invocations".format (len(calls), len(invocations)))
+        def record (key, future):
+            outcome = future.result ()
+            service, op, source_node = pending[key]
+            if not outcome.error and batch_forms[op][0]:
+                outcome = Outcome (outcome.result.get (source_node.identifier, []), None)
+            if outcome.error:
+                self.report_call (metadata, key, outcome.error)
+            else:
+                self.cache.put (self.get_service_name (service), op, source_node, outcome.result)
+            memo[key] = outcome
+            return outcome
+        try:
+            if ordered:
+                for position, key in enumerate (keys):
+                    outcome = memo[key] if key in memo else record (key, futures[key])
+                    yield position, outcome
+            else:
+                waiting = defaultdict (list)
+                for position, key in enumerate (keys):
+                    if key in memo:
+                        yield position, memo[key]
+                    else:
+                        waiting[key].append (position)
+                future_keys = defaultdict (list)
+                for key, future in futures.items ():
+                    future_keys[future].append (key)
+                for future in executor.as_completed (calls):
+                    for key in future_keys[future]:
+                        outcome = record (key, future)
+                        for position in waiting[key]:
+                            yield position, outcome
+        finally:
+            for future in calls:
+                future.cancel ()
+
+    def get_batch_form (self, name):
+        """ Get the batch form of the named operator, and the most nodes to pass it at once, or (None, None)
+        if it has none. See greent.service.batch_operator. A batch_size set on the operator's service in
+        greent.conf wins over the size the operator declares, which wins over Rosetta's batch_size. """
+        try:
+            op = self.get_ops (name)
+        except AttributeError:
+            return None, None
+        batch_form = getattr (op, 'batch_form', None)
+        if not batch_form:
+            return None, None
+        batch_size = self.get_service_config (name.split ('.')[0]).get (
+            'batch_size', getattr (op, 'batch_size', None) or self.batch_size)
+        return getattr (op.__self__, batch_form), max (1, int (batch_size))
+
+    def get_op_invoker (self, name):
+        """ Get a function invoking the named operator. The operator is looked up at call time so that
+        failing to find it is reported like any other failed call. """
+        def invoke (node):
+            return self.get_ops (name) (node)
+        return invoke
             
-    def clinical_outcome_pathway (self, drug=None, disease=None):
-        blackboard = []
+    def clinical_outcome_pathway (self, drug=None, disease=None, concurrency=None, metadata=None):
+        """ Get clinical outcome pathway edges as a RosettaResult. See graph. """
+        metadata = self.create_metadata () if metadata is None else metadata
+        return RosettaResult (self.clinical_outcome_pathway_stream (drug=drug, disease=disease,
+                                                                    concurrency=concurrency, ordered=True,
+                                                                    metadata=metadata), metadata)
+
+    def clinical_outcome_pathway_stream (self, drug=None, disease=None, concurrency=None, ordered=False, cancel=None,
+                                         metadata=None):
+        """ Generate clinical outcome pathway edges as they are found. See graph_stream. """
+        memo = {}
         from greent import node_types
         if disease:
-            blackboard += self.graph (
+            yield from self.graph_stream (
                 [ ( None, KNode('NAME.DISEASE:{0}'.format (disease), node_types.NAME_DISEASE) ) ],
                 query=\
                 """MATCH (a{name:"NAME.DISEASE"}),(b:GeneticCondition), p = allShortestPaths((a)-[*]->(b)) 
                 WHERE NONE (r IN relationships(p) WHERE type(r)='UNKNOWN') 
-                RETURN p""")
-            blackboard += self.graph (
+                RETURN p""",
+                concurrency=concurrency,
+                memo=memo,
+                ordered=ordered,
+                cancel=cancel,
+                metadata=metadata)
+            yield from self.graph_stream (
                 [ ( None, KNode('NAME.DISEASE:{0}'.format (disease), 'D') ) ],
                 query=\
                 """MATCH (a{name:"NAME.DISEASE"}),(b:Gene), p = allShortestPaths((a)-[*]->(b)) 
                 WHERE NONE (r IN relationships(p) WHERE type(r)='UNKNOWN') 
-                RETURN p""")
+                RETURN p""",
+                concurrency=concurrency,
+                memo=memo,
+                ordered=ordered,
+                cancel=cancel,
+                metadata=metadata)
         if drug:
-            blackboard += self.graph (
+            yield from self.graph_stream (
                 [ ( None, KNode('NAME.DRUG:{0}'.format (drug), node_types.NAME_DRUG) ) ],
                 query=\
                 """MATCH (a{name:"NAME.DRUG"}),(b:Pathway), p = allShortestPaths((a)-[*]->(b)) 
                 WHERE NONE (r IN relationships(p) WHERE type(r)='UNKNOWN') 
-                RETURN p""")
-        return blackboard
+                RETURN p""",
+                concurrency=concurrency,
+                memo=memo,
+                ordered=ordered,
+                cancel=cancel,
+                metadata=metadata)
     
     @staticmethod
-    def clinical_outcome_pathway_app (drug=None, disease=None, greent_conf='greent.conf'):
-        return Rosetta(greentConf=greent_conf).clinical_outcome_pathway (drug=drug, disease=disease)
+    def clinical_outcome_pathway_app (drug=None, disease=None, greent_conf='greent.conf', concurrency=None,
+                                      metadata=None):
+        return Rosetta(greentConf=greent_conf).clinical_outcome_pathway (drug=drug, disease=disease,
+                                                                         concurrency=concurrency,
+                                                                         metadata=metadata)
 
     @staticmethod
     def clinical_outcome_pathway_app_from_args (args, greent_conf='greent.conf'):        
@@ -339,6 +642,13 @@ class Rosetta:
                     greent_conf=greent_conf) )
         return result
     
+class RosettaResult(list):
+    """ The edges a Rosetta run produced, with metadata recording the calls it could not make. See
+    Rosetta.create_metadata. """
+    def __init__(self, edges=(), metadata=None):
+        super(RosettaResult, self).__init__(edges)
+        self.metadata = metadata if metadata is not None else Rosetta.create_metadata ()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Rosetta.')
     parser.add_argument('--delete-type-graph',
@@ -349,10 +659,17 @@ if __name__ == "__main__":
                         action="store_true", default=False)
     parser.add_argument('-d', '--disease', help='A disease to analyze.', default=None)
     parser.add_argument('-s', '--drug', help='A drug to analyze.', default=None)
+    parser.add_argument('--type-graph-backend', help='Type graph backend: neo4j or memory.', default=None)
+    parser.add_argument('-c', '--concurrency', help='Operator calls to run at once per level.', type=int, default=None)
     args = parser.parse_args()
     
     rosetta = Rosetta (init_db=args.initialize_type_graph,
-                       delete_type_graph=args.delete_type_graph)
+                       delete_type_graph=args.delete_type_graph,
+                       type_graph_backend=args.type_graph_backend)
     blackboard = Rosetta.clinical_outcome_pathway_app (drug=args.drug,
-                                                       disease=args.disease)
+                                                       disease=args.disease,
+                                                       concurrency=args.concurrency)
     print ("output: {}".format (blackboard))
+    for kind in [ 'skipped', 'failed' ]:
+        if len(blackboard.metadata[kind]) > 0:
+            print ("{0}: {1}".format (kind, pformat (blackboard.metadata[kind])))
@@ -1,27 +1,130 @@
+import json
 import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 from greent.graph_components import KEdge, KNode
 from greent.config import Config
+from greent.singleflight import SingleFlight
 from greent.util import LoggingUtil
 
+def batch_operator (batch_form, batch_size=None):
+    """ Declare that an operator has a batch form: the method named batch_form on the same service, which
+    takes a list of nodes and returns a dict mapping each node's identifier to the list of (edge, node)
+    pairs the operator would return for it. Nodes missing from the dict have no results. Rosetta calls
+    the batch form instead of the operator, with up to batch_size nodes at a time. """
+    def decorate (operator):
+        operator.batch_form = batch_form
+        operator.batch_size = batch_size
+        return operator
+    return decorate
+
 class ServiceContext:
     """ A context for all service objects. Gives us a bit of control over how services behave
     and a common point of coniguration. """
     def __init__(self, config=None):
         self.config = Config (config if config else os.path.join (os.path.dirname (__file__), "greent.conf"))
+        # The core whose services share this context, if any, so a service can use another service's instance.
+        self.core = None
     @staticmethod
     def create_context (config=None):
         return ServiceContext (config)
     
 class Service:
     """ Basic characteristics of services. """
+
+    # HTTP policy used unless greent.conf's http section or the service's own entry says otherwise.
+    http_defaults = {
+        'pool_size'       : 10,
+        'connect_timeout' : 5,
+        'read_timeout'    : 60,
+        'retries'         : 3,
+        'backoff'         : 0.5
+    }
+    session_lock = threading.Lock ()
+    # HTTP requests in flight, shared by all services so identical concurrent requests are made once.
+    flights = SingleFlight ()
+
     def __init__(self, name, context):
         """ Initialize the service given a name and an application context. """
         self.context = context
         self.name = name
-        self.url = context.config.get_service (self.name)["url"]
+        service_conf = context.config.get_service (self.name)
+        self.url = service_conf["url"]
+        self.http_conf = dict (self.http_defaults)
+        self.http_conf.update (context.config.get_section ('http'))
+        self.http_conf.update ({ k : v for k, v in service_conf.items () if k in self.http_defaults })
+        self.timeout = (self.http_conf['connect_timeout'], self.http_conf['read_timeout'])
+        self._session = None
 
         setattr (self.context, self.name, self)
-        
+
+    @property
+    def session (self):
+        """ The service's HTTP session, created on first use. It keeps a pool of up to pool_size keep-alive
+        connections per host and retries failed connections and 429 and 5xx responses retries times,
+        backing off exponentially from backoff seconds. """
+        if not self._session:
+            with self.session_lock:
+                if not self._session:
+                    self._session = self.create_session ()
+        return self._session
+
+    def create_session (self):
+        options = {
+            'total'            : self.http_conf['retries'],
+            'backoff_factor'   : self.http_conf['backoff'],
+            'status_forcelist' : [ 429, 500, 502, 503, 504 ],
+            'raise_on_status'  : False
+        }
+        # Services only read, so POSTs (eg Cypher and OXO queries) are as safe to retry as GETs.
+        methods = frozenset ([ 'GET', 'HEAD', 'OPTIONS', 'POST' ])
+        try:
+            retry = Retry (allowed_methods=methods, **options)
+        except TypeError:
+            retry = Retry (method_whitelist=methods, **options)
+        adapter = HTTPAdapter (pool_connections=self.http_conf['pool_size'],
+                               pool_maxsize=self.http_conf['pool_size'],
+                               max_retries=retry)
+        session = requests.Session ()
+        session.mount ('http://', adapter)
+        session.mount ('https://', adapter)
+        return session
+
+    def http_get (self, url, **kwargs):
+        """ GET a url through the service's session, with its timeouts unless others are given. """
+        return self.http_request ('GET', url, **kwargs)
+
+    def http_post (self, url, **kwargs):
+        """ POST to a url through the service's session, with its timeouts unless others are given. """
+        return self.http_request ('POST', url, **kwargs)
+
+    def http_request (self, method, url, **kwargs):
+        """ Make an HTTP request. Identical requests made concurrently, from any thread or service, share
+        one response, which is read in full before it's shared. Streamed requests are never shared.
+        A 429 or 5xx response still failing once retries are exhausted raises requests.HTTPError, so the
+        admission controller counts it against the service. Other responses are returned whatever their
+        status. """
+        kwargs.setdefault ('timeout', self.timeout)
+        if kwargs.get ('stream', False):
+            return self.check_status (self.session.request (method, url, **kwargs))
+        options = { k : v for k, v in kwargs.items () if k != 'timeout' }
+        key = (method, url, json.dumps (options, sort_keys=True, default=str))
+        return self.flights.do (key, self.fetch, method, url, kwargs)
+
+    def fetch (self, method, url, kwargs):
+        response = self.session.request (method, url, **kwargs)
+        response.content
+        return self.check_status (response)
+
+    def check_status (self, response):
+        if response.status_code == 429 or response.status_code >= 500:
+            response.close ()
+            raise requests.HTTPError ("{0} {1} from {2}".format (
+                response.status_code, response.reason, response.url), response=response)
+        return response
+
     def _type(self):
         return self.__class__.__name__
     
@@ -0,0 +1,56 @@
+import logging
+import threading
+from collections import Counter
+from greent.util import LoggingUtil
+
+logger = LoggingUtil.init_logging (__name__, level=logging.DEBUG)
+
+class Flight:
+    """ One call in progress, and what it produced once it's done. """
+    def __init__(self):
+        self.done = threading.Event ()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """ Coalesce identical concurrent calls. While a call for a key is in progress, other callers
+    asking for the same key wait for it and get its result, or its exception, instead of making the
+    call themselves. Nothing is kept once the call finishes; later callers make a fresh call. Results
+    are shared between the callers of one flight, so they should be treated as read only. """
+
+    def __init__(self):
+        self.lock = threading.Lock ()
+        self.flights = {}
+        self.stats = Counter ()
+
+    def do (self, key, function, *args, **kwargs):
+        """ Call function with args unless a call for key is already in progress, in which case wait
+        for that call's outcome. """
+        with self.lock:
+            flight = self.flights.get (key, None)
+            leader = flight is None
+            if leader:
+                flight = Flight ()
+                self.flights[key] = flight
+            self.stats['calls' if leader else 'shared'] += 1
+        if not leader:
+            logger.debug ("  -- waiting for in-flight call {0}".format (key))
+            flight.done.wait ()
+            if flight.error:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = function (*args, **kwargs)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set ()
+        return flight.result
+
+    def get_stats (self):
+        """ Get the number of calls made and the number of callers that shared another's call. """
+        with self.lock:
+            return dict (self.stats)
@@ -0,0 +1,247 @@
+import argparse
+import logging
+import os
+import re
+import threading
+import time
+from array import array
+from collections import deque
+from greent.mapped import MappedFile
+from greent.mapped import MappedFileError
+from greent.mapped import SectionWriter
+from greent.ontologies import ClosureIndex
+from greent.ontologies import LabelIndex
+from greent.util import LoggingUtil
+from greent.util import Resource
+
+logger = LoggingUtil.init_logging (__name__, level=logging.DEBUG)
+
+MAGIC = b'GTONTSNP'
+FORMAT_VERSION = 1
+
+class SnapshotError(MappedFileError):
+    """ Raised for a file that isn't a snapshot this code can read. """
+    pass
+
+class OntologySnapshot(MappedFile):
+    """ A read only ontology loaded by memory mapping a snapshot file. It answers the subset of ontobio's
+    Ontology interface GreenT uses, looking terms up by binary search in the mapped file instead of
+    parsing anything, so loading takes about as long as opening the file.
+
+    The header names the ontology, its version, where and when the snapshot was built and the relations
+    its edges carry. The sections are:
+        ids, id_offsets              : term ids, sorted by their utf-8 bytes. A node is its place here.
+        labels, label_offsets        : each node's label, empty if it has none.
+        synonym_index, synonyms, synonym_offsets : each node's synonyms.
+        xref_index, xrefs, xref_offsets          : each node's xrefs.
+        parent_index, parents, parent_relations  : each node's parents, and the relation to each.
+        xref_keys, xref_key_offsets, xref_nodes  : every xref, sorted, with the node that has it. """
+
+    magic = MAGIC
+    format_version = FORMAT_VERSION
+    error = SnapshotError
+
+    def __init__(self, path):
+        super(OntologySnapshot, self).__init__(path)
+        self.name = self.header['name']
+        self.version = self.header['version']
+        self.relations = self.header['relations']
+        self.size = len(self.sections['id_offsets']) - 1
+        self.graph = None
+        self.label_index = None
+        self.label_lock = threading.Lock ()
+
+    def node_index (self, identifier):
+        """ Get the place of a term in the snapshot, or None if it isn't there. """
+        return self.lookup ('ids', 'id_offsets', identifier)
+
+    def nodes (self):
+        return [ self.string ('ids', 'id_offsets', i) for i in range (self.size) ]
+
+    def has_node (self, identifier):
+        return self.node_index (identifier) is not None
+
+    def label (self, identifier):
+        node = self.node_index (identifier)
+        if node is None:
+            return None
+        return self.string ('labels', 'label_offsets', node) or None
+
+    def synonyms (self, identifier):
+        """ Get a term's synonyms, as strings rather than ontobio's synonym objects. """
+        node = self.node_index (identifier)
+        return [] if node is None else self.strings ('synonyms', 'synonym_offsets', 'synonym_index', node)
+
+    def xrefs (self, identifier, bidirectional=False):
+        """ Get a term's xrefs. If bidirectional, the terms that have identifier as an xref are included. """
+        node = self.node_index (identifier)
+        result = [] if node is None else self.strings ('xrefs', 'xref_offsets', 'xref_index', node)
+        if bidirectional:
+            xref_nodes = self.sections['xref_nodes']
+            index = self.find ('xref_keys', 'xref_key_offsets', identifier)
+            while index < len(xref_nodes) and self.string ('xref_keys', 'xref_key_offsets', index) == identifier:
+                result.append (self.string ('ids', 'id_offsets', xref_nodes[index]))
+                index += 1
+        return result
+
+    def parent_nodes (self, node):
+        parent_index = self.sections['parent_index']
+        return self.sections['parents'][parent_index[node]:parent_index[node + 1]]
+
+    def parents (self, identifier):
+        node = self.node_index (identifier)
+        if node is None:
+            return []
+        return [ self.string ('ids', 'id_offsets', parent) for parent in self.parent_nodes (node) ]
+
+    def ancestors (self, identifier):
+        """ Get a term's ancestors over all relations, not including the term itself. """
+        node = self.node_index (identifier)
+        if node is None:
+            return []
+        seen = set ([ node ])
+        queue = deque ([ node ])
+        while queue:
+            for parent in self.parent_nodes (queue.popleft ()):
+                if parent not in seen:
+                    seen.add (parent)
+                    queue.append (parent)
+        seen.discard (node)
+        return [ self.string ('ids', 'id_offsets', n) for n in seen ]
+
+    def search (self, searchterm, synonyms=False, is_regex=False):
+        """ Get the terms whose label, or if synonyms is set one of whose synonyms, matches searchterm, as
+        ontobio's search does. A curie is returned as is and % alone matches every term. Otherwise, a
+        searchterm with % in it is a regex with % matching anything; a regex matches anywhere in the text,
+        as re.search does; and anything else must equal the text. Candidates come from the label index,
+        which ignores case, and are then checked. """
+        if len(searchterm.split (':')) == 2:
+            return [ searchterm ]
+        if searchterm == '%':
+            return self.nodes ()
+        if '%' in searchterm:
+            searchterm = searchterm.replace ('%', '.*')
+            is_regex = True
+        labels = self.get_label_index ()
+        if is_regex:
+            pattern = re.compile (searchterm)
+            if pattern.search (''):
+                candidates = self.nodes ()
+            else:
+                candidates = labels.match_regex ('(?i){0}'.format (searchterm))
+            matches = lambda text: pattern.search (text or '') is not None
+        else:
+            candidates = labels.lookup (searchterm)
+            matches = lambda text: text == searchterm
+        result = []
+        for identifier in sorted (candidates, key=lambda i: i.encode ('utf-8')):
+            texts = [ self.label (identifier) ] + (self.synonyms (identifier) if synonyms else [])
+            if any (matches (text) for text in texts):
+                result.append (identifier)
+        return result
+
+    def get_label_index (self):
+        """ Get the LabelIndex of the snapshot's labels and synonyms, built the first time it's asked for. """
+        with self.label_lock:
+            if self.label_index is None:
+                self.label_index = LabelIndex (self)
+            return self.label_index
+
+    def get_closure_index (self):
+        """ Build a ClosureIndex from the parent sections, inverted into lists of children, without
+        building a graph. """
+        parent_index = self.sections['parent_index']
+        parents = self.sections['parents']
+        child_index = array ('l', [ 0 ]) * (self.size + 1)
+        for parent in parents:
+            child_index[parent + 1] += 1
+        for node in range (self.size):
+            child_index[node + 1] += child_index[node]
+        children = array ('l', [ 0 ]) * len(parents)
+        filled = array ('l', child_index)
+        for node in range (self.size):
+            for i in range (parent_index[node], parent_index[node + 1]):
+                children[filled[parents[i]]] = node
+                filled[parents[i]] += 1
+        return ClosureIndex (self.size, lambda node: children[child_index[node]:child_index[node + 1]],
+                             self.node_index)
+
+    def get_graph (self):
+        """ Get the ontology as a networkx graph with an edge from each parent to its child, built the first
+        time it's asked for. """
+        if self.graph is None:
+            import networkx as nx
+            graph = nx.MultiDiGraph ()
+            ids = self.nodes ()
+            graph.add_nodes_from (ids)
+            parent_index = self.sections['parent_index']
+            relations = self.sections['parent_relations']
+            for node in range (self.size):
+                for i in range (parent_index[node], parent_index[node + 1]):
+                    graph.add_edge (ids[self.sections['parents'][i]], ids[node], pred=self.relations[relations[i]])
+            self.graph = graph
+        return self.graph
+
+def build_snapshot (ont, path, name, version, source=None):
+    """ Write a snapshot of an ontobio ontology. The file is written alongside path and moved into place,
+    so processes loading the old snapshot keep a consistent view. """
+    ids = sorted (ont.nodes (), key=lambda i: i.encode ('utf-8'))
+    number = { identifier : n for n, identifier in enumerate (ids) }
+    relations = []
+    relation_number = {}
+    parents = [ [] for identifier in ids ]
+    for parent, child, data in ont.get_graph ().edges (data=True):
+        relation = data.get ('pred', None)
+        if relation not in relation_number:
+            relation_number[relation] = len(relations)
+            relations.append (relation)
+        if parent in number and child in number:
+            parents[number[child]].append ((number[parent], relation_number[relation]))
+
+    writer = SectionWriter ()
+    xrefs = [ list (ont.xrefs (i)) for i in ids ]
+    writer.add_strings ('ids', 'id_offsets', ids)
+    writer.add_strings ('labels', 'label_offsets', [ ont.label (i) or '' for i in ids ])
+    flat_synonyms = writer.add_lists ('synonym_index', [ [ getattr (s, 'val', s) for s in ont.synonyms (i) ] for i in ids ])
+    writer.add_strings ('synonyms', 'synonym_offsets', flat_synonyms)
+    flat_xrefs = writer.add_lists ('xref_index', xrefs)
+    writer.add_strings ('xrefs', 'xref_offsets', flat_xrefs)
+    flat_parents = writer.add_lists ('parent_index', parents)
+    writer.add_array ('parents', [ p for p, r in flat_parents ])
+    writer.add_array ('parent_relations', [ r for p, r in flat_parents ])
+    xref_keys = sorted (((x, number[i]) for i, node_xrefs in zip (ids, xrefs) for x in node_xrefs),
+                        key=lambda k: (k[0].encode ('utf-8'), k[1]))
+    writer.add_strings ('xref_keys', 'xref_key_offsets', [ k for k, n in xref_keys ])
+    writer.add_array ('xref_nodes', [ n for k, n in xref_keys ])
+    header = writer.write (path, MAGIC, FORMAT_VERSION, {
+        'name'      : name,
+        'version'   : version,
+        'source'    : source,
+        'built'     : time.strftime ('%Y-%m-%dT%H:%M:%S'),
+        'relations' : relations,
+        'counts'    : { 'nodes' : len(ids), 'edges' : len(flat_parents),
+                        'synonyms' : len(flat_synonyms), 'xrefs' : len(flat_xrefs) }
+    })
+    logger.info ("Wrote {0} snapshot {1} of {2} nodes to {3}".format (name, version, len(ids), path))
+    return header
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build a binary ontology snapshot GreenT loads at startup.')
+    parser.add_argument('--name', help='Ontology name, eg mondo, hp or go.', required=True)
+    parser.add_argument('--source', help='OBO or OWL file, or ontobio handle, to build from. Defaults to the sources GreenT loads the ontology from.', default=None)
+    parser.add_argument('--output', help='Snapshot file. Defaults to onto_cache/<name>.snapshot in the greent package.', default=None)
+    parser.add_argument('--version', help='Version of the ontology. Defaults to today\'s date.', default=None)
+    args = parser.parse_args ()
+    from greent.ontologies import registry
+    if args.source:
+        from ontobio.ontol_factory import OntologyFactory
+        ont = OntologyFactory().create (args.source)
+    else:
+        ont = registry.load_ontobio (args.name)
+    output = Resource.get_resource_path (args.output or os.path.join ('onto_cache', '{0}.snapshot'.format (args.name)))
+    os.makedirs (os.path.dirname (output), exist_ok=True)
+    header = build_snapshot (ont, output, args.name, args.version or time.strftime ('%Y-%m-%d'),
+                             source=args.source or args.name)
+    start = time.time ()
+    snapshot = OntologySnapshot (output)
+    print ("Built {0}: {1}. Loads in {2:.3f}s.".format (output, header['counts'], time.time () - start))
@@ -0,0 +1,162 @@
+import threading
+import time
+import unittest
+import requests
+from greent.admission import AdmissionController
+from greent.admission import ServiceLimiter
+from greent.admission import ServiceUnavailable
+from greent.singleflight import SingleFlight
+
+def fail (argument):
+    raise IOError ("failed: {0}".format (argument))
+
+class TestServiceLimiter(unittest.TestCase):
+
+    def test_limit (self):
+        """ The limit grows by about one per limit's worth of good calls, and halves on a slow or failed
+        call, at most once per cooldown, down to min_concurrency. """
+        limiter = ServiceLimiter ('test', max_concurrency=8, min_concurrency=2, latency_target=1, cooldown=0)
+        self.assertEqual (limiter.get_state (), { 'limit' : 8, 'in_flight' : 0, 'circuit' : 'closed' })
+        limiter.release (2, trial=limiter.acquire ())
+        self.assertEqual (limiter.get_state ()['limit'], 4)
+        self.assertRaises (IOError, limiter.call, fail, 'x')
+        self.assertEqual (limiter.get_state ()['limit'], 2)
+        self.assertRaises (IOError, limiter.call, fail, 'x')
+        self.assertEqual (limiter.get_state ()['limit'], 2)
+        for i in range (3):
+            self.assertEqual (limiter.call (str, i), str (i))
+        self.assertEqual (limiter.get_state ()['limit'], 3)
+        for i in range (100):
+            limiter.call (str, i)
+        self.assertEqual (limiter.get_state (), { 'limit' : 8, 'in_flight' : 0, 'circuit' : 'closed' })
+
+    def test_cooldown (self):
+        limiter = ServiceLimiter ('test', max_concurrency=8, cooldown=60)
+        for i in range (3):
+            self.assertRaises (IOError, limiter.call, fail, i)
+        self.assertEqual (limiter.get_state ()['limit'], 4)
+
+    def test_bound (self):
+        """ No more than limit calls are in flight at once. """
+        limiter = ServiceLimiter ('test', max_concurrency=3)
+        lock = threading.Lock ()
+        counts = { 'in_flight' : 0, 'most' : 0 }
+        def call (argument):
+            with lock:
+                counts['in_flight'] += 1
+                counts['most'] = max (counts['most'], counts['in_flight'])
+            time.sleep (0.02)
+            with lock:
+                counts['in_flight'] -= 1
+        threads = [ threading.Thread (target=limiter.call, args=(call, i)) for i in range (12) ]
+        for thread in threads:
+            thread.start ()
+        for thread in threads:
+            thread.join ()
+        self.assertEqual (counts['most'], 3)
+        self.assertEqual (limiter.get_state ()['in_flight'], 0)
+
+    def test_circuit (self):
+        """ The circuit opens after failure_threshold consecutive failures, lets a single trial call
+        through after reset_timeout, reopens if it fails and closes if it succeeds. """
+        limiter = ServiceLimiter ('test', failure_threshold=3, reset_timeout=0.1)
+        for i in range (2):
+            self.assertRaises (IOError, limiter.call, fail, i)
+        limiter.call (str, 'x')
+        for i in range (3):
+            self.assertRaises (IOError, limiter.call, fail, i)
+        self.assertEqual (limiter.get_state ()['circuit'], 'open')
+        with self.assertRaises (ServiceUnavailable) as context:
+            limiter.call (str, 'x')
+        self.assertEqual (context.exception.service, 'test')
+        time.sleep (0.15)
+        self.assertRaises (IOError, limiter.call, fail, 'trial')
+        self.assertRaises (ServiceUnavailable, limiter.call, str, 'x')
+        time.sleep (0.15)
+        self.assertTrue (limiter.acquire ())
+        self.assertEqual (limiter.get_state ()['circuit'], 'half-open')
+        waiter = threading.Thread (target=limiter.call, args=(str, 'waiting'))
+        waiter.start ()
+        time.sleep (0.05)
+        self.assertTrue (waiter.is_alive ())
+        limiter.release (0, trial=True)
+        waiter.join ()
+        state = limiter.get_state ()
+        self.assertEqual ((state['circuit'], state['in_flight']), ('closed', 0))
+
+    def test_neutral_errors (self):
+        """ Errors that aren't the service's fault neither open nor close the circuit. """
+        limiter = ServiceLimiter ('test', max_concurrency=4, failure_threshold=2, reset_timeout=0.1)
+        for i in range (5):
+            self.assertRaises (ValueError, limiter.call, int, 'x')
+        self.assertEqual (limiter.get_state (), { 'limit' : 4, 'in_flight' : 0, 'circuit' : 'closed' })
+        def http_error (argument):
+            raise requests.exceptions.HTTPError ("503 Server Error")
+        for i in range (2):
+            self.assertRaises (requests.exceptions.HTTPError, limiter.call, http_error, i)
+        self.assertEqual (limiter.get_state ()['circuit'], 'open')
+        time.sleep (0.15)
+        self.assertRaises (ValueError, limiter.call, int, 'x')
+        self.assertEqual (limiter.get_state ()['circuit'], 'open')
+        self.assertEqual (limiter.call (int, '1'), 1)
+        self.assertEqual (limiter.get_state ()['circuit'], 'closed')
+
+class TestAdmissionController(unittest.TestCase):
+
+    def test_policy (self):
+        controller = AdmissionController (policy=lambda service: { 'max_concurrency' : len(service) })
+        self.assertEqual (controller.call ('ab', str.upper, 'x'), 'X')
+        self.assertIs (controller.get_limiter ('ab'), controller.get_limiter ('ab'))
+        self.assertRaises (IOError, controller.call, 'abcd', fail, 'x')
+        self.assertEqual (controller.get_state (), {
+            'ab'   : { 'limit' : 2, 'in_flight' : 0, 'circuit' : 'closed' },
+            'abcd' : { 'limit' : 2, 'in_flight' : 0, 'circuit' : 'closed' } })
+        self.assertEqual (AdmissionController ().get_limiter ('x').max_concurrency, 4)
+
+class TestSingleFlight(unittest.TestCase):
+
+    def run_concurrently (self, flight, calls, function):
+        """ Make calls, pairs of key and argument, at once, each on its own thread. """
+        results = [ None ] * len(calls)
+        def call (i, key, argument):
+            try:
+                results[i] = flight.do (key, function, argument)
+            except Exception as e:
+                results[i] = e
+        threads = [ threading.Thread (target=call, args=(i, key, argument)) for i, (key, argument) in enumerate (calls) ]
+        for thread in threads:
+            thread.start ()
+        for thread in threads:
+            thread.join ()
+        return results
+
+    def test_coalesce (self):
+        flight = SingleFlight ()
+        made = []
+        def call (argument):
+            made.append (argument)
+            time.sleep (0.1)
+            return [ argument ]
+        results = self.run_concurrently (flight, [ ('a', 1) ] * 5 + [ ('b', 2) ] * 3, call)
+        self.assertEqual (sorted (made), [ 1, 2 ])
+        self.assertEqual (results, [ [ 1 ] ] * 5 + [ [ 2 ] ] * 3)
+        self.assertIs (results[0], results[4])
+        self.assertEqual (flight.get_stats (), { 'calls' : 2, 'shared' : 6 })
+        self.assertEqual (flight.flights, {})
+        self.assertEqual (flight.do ('a', call, 3), [ 3 ])
+        self.assertEqual (flight.get_stats ()['calls'], 3)
+
+    def test_errors (self):
+        flight = SingleFlight ()
+        def call (argument):
+            time.sleep (0.1)
+            raise IOError (argument)
+        results = self.run_concurrently (flight, [ ('a', 'x') ] * 4, call)
+        self.assertIsInstance (results[0], IOError)
+        self.assertTrue (all (result is results[0] for result in results))
+        self.assertEqual (flight.get_stats (), { 'calls' : 1, 'shared' : 3 })
+        self.assertEqual (flight.flights, {})
+        self.assertEqual (flight.do ('a', str, 'y'), 'y')
+
+if __name__ == '__main__':
+    unittest.main ()
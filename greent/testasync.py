@@ -0,0 +1,141 @@
+import importlib
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+
+# async is a keyword in later Pythons, so the module can't be imported by name.
+greent_async = importlib.import_module ('greent.async')
+
+Operation = greent_async.Operation
+
+class Counter:
+    """ Count calls in flight, and the most there have been at once. """
+    def __init__(self):
+        self.lock = threading.Lock ()
+        self.started = 0
+        self.in_flight = 0
+        self.most = 0
+    def call (self, seconds):
+        with self.lock:
+            self.started += 1
+            self.in_flight += 1
+            self.most = max (self.most, self.in_flight)
+        time.sleep (seconds)
+        with self.lock:
+            self.in_flight -= 1
+        return seconds
+
+class TestAsyncEngine(unittest.TestCase):
+
+    def setUp (self):
+        self.engine = greent_async.AsyncEngine (workers=8)
+
+    def tearDown (self):
+        self.engine.close ()
+
+    def test_window (self):
+        """ Up to window calls are in flight at once, and each result is processed. """
+        counter = Counter ()
+        processed = []
+        self.engine.execute (counter.call, [ 0.02 ] * 20, processed.append, window=3)
+        self.assertEqual (counter.most, 3)
+        self.assertEqual (processed, [ 0.02 ] * 20)
+        self.engine.execute (counter.call, [], processed.append, window=3)
+        self.assertEqual (len(processed), 20)
+
+    def test_sliding_window (self):
+        """ A slow call holds up its own slot, not the calls started alongside it. """
+        operations = [ Operation (time.sleep, 0.3 if i % 4 == 0 else 0.05) for i in range (8) ]
+        start = time.time ()
+        greent_async.execute_chunked_operations (operations, lambda r: None, chunk_size=4)
+        chunked = time.time () - start
+        start = time.time ()
+        self.engine.execute (lambda op: op.operation (op.arguments), operations, lambda r: None, window=4)
+        sliding = time.time () - start
+        self.assertGreaterEqual (chunked, 0.6)
+        self.assertLess (sliding, 0.5)
+
+    def test_errors (self):
+        processed = []
+        self.engine.execute (lambda x: 10 // x, [ 1, 0, 2, 0, 5 ], processed.append, window=2)
+        self.assertEqual (sorted (processed), [ 2, 5, 10 ])
+
+    def test_timeout (self):
+        """ A call that takes too long is skipped. Calls waiting for a worker don't time out while they wait. """
+        engine = greent_async.AsyncEngine (workers=2)
+        try:
+            processed = []
+            engine.execute (lambda seconds: time.sleep (seconds) or seconds,
+                            [ 1 ] + [ 0.1 ] * 6, processed.append, window=4, timeout=0.25)
+            self.assertEqual (processed, [ 0.1 ] * 6)
+        finally:
+            engine.close ()
+
+    def test_backpressure (self):
+        """ Results waiting to be processed count against the window, so a slow processor slows the calls. """
+        counter = Counter ()
+        processed = []
+        def process (response):
+            self.assertLessEqual (counter.started - len(processed), 2)
+            time.sleep (0.02)
+            processed.append (response)
+        self.engine.execute (counter.call, [ 0 ] * 20, process, window=2)
+        self.assertEqual (len(processed), 20)
+
+class TestAsyncUtil(unittest.TestCase):
+
+    def test_requests (self):
+        """ Requests are made with the service's own http_get. """
+        processed = []
+        requested = []
+        def http_get (url):
+            requested.append (url)
+            if url.endswith ('bad'):
+                raise IOError ("404 Client Error: {0}".format (url))
+            return url.upper ()
+        urls = [ 'http://test/{0}'.format (i) for i in range (10) ] + [ 'http://test/bad' ]
+        greent_async.AsyncUtil.execute_parallel_requests (urls, processed.append, http_get=http_get, window=3)
+        self.assertEqual (sorted (requested), sorted (urls))
+        self.assertEqual (sorted (processed), sorted (url.upper () for url in urls[:-1]))
+
+    def test_default_get (self):
+        """ Without an http_get, requests are made through the shared session, and chunk_size, passed
+        the old way, still sets the window. """
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET (self):
+                body = self.path.encode ('utf-8')
+                self.send_response (200)
+                self.send_header ('Content-Length', str (len(body)))
+                self.end_headers ()
+                self.wfile.write (body)
+            def log_message (self, *args):
+                pass
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+        server = Server (('127.0.0.1', 0), Handler)
+        threading.Thread (target=server.serve_forever, daemon=True).start ()
+        try:
+            processed = []
+            urls = [ 'http://127.0.0.1:{0}/{1}'.format (server.server_port, i) for i in range (6) ]
+            greent_async.AsyncUtil.execute_parallel_requests (urls, processed.append, 2)
+            self.assertEqual (sorted (response.text for response in processed), [ '/{0}'.format (i) for i in range (6) ])
+            self.assertTrue (all (response.status_code == 200 for response in processed))
+        finally:
+            server.shutdown ()
+            server.server_close ()
+
+    def test_operations (self):
+        processed = []
+        operations = [ Operation (lambda x: x * 2, i) for i in range (10) ]
+        greent_async.AsyncUtil.execute_parallel_operations (operations, processed.append, window=4)
+        self.assertEqual (sorted (processed), [ i * 2 for i in range (10) ])
+        processed = []
+        greent_async.AsyncUtil.execute_parallel_operations (operations, processed.append, chunk_size=3)
+        self.assertEqual (sorted (processed), [ i * 2 for i in range (10) ])
+        self.assertIs (greent_async.get_engine (), greent_async.get_engine ())
+
+if __name__ == '__main__':
+    unittest.main ()
@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import yaml
+from greent import node_types
+from greent.cache import OperatorCache
+from greent.config import Config
+from greent.graph_components import KEdge
+from greent.graph_components import KNode
+from greent.mapped import SectionWriter
+
+class TestOperatorCache(unittest.TestCase):
+
+    def setUp (self):
+        self.directory = tempfile.mkdtemp ()
+        self.store = os.path.join (self.directory, 'test.store')
+
+    def tearDown (self):
+        shutil.rmtree (self.directory)
+
+    def make_cache (self, path=True, memory_entries=100, ttl=60, negative_ttl=30, services={}):
+        cache_conf = { 'memory_entries' : memory_entries, 'ttl' : ttl, 'negative_ttl' : negative_ttl }
+        if path:
+            cache_conf['path'] = os.path.join (self.directory, 'cache.sqlite')
+        conf = { 'translator' : { 'cache' : cache_conf, 'services' : dict ({ 'test' : {} }, **services) } }
+        config_path = os.path.join (self.directory, 'greent.conf')
+        with open (config_path, 'w') as stream:
+            yaml.safe_dump (conf, stream)
+        return OperatorCache (Config (config_path))
+
+    def make_result (self, identifier):
+        edge = KEdge ('test', 'gene_get_disease')
+        return [ (edge, KNode (identifier, node_types.DISEASE)) ]
+
+    def test_get_put (self):
+        cache = self.make_cache ()
+        node = KNode ('NCBIGENE:1', node_types.GENE)
+        self.assertIsNone (cache.get ('test', 'gene_get_disease', node))
+        cache.put ('test', 'gene_get_disease', node, self.make_result ('DOID:1'))
+        result = cache.get ('test', 'gene_get_disease', node)
+        self.assertEqual (result[0][1].identifier, 'DOID:1')
+        self.assertIsNone (cache.get ('test', 'gene_get_pathway', node))
+        self.assertIsNone (cache.get ('test', 'gene_get_disease', KNode ('NCBIGENE:1', node_types.DISEASE)))
+        self.assertEqual (cache.get_stats (), { 'test' : { 'miss' : 3, 'memory' : 1 } })
+
+    def test_copies (self):
+        """ Each hit is a fresh copy, so changing one doesn't change what the next caller gets. """
+        cache = self.make_cache ()
+        node = KNode ('NCBIGENE:1', node_types.GENE)
+        cache.put ('test', 'op', node, self.make_result ('DOID:1'))
+        first = cache.get ('test', 'op', node)
+        first[0][1].identifier = 'DOID:2'
+        first.append (None)
+        second = cache.get ('test', 'op', node)
+        self.assertEqual (len(second), 1)
+        self.assertEqual (second[0][1].identifier, 'DOID:1')
+
+    def test_ttl (self):
+        cache = self.make_cache (ttl=0.1, services={ 'long' : { 'cache_ttl' : 60 }, 'off' : { 'cache_ttl' : 0 } })
+        node = KNode ('NCBIGENE:1', node_types.GENE)
+        for service in [ 'test', 'long', 'off' ]:
+            cache.put (service, service + '_op', node, self.make_result ('DOID:1'))
+        self.assertIsNotNone (cache.get ('test', 'test_op', node))
+        self.assertIsNone (cache.get ('off', 'off_op', node))
+        time.sleep (0.15)
+        self.assertIsNone (cache.get ('test', 'test_op', node))
+        self.assertIsNotNone (cache.get ('long', 'long_op', node))
+        cache.purge ()
+        self.assertEqual (len(cache.memory), 1)
+        self.assertEqual (cache.db.execute ("SELECT COUNT(*) FROM results").fetchone ()[0], 1)
+
+    def test_negative_ttl (self):
+        """ Empty results expire after negative_ttl, or a service's own cache_negative_ttl, and never
+        outlive the service's other results. """
+        cache = self.make_cache (ttl=60, negative_ttl=0.1, services={
+            'long'  : { 'cache_negative_ttl' : 60 },
+            'off'   : { 'cache_negative_ttl' : 0 },
+            'short' : { 'cache_ttl' : 0.1, 'cache_negative_ttl' : 60 } })
+        node = KNode ('NCBIGENE:1', node_types.GENE)
+        for service in [ 'test', 'long', 'off', 'short' ]:
+            cache.put (service, service + '_empty', node, [])
+        cache.put ('test', 'test_op', node, self.make_result ('DOID:1'))
+        self.assertEqual (cache.get ('test', 'test_empty', node), [])
+        self.assertIsNone (cache.get ('off', 'off_empty', node))
+        time.sleep (0.15)
+        self.assertIsNone (cache.get ('test', 'test_empty', node))
+        self.assertIsNone (cache.get ('short', 'short_empty', node))
+        self.assertEqual (cache.get ('long', 'long_empty', node), [])
+        self.assertIsNotNone (cache.get ('test', 'test_op', node))
+
+    def test_lru (self):
+        cache = self.make_cache (path=False, memory_entries=3)
+        nodes = [ KNode ('NCBIGENE:{0}'.format (i), node_types.GENE) for i in range (5) ]
+        for node in nodes[:3]:
+            cache.put ('test', 'op', node, self.make_result ('DOID:1'))
+        self.assertIsNotNone (cache.get ('test', 'op', nodes[0]))
+        cache.put ('test', 'op', nodes[3], self.make_result ('DOID:1'))
+        cache.put ('test', 'op', nodes[4], self.make_result ('DOID:1'))
+        self.assertEqual ([ cache.get ('test', 'op', node) is not None for node in nodes ],
+                          [ True, False, False, True, True ])
+
+    def test_disk (self):
+        """ Entries evicted from memory, or made by another process, are found on disk. """
+        cache = self.make_cache (memory_entries=1)
+        nodes = [ KNode ('NCBIGENE:{0}'.format (i), node_types.GENE) for i in range (3) ]
+        for node in nodes:
+            cache.put ('test', 'op', node, self.make_result (node.identifier.replace ('NCBIGENE', 'DOID')))
+        self.assertEqual (cache.get ('test', 'op', nodes[0])[0][1].identifier, 'DOID:0')
+        other = self.make_cache ()
+        self.assertEqual (other.get ('test', 'op', nodes[1])[0][1].identifier, 'DOID:1')
+        self.assertEqual (other.get ('test', 'op', nodes[1])[0][1].identifier, 'DOID:1')
+        self.assertEqual (cache.get_stats (), { 'test' : { 'disk' : 1 } })
+        self.assertEqual (other.get_stats (), { 'test' : { 'disk' : 1, 'memory' : 1 } })
+
+    def test_version (self):
+        """ Changing a service's version in the configuration, or rebuilding the file it serves, retires
+        its entries. """
+        node = KNode ('NCBIGENE:1', node_types.GENE)
+        cache = self.make_cache (services={ 'test' : { 'version' : 1 } })
+        cache.put ('test', 'op', node, self.make_result ('DOID:1'))
+        self.assertIsNotNone (self.make_cache (services={ 'test' : { 'version' : 1 } }).get ('test', 'op', node))
+        self.assertIsNone (self.make_cache (services={ 'test' : { 'version' : 2 } }).get ('test', 'op', node))
+
+        SectionWriter ().write (self.store, b'GTTEST..', 1, { 'version' : '2017-12-01', 'built' : 'first' })
+        cache = self.make_cache (services={ 'test' : { 'store' : self.store } })
+        key = cache.make_key ('test', 'op', node)
+        self.assertIn ('2017-12-01@first', key)
+        cache.put ('test', 'op', node, self.make_result ('DOID:1'))
+        SectionWriter ().write (self.store, b'GTTEST..', 1, { 'version' : '2017-12-01', 'built' : 'second' })
+        later = time.time () + 10
+        os.utime (self.store, (later, later))
+        self.assertNotEqual (cache.make_key ('test', 'op', node), key)
+        self.assertIsNone (cache.get ('test', 'op', node))
+        self.assertEqual (cache.get_version ('missing'), '')
+
+if __name__ == '__main__':
+    unittest.main ()
@@ -0,0 +1,375 @@
+import functools
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import HTTPServer
+from http.server import SimpleHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from greent import crosswalk
+from greent.crosswalk import Crosswalk
+from greent.crosswalk import MemoryCrosswalk
+from greent.crosswalk import build_crosswalk
+from greent.crosswalk import get_crosswalk
+from greent.crosswalk import read_pairs
+from greent.ctd import CTD
+from greent.ctd import CTDStore
+from greent.ctd import build_store
+from greent.mapped import BuildLock
+from greent.mapped import MappedFile
+from greent.mapped import MappedFileError
+from greent.mapped import SectionWriter
+from greent.mapped import read_header
+from greent.service import ServiceContext
+
+class SampleFile(MappedFile):
+    magic = b'GTTEST..'
+    format_version = 2
+
+class TestMappedFile(unittest.TestCase):
+
+    def setUp (self):
+        self.directory = tempfile.mkdtemp ()
+        self.path = os.path.join (self.directory, 'test.mapped')
+
+    def tearDown (self):
+        shutil.rmtree (self.directory)
+
+    def write (self, magic=SampleFile.magic, format_version=SampleFile.format_version, header={ 'name' : 'test' }):
+        writer = SectionWriter ()
+        writer.add_strings ('words', 'word_offsets', [ '', 'alpha', 'beta', 'gamma', 'zeta', 'ğlü' ])
+        writer.add_array ('numbers', [ 0, 1, 2 ** 32 - 1 ])
+        writer.add_array ('flat', writer.add_lists ('index', [ [ 1, 2 ], [], [ 3 ] ]))
+        return writer.write (self.path, magic, format_version, header)
+
+    def test_round_trip (self):
+        header = self.write ()
+        mapped = SampleFile (self.path)
+        self.assertEqual (mapped.header, header)
+        self.assertEqual (mapped.header['name'], 'test')
+        self.assertEqual ([ mapped.string ('words', 'word_offsets', i) for i in range (6) ],
+                          [ '', 'alpha', 'beta', 'gamma', 'zeta', 'ğlü' ])
+        self.assertEqual (list (mapped.sections['numbers']), [ 0, 1, 2 ** 32 - 1 ])
+        self.assertEqual (list (mapped.sections['index']), [ 0, 2, 2, 3 ])
+        self.assertEqual (list (mapped.sections['flat']), [ 1, 2, 3 ])
+        for name, (offset, length, typecode) in mapped.header['sections'].items ():
+            self.assertEqual (offset % 8, 0, name)
+        self.assertEqual (read_header (self.path)['name'], 'test')
+
+    def test_lookup (self):
+        self.write ()
+        mapped = SampleFile (self.path)
+        for i, word in enumerate ([ '', 'alpha', 'beta', 'gamma', 'zeta', 'ğlü' ]):
+            self.assertEqual (mapped.lookup ('words', 'word_offsets', word), i)
+        self.assertIsNone (mapped.lookup ('words', 'word_offsets', 'delta'))
+        self.assertIsNone (mapped.lookup ('words', 'word_offsets', 'zzz'))
+        self.assertEqual (mapped.find ('words', 'word_offsets', 'delta'), 3)
+
+    def test_large_header (self):
+        """ A header bigger than the space first reserved for it still leaves the sections readable. """
+        self.write (header={ 'name' : 'test', 'padding' : 'x' * 10000 })
+        mapped = SampleFile (self.path)
+        self.assertEqual (len(mapped.header['padding']), 10000)
+        self.assertEqual (mapped.string ('words', 'word_offsets', 5), 'ğlü')
+
+    def test_rejects_other_files (self):
+        self.write (magic=b'GTOTHER.')
+        self.assertRaises (MappedFileError, SampleFile, self.path)
+        self.write (format_version=1)
+        with self.assertRaisesRegex (MappedFileError, 'Rebuild'):
+            SampleFile (self.path)
+        with open (self.path, 'wb') as stream:
+            stream.write (b'GT')
+        self.assertRaises (MappedFileError, SampleFile, self.path)
+        self.assertRaises (MappedFileError, read_header, self.path)
+
+    def test_replace (self):
+        """ A file rebuilt while mapped is replaced, not overwritten, so the old mapping stays intact. """
+        self.write ()
+        old = SampleFile (self.path)
+        self.write (header={ 'name' : 'new' })
+        new = SampleFile (self.path)
+        self.assertEqual (old.header['name'], 'test')
+        self.assertEqual (old.string ('words', 'word_offsets', 1), 'alpha')
+        self.assertEqual (new.header['name'], 'new')
+        self.assertNotEqual (old.inode, new.inode)
+
+class TestBuildLock(unittest.TestCase):
+
+    def setUp (self):
+        self.directory = tempfile.mkdtemp ()
+        self.path = os.path.join (self.directory, 'test.mapped')
+
+    def tearDown (self):
+        shutil.rmtree (self.directory)
+
+    def test_exclusive (self):
+        lock = BuildLock (self.path)
+        self.assertTrue (lock.acquire (wait=False))
+        self.assertFalse (BuildLock (self.path).acquire (wait=False))
+        lock.release ()
+        with BuildLock (self.path):
+            self.assertFalse (BuildLock (self.path).acquire (wait=False))
+        self.assertTrue (BuildLock (self.path).acquire (wait=False))
+
+    def test_waits (self):
+        lock = BuildLock (self.path)
+        lock.acquire ()
+        threading.Timer (0.2, lock.release).start ()
+        start = time.time ()
+        self.assertTrue (BuildLock (self.path, poll=0.05).acquire ())
+        self.assertGreaterEqual (time.time () - start, 0.15)
+
+    def test_stale (self):
+        BuildLock (self.path).acquire ()
+        past = time.time () - 100
+        os.utime (self.path + '.lock', (past, past))
+        self.assertFalse (BuildLock (self.path, stale=1000).acquire (wait=False))
+        self.assertTrue (BuildLock (self.path, stale=10).acquire (wait=False))
+
+class TestCrosswalk(unittest.TestCase):
+
+    rows = [ 'DOID\tPharosID\tName', 'DOID:1,doid:2\tP1\tone', 'DOID:1\tP2\tone', '\tP3\tnone', 'DOID:3\tP1', 'short' ]
+
+    def setUp (self):
+        self.directory = tempfile.mkdtemp ()
+        self.source = os.path.join (self.directory, 'map.txt')
+        with open (self.source, 'w') as stream:
+            stream.write ('\n'.join (self.rows) + '\n')
+        self.cache_dir = crosswalk.cache_dir
+        crosswalk.cache_dir = os.path.join (self.directory, 'cache')
+        crosswalk.crosswalks.clear ()
+
+    def tearDown (self):
+        crosswalk.cache_dir = self.cache_dir
+        crosswalk.crosswalks.clear ()
+        shutil.rmtree (self.directory)
+
+    def check (self, walk):
+        self.assertEqual (walk.get ('DOID:1'), [ 'P1', 'P2' ])
+        self.assertEqual (walk.get ('DOID:2'), [ 'P1' ])
+        self.assertEqual (walk.get ('doid:2'), [])
+        self.assertEqual (walk.get_batch ([ 'DOID:3', 'DOID:4' ]), [ [ 'P1' ], [] ])
+        self.assertEqual (walk.get_inverse ('P1'), [ 'DOID:1', 'DOID:2', 'DOID:3' ])
+        self.assertEqual (walk.get_inverse ('P3'), [])
+
+    def test_read_pairs (self):
+        self.assertEqual (list (read_pairs (self.source, 'DOID', 'PharosID', split=',', upper=True)),
+                          [ ('DOID:1', 'P1'), ('DOID:2', 'P1'), ('DOID:1', 'P2'), ('DOID:3', 'P1') ])
+
+    def test_build (self):
+        path = os.path.join (self.directory, 'map.xwalk')
+        build_crosswalk (path, read_pairs (self.source, 'DOID', 'PharosID', split=',', upper=True))
+        self.check (Crosswalk (path))
+        self.check (MemoryCrosswalk (read_pairs (self.source, 'DOID', 'PharosID', split=',', upper=True)))
+
+    def test_get_crosswalk (self):
+        walk = get_crosswalk (self.source, 'DOID', 'PharosID', split=',', upper=True)
+        self.check (walk)
+        self.assertEqual (os.path.dirname (walk.path), self.directory)
+        self.assertIs (get_crosswalk (self.source, 'DOID', 'PharosID', split=',', upper=True), walk)
+        crosswalk.crosswalks.clear ()
+        self.assertEqual (get_crosswalk (self.source, 'DOID', 'PharosID', split=',', upper=True).inode, walk.inode)
+        crosswalk.crosswalks.clear ()
+        self.assertEqual (get_crosswalk (self.source, 'DOID', 'PharosID', split=',').get ('DOID:2'), [])
+
+    def test_rebuilds_when_source_changes (self):
+        walk = get_crosswalk (self.source, 'DOID', 'PharosID', split=',', upper=True)
+        with open (self.source, 'a') as stream:
+            stream.write ('DOID:9\tP9\n')
+        later = time.time () + 10
+        os.utime (self.source, (later, later))
+        crosswalk.crosswalks.clear ()
+        self.assertEqual (get_crosswalk (self.source, 'DOID', 'PharosID', split=',', upper=True).get ('DOID:9'), [ 'P9' ])
+
+    def test_unwritable (self):
+        """ Where the source's directory can't take the crosswalk, it goes in the cache directory, and
+        where neither can, in memory. A directory in the crosswalk's place stands in for a read only one. """
+        os.mkdir (os.path.join (self.directory, 'map.txt.DOID-PharosID.xwalk'))
+        walk = get_crosswalk (self.source, 'DOID', 'PharosID', split=',', upper=True)
+        self.check (walk)
+        self.assertEqual (os.path.dirname (walk.path), crosswalk.cache_dir)
+        crosswalk.crosswalks.clear ()
+        crosswalk.cache_dir = os.path.join (self.source, 'cache')
+        walk = get_crosswalk (self.source, 'DOID', 'PharosID', split=',', upper=True)
+        self.assertIsInstance (walk, MemoryCrosswalk)
+        self.check (walk)
+
+    def test_missing_source (self):
+        self.assertRaises (OSError, get_crosswalk, os.path.join (self.directory, 'nope.txt'), 'DOID', 'PharosID')
+
+chemicals = [
+    '# ChemicalName\tChemicalID\tCasRN\tDefinition\tParentIDs\tTreeNumbers\tParentTreeNumbers\tSynonyms',
+    'Aspirin\tMESH:D001241\t50-78-2\t\t\t\t\tAcetylsalicylic Acid|ASA',
+    'Caffeine\tMESH:D002110\t58-08-2\t\t\t\t\tGuaranine|ASA',
+    'Water\tMESH:D014867'
+]
+interactions = [
+    '# ChemicalName\tChemicalID\tCasRN\tGeneSymbol\tGeneID\tGeneForms\tOrganism\tOrganismID\tInteraction\tInteractionActions\tPubMedIDs',
+    'Aspirin\tD001241\t50-78-2\tPTGS1\t5742\tprotein\tHomo sapiens\t9606\tx\tdecreases^activity\t111|222',
+    'Aspirin\tD001241\t50-78-2\tPTGS2\t5743\tprotein\tHomo sapiens\t9606\tx\tdecreases^activity|affects^binding\t333',
+    'Aspirin\tD001241\t50-78-2\tPtgs2\t19225\tprotein\tMus musculus\t10090\tx\tdecreases^activity\t444',
+    'Caffeine\tD002110\t58-08-2\tADORA1\t134\tprotein\tHomo sapiens\t9606\tx\taffects^binding'
+]
+
+class Handler(SimpleHTTPRequestHandler):
+    """ Serve files with an ETag, answering If-None-Match, and count the requests. """
+
+    requests = []
+
+    def send_head (self):
+        Handler.requests.append (self.command)
+        path = self.translate_path (self.path)
+        stat = os.stat (path)
+        etag = '"{0}-{1}"'.format (stat.st_mtime, stat.st_size)
+        if self.headers.get ('If-None-Match', None) == etag:
+            self.send_response (304)
+            self.end_headers ()
+            return None
+        self.send_response (200)
+        self.send_header ('Content-Length', str (stat.st_size))
+        self.send_header ('ETag', etag)
+        self.end_headers ()
+        return open (path, 'rb')
+
+    def log_message (self, *args):
+        pass
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class Response:
+    """ Enough of a streamed response for stream_lines: data in chunks of size. """
+    def __init__(self, data, size=7):
+        self.raw = self
+        self.data = data
+        self.size = size
+        self.url = 'test'
+    def stream (self, amount, decode_content=False):
+        for i in range (0, len(self.data), self.size):
+            yield self.data[i:i + self.size]
+
+class TestCTD(unittest.TestCase):
+
+    @classmethod
+    def setUpClass (cls):
+        cls.directory = tempfile.mkdtemp ()
+        cls.files = os.path.join (cls.directory, 'files')
+        os.mkdir (cls.files)
+        cls.write ()
+        handler = functools.partial (Handler, directory=cls.files) if 'directory' in Handler.__init__.__code__.co_varnames else Handler
+        cls.server = Server (('127.0.0.1', 0), handler)
+        threading.Thread (target=cls.server.serve_forever, daemon=True).start ()
+
+    @classmethod
+    def tearDownClass (cls):
+        cls.server.shutdown ()
+        cls.server.server_close ()
+        shutil.rmtree (cls.directory)
+
+    @classmethod
+    def write (cls, extra=[]):
+        for name, lines in (('CTD_chemicals.tsv', chemicals), ('CTD_chem_gene_ixns.tsv', interactions + extra)):
+            with gzip.open (os.path.join (cls.files, name + '.gz'), 'wt') as stream:
+                stream.write ('\n'.join (lines) + '\n')
+
+    def setUp (self):
+        self.ctd = CTD (ServiceContext.create_context ())
+        self.ctd.url = 'http://127.0.0.1:{0}'.format (self.server.server_port)
+        self.ctd.store_path = os.path.join (self.directory, 'ctd.store')
+        if os.path.exists (self.ctd.store_path):
+            os.remove (self.ctd.store_path)
+        Handler.requests = []
+        self.cwd = os.getcwd ()
+        os.chdir (self.files)
+
+    def tearDown (self):
+        os.chdir (self.cwd)
+
+    def check (self, store):
+        self.assertEqual (store.get_interactions ('Aspirin'), [
+            ('NCBIGENE:5742', [ 'decreases^activity' ], [ '111', '222' ]),
+            ('NCBIGENE:5743', [ 'decreases^activity', 'affects^binding' ], [ '333' ]) ])
+        self.assertEqual (store.get_interactions ('Caffeine'), [ ('NCBIGENE:134', [ 'affects^binding' ], []) ])
+        self.assertEqual (store.get_interactions ('Water'), [])
+        self.assertEqual (store.get_chemicals ('aspirin'), [ 'Aspirin' ])
+        self.assertEqual (store.get_chemicals ('asa'), [ 'Aspirin', 'Caffeine' ])
+        self.assertEqual (store.get_chemicals ('tea'), [])
+
+    def test_build_store (self):
+        build_store (self.ctd.store_path, chemicals, interactions, header={ 'sources' : {} })
+        store = CTDStore (self.ctd.store_path)
+        self.check (store)
+        self.assertEqual (store.header['counts'], { 'chemicals' : 2, 'interactions' : 3, 'names' : 6 })
+
+    def test_stream_lines (self):
+        first = gzip.compress (b'one\ntwo\n')
+        second = gzip.compress (b'three\nfour')
+        self.assertEqual (list (self.ctd.stream_lines (Response (first + second))), [ 'one', 'two', 'three', 'four' ])
+        self.assertEqual (list (self.ctd.stream_lines (Response (first + b'\0\0\0' + second + b'\0', size=3))),
+                          [ 'one', 'two', 'three', 'four' ])
+        with self.assertRaises (EOFError):
+            list (self.ctd.stream_lines (Response ((first + second)[:-4])))
+        with self.assertRaises (EOFError):
+            list (self.ctd.stream_lines (Response (b'')))
+
+    def test_refresh (self):
+        self.assertTrue (self.ctd.refresh (force=True))
+        self.assertEqual (Handler.requests, [ 'GET', 'GET' ])
+        self.check (self.ctd.store)
+        Handler.requests = []
+        self.assertFalse (self.ctd.refresh ())
+        self.assertEqual (Handler.requests, [ 'HEAD', 'HEAD' ])
+        time.sleep (0.01)
+        self.write (extra=[ 'Water\tD014867\t7732-18-5\tAQP1\t358\tprotein\tHomo sapiens\t9606\tx\taffects^transport\t555' ])
+        Handler.requests = []
+        self.assertTrue (self.ctd.refresh ())
+        self.assertEqual (Handler.requests, [ 'HEAD', 'GET', 'GET' ])
+        self.assertEqual (self.ctd.store.get_interactions ('Water'), [ ('NCBIGENE:358', [ 'affects^transport' ], [ '555' ]) ])
+        self.write ()
+
+    def test_truncated_download (self):
+        """ A download cut short fails the refresh and leaves the store as it was. """
+        self.ctd.refresh (force=True)
+        inode = os.stat (self.ctd.store_path).st_ino
+        stream_lines = self.ctd.stream_lines
+        def truncated (response):
+            yield next (stream_lines (response))
+            raise EOFError ('truncated')
+        self.ctd.stream_lines = truncated
+        self.assertRaises (EOFError, self.ctd.refresh, force=True)
+        self.assertEqual (os.stat (self.ctd.store_path).st_ino, inode)
+        self.assertFalse (os.path.exists (self.ctd.store_path + '.lock'))
+
+    def test_store (self):
+        """ The store is built on first use, by one process at a time, and picked up by the others. """
+        self.check (self.ctd.store)
+        self.assertEqual (Handler.requests, [ 'GET', 'GET' ])
+        other = CTD (ServiceContext.create_context ())
+        other.url = self.ctd.url
+        other.store_path = self.ctd.store_path
+        other.check_interval = 0
+        store = other.store
+        self.ctd.refresh (force=True)
+        self.assertIsNot (other.store, store)
+        self.check (other.store)
+        with BuildLock (self.ctd.store_path):
+            Handler.requests = []
+            self.assertFalse (other.refresh (wait=False))
+            self.assertEqual (Handler.requests, [])
+
+    def test_stale_store (self):
+        """ A store older than refresh_ttl is checked against CTD in the background. """
+        self.ctd.store
+        self.ctd.refresh_ttl = 0
+        self.ctd.checked = 0
+        Handler.requests = []
+        self.ctd.store
+        self.ctd.refresh_thread.join ()
+        self.assertEqual (Handler.requests, [ 'HEAD', 'HEAD' ])
+
+if __name__ == '__main__':
+    unittest.main ()
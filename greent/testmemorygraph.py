@@ -0,0 +1,144 @@
+import json
+import random
+import unittest
+
+try:
+    from greent.graph import TypeGraph
+    from greent.memory_graph import MemoryTypeGraph
+except ImportError:
+    TypeGraph = MemoryTypeGraph = None
+
+concept_metadata = {
+    'NameDisease' : [ 'NAME.DISEASE' ],
+    'Disease'     : [ 'DOID', 'MONDO', 'MESH.DISEASE' ],
+    'Gene'        : [ 'HGNC', 'NCBIGENE', 'UNIPROT' ],
+    'Pathway'     : [ 'KEGG', 'REACT' ],
+    'Substance'   : [ 'CHEBI', 'PUBCHEM', 'DRUGBANK' ]
+}
+
+query = """MATCH (a{{name:"{0}"}}),(b:{1}), p = allShortestPaths((a)-[*]->(b))
+           WHERE NONE (r IN relationships(p) WHERE type(r)='UNKNOWN')
+           RETURN p"""
+
+class Neo4jPaths:
+    """ The transitions the Neo4j TypeGraph would hold after the same calls to add_edge, and the rows it
+    returns for a path query, found by trying every path of each length in turn. Concept nodes and the
+    is_a and translation relationships are left out: no path through them can end at a type. """
+
+    def __init__(self):
+        self.types = {}
+        self.edges = []
+
+    def add_edge (self, a, b, rel_name, predicate, op):
+        for name in (a, b):
+            self.types.setdefault (name, { 'name' : name, 'iri' : None })
+        if predicate != 'UNKNOWN' and not any (e[:3] == (a, b, rel_name) and e[3]['op'] == op for e in self.edges):
+            self.edges.append ((a, b, rel_name, {
+                'predicate' : predicate, 'op' : op, 'enabled' : True, 'synonym' : predicate == 'SYNONYM' }))
+
+    def get_rows (self, source, concept):
+        targets = [ t for t in concept_metadata[concept] if t in self.types and t != source ]
+        shortest = {}
+        rows = []
+        paths = [ ([ source ], [ self.types[source] ]) ] if source in self.types else []
+        for length in range (1, len(self.types)):
+            paths = [ (names + [ b ], path + [ properties, self.types[b] ])
+                      for names, path in paths
+                      for a, b, rel_name, properties in self.edges
+                      if a == names[-1] and rel_name != 'UNKNOWN' and not b in names ]
+            for names, path in paths:
+                if names[-1] in targets and shortest.setdefault (names[-1], length) == length:
+                    rows.append ([ path ])
+        return rows
+
+def make_transitions (seed, count=60):
+    """ Random transitions between the types of concept_metadata, some of them unknown, some synonyms, and
+    some pairs of types joined by more than one operator. """
+    rand = random.Random (seed)
+    types = [ t for instances in concept_metadata.values () for t in instances ]
+    transitions = []
+    for i in range (count):
+        a = 'NAME.DISEASE' if i % 10 == 0 else rand.choice (types)
+        b = rand.choice (types)
+        predicate = rand.choice ([ 'affects', 'treats', 'SYNONYM', 'UNKNOWN' ])
+        transitions.append ((a, b, predicate, predicate, 'op_{0}'.format (rand.randint (0, count // 2))))
+    return transitions
+
+def normalize (programs):
+    return sorted (json.dumps (program, sort_keys=True) for program in programs)
+
+@unittest.skipUnless (MemoryTypeGraph, "the Neo4j client is not installed")
+class TestMemoryTypeGraph(unittest.TestCase):
+    """ The in-memory type graph compiles the same programs as the Neo4j one would. """
+
+    def make_graphs (self, transitions):
+        graph = MemoryTypeGraph (None)
+        graph.set_concept_metadata (concept_metadata)
+        neo4j = Neo4jPaths ()
+        for transition in transitions:
+            graph.add_edge (*transition)
+            neo4j.add_edge (*transition)
+        return graph, neo4j
+
+    def check (self, graph, neo4j):
+        for source in sorted (neo4j.types):
+            for concept in sorted (concept_metadata):
+                self.assertEqual (normalize (graph.get_transitions (query.format (source, concept))),
+                                  normalize (TypeGraph.compile_programs (neo4j.get_rows (source, concept))),
+                                  (source, concept))
+
+    def test_programs (self):
+        for seed in range (5):
+            graph, neo4j = self.make_graphs (make_transitions (seed))
+            self.check (graph, neo4j)
+
+    def test_alternatives (self):
+        """ Every operator on every shortest path is kept, and nothing goes through an unknown transition. """
+        graph, neo4j = self.make_graphs ([
+            ('NAME.DISEASE', 'DOID', 'SYNONYM', 'SYNONYM', 'lookup'),
+            ('DOID', 'HGNC', 'affects', 'affects', 'doid_to_hgnc'),
+            ('DOID', 'HGNC', 'affects', 'affects', 'doid_to_hgnc_2'),
+            ('DOID', 'MONDO', 'SYNONYM', 'SYNONYM', 'doid_to_mondo'),
+            ('MONDO', 'NCBIGENE', 'affects', 'affects', 'mondo_to_ncbigene'),
+            ('NAME.DISEASE', 'UNIPROT', 'UNKNOWN', 'UNKNOWN', 'unknown'),
+            ('NAME.DISEASE', 'KEGG', 'affects', 'affects', 'name_to_kegg'),
+            ('KEGG', 'UNIPROT', 'affects', 'affects', 'kegg_to_uniprot') ])
+        programs = graph.get_transitions (query.format ('NAME.DISEASE', 'Gene'))
+        self.assertEqual (normalize (programs), normalize (TypeGraph.compile_programs (neo4j.get_rows ('NAME.DISEASE', 'Gene'))))
+        self.assertEqual (len(programs), 4)
+        self.assertIn ([
+            { 'node_type' : 'NAME.DISEASE', 'ops' : [ { 'link' : 'SYNONYM', 'op' : 'lookup' } ], 'collector' : [] },
+            { 'node_type' : 'DOID', 'ops' : [ { 'link' : 'affects', 'op' : 'doid_to_hgnc_2' } ], 'collector' : [] } ],
+                       programs)
+        self.assertNotIn ('unknown', json.dumps (programs))
+
+    def test_changes (self):
+        """ Programs are compiled again after the graph changes, and callers get their own copy. """
+        graph, neo4j = self.make_graphs (make_transitions (7))
+        before = graph.get_transitions (query.format ('NAME.DISEASE', 'Pathway'))
+        before.append ('changed')
+        self.assertNotIn ('changed', graph.get_transitions (query.format ('NAME.DISEASE', 'Pathway')))
+        for transition in [ ('NAME.DISEASE', 'REACT', 'affects', 'affects', 'direct'),
+                            ('NAME.DISEASE', 'REACT', 'affects', 'affects', 'direct') ]:
+            graph.add_edge (*transition)
+            neo4j.add_edge (*transition)
+        after = graph.get_transitions (query.format ('NAME.DISEASE', 'Pathway'))
+        self.assertIn ([ { 'node_type' : 'NAME.DISEASE', 'ops' : [ { 'link' : 'affects', 'op' : 'direct' } ], 'collector' : [] } ],
+                       after)
+        self.check (graph, neo4j)
+
+    def test_version (self):
+        transitions = make_transitions (3)
+        first, neo4j = self.make_graphs (transitions)
+        second, neo4j = self.make_graphs (list (reversed (transitions)))
+        self.assertEqual (first.get_version (), second.get_version ())
+        second.add_edge ('DOID', 'KEGG', 'affects', 'affects', 'new')
+        self.assertNotEqual (first.get_version (), second.get_version ())
+
+    def test_unsupported_query (self):
+        graph, neo4j = self.make_graphs ([])
+        self.assertRaises (ValueError, graph.get_transitions, 'MATCH (a) RETURN a')
+        self.assertEqual (graph.get_transitions (query.format ('NAME.DISEASE', 'Gene')), [])
+
+if __name__ == '__main__':
+    unittest.main ()
@@ -0,0 +1,208 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import networkx as nx
+from greent.ontologies import ClosureIndex
+from greent.ontologies import LabelIndex
+from greent.ontologies import OntologyRegistry
+from greent.ontologies import XrefIndex
+from greent.snapshot import OntologySnapshot
+from greent.snapshot import SnapshotError
+from greent.snapshot import build_snapshot
+
+try:
+    from ontobio.ontol import Ontology
+    from ontobio.ontol import Synonym
+except ImportError:
+    Ontology = None
+
+def make_graph (size, back_edges, seed):
+    """ A random ontology-like graph, with an edge from each parent to its child. Back edges, each from a
+    term to one of its ancestors, and a self loop, make cycles. """
+    rand = random.Random (seed)
+    terms = [ 'TEST:{0:04d}'.format (i) for i in range (size) ]
+    parents = [ [] ] + [ rand.sample (range (i), min (i, rand.randint (1, 2))) for i in range (1, size) ]
+    graph = nx.MultiDiGraph ()
+    graph.add_nodes_from (terms)
+    for i in range (1, size):
+        for parent in parents[i]:
+            graph.add_edge (terms[parent], terms[i], pred='subClassOf')
+    for i in range (back_edges):
+        term = ancestor = rand.randrange (1, size)
+        for step in range (rand.randint (1, 4)):
+            if parents[ancestor]:
+                ancestor = rand.choice (parents[ancestor])
+        graph.add_edge (terms[term], terms[ancestor], pred='part_of')
+    graph.add_edge (terms[3], terms[3], pred='part_of')
+    return graph
+
+def make_ontology (size=300, seed=1):
+    """ An ontobio ontology over make_graph, with labels, synonyms and xrefs, some of them shared. """
+    ontology = Ontology (graph=make_graph (size, 20, seed), xref_graph=nx.MultiGraph ())
+    for i, term in enumerate (sorted (ontology.nodes ())):
+        if i % 11:
+            ontology.add_node (term, label='Disease {0}'.format (i))
+        if i % 3 == 0:
+            ontology.add_synonym (Synonym (term, val='Synonym (of) {0}'.format (i)))
+            ontology.add_synonym (Synonym (term, val='Disease {0}'.format (i + 1)))
+        if i % 2 == 0:
+            for xref in [ 'DOID:{0}'.format (i % 50), 'UMLS:C{0}'.format (i) ]:
+                ontology.xref_graph.add_edge (term, xref, source=term)
+    return ontology
+
+class TestClosureIndex(unittest.TestCase):
+
+    def check (self, index, graph, roots):
+        terms = sorted (graph.nodes ())
+        ancestors = { term : nx.ancestors (graph, term) for term in terms }
+        expected = [ [ root for root in roots if root in ancestors[term] ] for term in terms ]
+        self.assertEqual (index.classify (terms, roots), expected)
+        for term in terms[::7]:
+            for root in roots:
+                self.assertEqual (index.is_descendant (term, root), root in ancestors[term])
+
+    def test_acyclic (self):
+        graph = make_graph (500, 0, seed=2)
+        self.check (ClosureIndex.from_graph (graph), graph, sorted (graph.nodes ())[::13])
+
+    def test_cycles (self):
+        graph = make_graph (500, 60, seed=3)
+        components = [ c for c in nx.strongly_connected_components (graph) if len(c) > 1 ]
+        self.assertTrue (components)
+        roots = sorted (graph.nodes ())[::13] + sorted (components[0])
+        self.check (ClosureIndex.from_graph (graph), graph, roots)
+
+    def test_cycle_members (self):
+        """ Terms on a cycle descend from each other, but not from themselves. """
+        graph = nx.MultiDiGraph ()
+        graph.add_edges_from ([ ('A', 'B'), ('B', 'C'), ('C', 'A'), ('C', 'D'), ('E', 'E') ])
+        index = ClosureIndex.from_graph (graph)
+        self.assertTrue (index.is_descendant ('A', 'C'))
+        self.assertTrue (index.is_descendant ('C', 'A'))
+        self.assertTrue (index.is_descendant ('D', 'B'))
+        self.assertFalse (index.is_descendant ('A', 'A'))
+        self.assertFalse (index.is_descendant ('B', 'D'))
+        self.assertFalse (index.is_descendant ('E', 'E'))
+        self.assertEqual (index.classify ([ 'A', 'D', 'E' ], [ 'A', 'B', 'E' ]), [ [ 'B' ], [ 'A', 'B' ], [] ])
+
+    def test_unknown_terms (self):
+        index = ClosureIndex.from_graph (make_graph (50, 5, seed=4))
+        self.assertEqual (index.classify ([ 'NOPE:1', 'TEST:0010' ], [ 'NOPE:2', 'TEST:0000' ]), [ [], [ 'TEST:0000' ] ])
+        self.assertFalse (index.is_descendant ('NOPE:1', 'TEST:0000'))
+        self.assertFalse (index.is_descendant ('TEST:0010', 'NOPE:2'))
+
+    def test_empty (self):
+        index = ClosureIndex.from_graph (nx.MultiDiGraph ())
+        self.assertEqual (index.classify ([ 'A' ], [ 'B' ]), [ [] ])
+
+@unittest.skipUnless (Ontology, "ontobio is not installed")
+class TestIndexes(unittest.TestCase):
+    """ The xref and label indexes answer as the ontobio calls they replace did. """
+
+    @classmethod
+    def setUpClass (cls):
+        cls.ontology = make_ontology ()
+        cls.xrefs = XrefIndex (cls.ontology)
+        cls.labels = LabelIndex (cls.ontology)
+
+    def test_xrefs (self):
+        for term in self.ontology.nodes ():
+            xrefs = self.ontology.xrefs (term)
+            self.assertEqual (sorted (self.xrefs.get_xrefs (term)), sorted (xrefs))
+            self.assertEqual (sorted (self.xrefs.get_xrefs (term, 'DOID:')),
+                              sorted ([ x for x in xrefs if x.startswith ('DOID:') ]))
+            self.assertEqual (self.xrefs.get_xrefs (term, 'DOID'), self.xrefs.get_xrefs (term, 'DOID:'))
+        for xref in [ 'DOID:4', 'DOID:49', 'UMLS:C10', 'UMLS:C11', 'NOPE:1' ]:
+            self.assertEqual (sorted (self.xrefs.get_terms (xref)),
+                              sorted (self.ontology.xrefs (xref, bidirectional=True)))
+
+    def test_search (self):
+        for name in [ 'Disease 5', 'disease 5', 'DISEASE 12', 'Synonym (of) 3', 'synonym (OF) 3',
+                      'Disease 1.', 'Disease 11', 'Nothing like it' ]:
+            self.assertEqual (sorted (self.labels.search (name)),
+                              sorted (self.ontology.search ('(?i)^{0}$'.format (name), synonyms=True, is_regex=True)),
+                              name)
+
+    def test_search_substring (self):
+        for name in [ 'disease 1', 'SYNONYM', '(of) 2', 'se 2', 'ym', '1$', 'zzz' ]:
+            self.assertEqual (sorted (self.labels.search_substring (name)),
+                              sorted (self.ontology.search ('(?i){0}'.format (name), synonyms=True, is_regex=True)),
+                              name)
+
+    def test_literal_lookups (self):
+        self.assertEqual (self.labels.lookup ('Synonym (of) 3'), self.labels.search ('Synonym \\(of\\) 3'))
+        self.assertEqual (sorted (self.labels.lookup_substring ('(OF) 3')),
+                          sorted (self.labels.search_substring ('\\(of\\) 3')))
+
+    def test_search_fuzzy (self):
+        term, score = self.labels.search_fuzzy ('Disease 12x')[0]
+        self.assertEqual (self.ontology.label (term), 'Disease 12')
+        self.assertEqual (self.labels.search_fuzzy ('qqq'), [])
+
+@unittest.skipUnless (Ontology, "ontobio is not installed")
+class TestSnapshot(unittest.TestCase):
+    """ A snapshot answers as the ontobio ontology it was built from. """
+
+    @classmethod
+    def setUpClass (cls):
+        cls.directory = tempfile.mkdtemp ()
+        cls.ontology = make_ontology (seed=5)
+        cls.path = os.path.join (cls.directory, 'test.snapshot')
+        cls.header = build_snapshot (cls.ontology, cls.path, 'test', '2017-12-01', source='test')
+        cls.snapshot = OntologySnapshot (cls.path)
+
+    @classmethod
+    def tearDownClass (cls):
+        shutil.rmtree (cls.directory)
+
+    def test_header (self):
+        self.assertEqual (self.snapshot.name, 'test')
+        self.assertEqual (self.snapshot.version, '2017-12-01')
+        self.assertEqual (self.header['counts']['nodes'], len(self.ontology.nodes ()))
+
+    def test_terms (self):
+        self.assertEqual (sorted (self.snapshot.nodes ()), sorted (self.ontology.nodes ()))
+        for term in list (self.ontology.nodes ()) + [ 'NOPE:1' ]:
+            self.assertEqual (self.snapshot.has_node (term), term in self.ontology.nodes ())
+            self.assertEqual (self.snapshot.label (term), self.ontology.label (term))
+            if term in self.ontology.nodes ():
+                self.assertEqual (self.snapshot.synonyms (term), [ s.val for s in self.ontology.synonyms (term) ])
+                self.assertEqual (sorted (self.snapshot.parents (term)), sorted (set (self.ontology.parents (term))))
+                self.assertEqual (sorted (self.snapshot.ancestors (term)), sorted (self.ontology.ancestors (term)))
+            self.assertEqual (sorted (self.snapshot.xrefs (term)), sorted (self.ontology.xrefs (term)))
+        for xref in [ 'DOID:4', 'UMLS:C10', 'NOPE:1' ]:
+            self.assertEqual (sorted (self.snapshot.xrefs (xref, bidirectional=True)),
+                              sorted (self.ontology.xrefs (xref, bidirectional=True)))
+
+    def test_search (self):
+        for term, options in [ ('Disease 3', {}), ('disease 3', {}), ('Disease 4', { 'synonyms' : True }),
+                               ('Synonym (of) 3', {}), ('Synonym (of) 3', { 'synonyms' : True }),
+                               ('Syn%3', { 'synonyms' : True }), ('Disease 1%', {}), ('%', {}),
+                               ('(?i)^disease 12$', { 'is_regex' : True }), ('x*', { 'is_regex' : True }),
+                               ('TEST:0001', {}) ]:
+            self.assertEqual (sorted (self.snapshot.search (term, **options)),
+                              sorted (self.ontology.search (term, **options)), (term, options))
+
+    def test_indexes (self):
+        """ The registry builds a snapshot's closure index from its sections and shares its label index. """
+        registry = OntologyRegistry ()
+        registry.get ('test', loader=lambda: self.snapshot)
+        closure = registry.get_closure ('test')
+        graph = self.ontology.get_graph ()
+        terms = sorted (graph.nodes ())
+        roots = terms[::17]
+        self.assertEqual (closure.classify (terms, roots),
+                          [ [ root for root in roots if root in nx.ancestors (graph, term) ] for term in terms ])
+        self.assertIs (registry.get_labels ('test'), self.snapshot.get_label_index ())
+
+    def test_not_a_snapshot (self):
+        path = os.path.join (self.directory, 'bad.snapshot')
+        with open (path, 'wb') as stream:
+            stream.write (b'not a snapshot at all')
+        with self.assertRaises (SnapshotError):
+            OntologySnapshot (path)
+
+if __name__ == '__main__':
+    unittest.main ()
@@ -1,4 +1,3 @@
-import requests
 import json
 from greent.service import Service
 from greent.service import ServiceContext
@@ -25,7 +24,7 @@ class TranslatorKnowledgeBeaconAggregator(Service):
             url = '{0}/concepts?keywords={1}&semanticGroups=DISO'.format (self.url, keyword)
         else:
             url = '{0}/concepts?keywords={1}'.format (self.url, keyword)
-        return requests.get (url).json ()
+        return self.http_get (url).json ()
 
     def name_to_doid (self, name):
         result = []
@@ -1,6 +1,5 @@
 import json
 import logging
-import requests
 import traceback
 import re
 import os
@@ -32,6 +31,10 @@ def defaultdict_to_regular(d):
 
 class TranslatorRegistry(Service):
     """ Interact with Translator services. """
+
+    # The Rosetta whose vocabulary results are converted to curies with.
+    rosetta = None
+
     def __init__(self, context):
         """ Read the Translator Registry root document. For each listed API, read its
             metadata. Then consider each path, parameter, and output in detail, regisgtering
@@ -41,7 +44,6 @@ class TranslatorRegistry(Service):
         super(TranslatorRegistry, self).__init__("transreg", context)
         self.verbose = True #False
         self.punctuation = re.compile('[ \./:]+')
-        self.rosetta = None
         
         # Use cached model
         self.op_map = Resource.get_resource_obj ("transreg.yml", format='yaml')
@@ -52,14 +54,14 @@ class TranslatorRegistry(Service):
         # Dynamically generate model
         self.op_map = defaultdict(lambda:defaultdict(lambda:defaultdict(None)))
         url = "{0}/API_LIST.yml".format (self.url)
-        registry = yaml.load (requests.get (url).text)
+        registry = yaml.load (self.http_get (url).text)
         apis = {}
         for context in registry['APIs']:
             metadata = context['metadata']
             api_name = metadata.split (os.sep)[0].replace (" ","")
             logger.debug ("API: {}".format (api_name))
             api_url = "{0}/{1}".format (self.url, metadata)
-            model = yaml.load (requests.get (api_url).text)
+            model = yaml.load (self.http_get (api_url).text)
             servers = model.get('servers', [])
             server = None
             if isinstance(servers,list) and len(servers) > 0:
@@ -84,7 +86,7 @@ class TranslatorRegistry(Service):
                             json_ld_url = success_response.get('x-JSONLDContext',None)
                             json_ld = {}
                             if json_ld_url:
-                                json_ld = requests.get(json_ld_url).json ()
+                                json_ld = self.http_get(json_ld_url).json ()
 
                             for response_value in success_response.get('x-responseValueType',{}):
                                 out_type = response_value['valueType']
@@ -105,7 +107,15 @@ class TranslatorRegistry(Service):
             yaml.dump (vanilla_op_map, stream, default_flow_style=False)
 
     def set_rosetta (self, rosetta):
-        self.rosetta = rosetta
+        TranslatorRegistry.rosetta = rosetta
+
+    @staticmethod
+    def subscribe (rosetta, subscriptions):
+        """ Define the methods invoking subscriptions saved by an earlier process, dicts of their method
+        metadata, without loading the registry. """
+        TranslatorRegistry.rosetta = rosetta
+        for subscription in subscriptions:
+            TranslatorRegistry.define_method (subscription['api'], MethodMetadata (**subscription))
         
     def path_to_method_name (self, path):
         return path.replace ("{","").replace ("}","").replace ("?","/").replace ("=","_").replace ("/","_")
@@ -125,7 +135,7 @@ class TranslatorRegistry(Service):
 
             """ Parameterize and execute the HTTP request. """
             url = Template (service_metadata.get_url).render (input=v)
-            response = requests.get (url).json ()
+            response = self.http_get (url).json ()
             
             """ Expand the context with JSON-LD """
             jsonld_context = json.loads (json.dumps (service_metadata.jsonld),
@@ -203,8 +213,13 @@ class TranslatorRegistry(Service):
     def add_method (self, cls, api, method_metadata):
         """ Dynamically create a method on this object to invoke a particular API. """
         method_metadata.op = self.get_method_name (api, method_metadata)
-        
-        """ Create the new method. Pass its metadata along in each invocation. """
+        TranslatorRegistry.define_method (api, method_metadata, cls)
+        return method_metadata.op
+
+    @staticmethod
+    def define_method (api, method_metadata, cls=None):
+        """ Create the method named method_metadata.op. Pass its metadata along in each invocation. """
+        cls = cls if cls else TranslatorRegistry
         def new_method(self, v):
             """ A dynamically created method to perform a translation. """
             return self.get (api, v, method_metadata)
@@ -213,7 +228,6 @@ class TranslatorRegistry(Service):
         new_method.__doc__ = "convert from {0} to {1}".format (method_metadata.in_type, method_metadata.out_type)
         new_method.__name__ = method_metadata.op
         setattr(cls, new_method.__name__, new_method)
-        return method_metadata.op
     
     def get_subscriptions (self):
         """ Provide enough information to subscribe translator services as part of the Rosetta translation scheme.
@@ -231,6 +245,7 @@ class TranslatorRegistry(Service):
                     predicate = semantics.get (api,{}).get (in_curie,{}).get (out_curie,{}).get ("link", None)
                     path      = semantics.get (api,{}).get (in_curie,{}).get (out_curie,{}).get ("path", None)
                     method_metadata = MethodMetadata (
+                        api       = api,
                         in_type   = in_type,
                         out_type  = out_type,
                         in_curie  = in_curie,
@@ -244,7 +259,8 @@ class TranslatorRegistry(Service):
 class MethodMetadata:
     """ Metadata about a method dynamically discovered from the translator registry and 
     attached to a TranslatorRegistry instance. """
-    def __init__(self, in_type, out_type, in_curie, out_curie, predicate, path, op=None):
+    def __init__(self, in_type, out_type, in_curie, out_curie, predicate, path, op=None, api=None):
+        self.api = api
         self.in_type = in_type
         self.out_type = out_type
         self.in_curie = in_curie